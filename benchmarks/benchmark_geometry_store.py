@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from shapely.geometry import shape
+from shapely.prepared import prep
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.geometry_store import GeometryStore
+from common.region_registry import region_registry
+
+"""
+Notes:
+
+Compares loading the district geometry of every country the cold way (json.load and
+shape() on every feature, as the scripts used to) against loading it from the binary
+geometry cache. Both paths end with prepared geometries so the comparison is like for like.
+The cache is built in a temporary directory which is removed afterwards.
+"""
+
+def main():
+
+  num_iterations, countries = extract_arguments()
+
+  cache_dir = tempfile.mkdtemp(prefix="geometry_store_")
+
+  try:
+    for country in countries:
+      geojson_filepath = region_registry.geojson_filepath(country)
+      size_mb = os.path.getsize(geojson_filepath) / (1 << 20)
+
+      json_latencies = []
+      for idx in range(0, num_iterations):
+        start = time.perf_counter()
+        load_geojson_cold(geojson_filepath)
+        json_latencies.append(time.perf_counter() - start)
+
+      # Build the cache outside of the timed section
+      GeometryStore(cache_dir).load_districts(geojson_filepath)
+
+      cache_latencies = []
+      for idx in range(0, num_iterations):
+        # A new store every time so the in-memory copy isn't reused
+        store = GeometryStore(cache_dir)
+        start = time.perf_counter()
+        store.load_districts(geojson_filepath)
+        cache_latencies.append(time.perf_counter() - start)
+
+      json_median = statistics.median(json_latencies) * 1000
+      cache_median = statistics.median(cache_latencies) * 1000
+
+      print(f"{country} ({size_mb:.1f} MB):")
+      print(f"  json + shape: {json_median:.2f} ms")
+      print(f"  wkb cache:    {cache_median:.2f} ms")
+      print(f"  speedup:      {json_median/cache_median:.1f}x")
+  finally:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+def extract_arguments() -> tuple:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: num_iterations - The number of loads to time per country
+          countries - The countries to load
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-n", "--num-iterations", type=int, default=10, help="The number of loads to time per country")
+  parser.add_argument("-c", "--countries", type=str, nargs="+", default=None, help="The countries to load (defaults to every registered country)")
+
+  args = parser.parse_args()
+
+  if args.num_iterations <= 0:
+    print("The number of iterations must be positive")
+    sys.exit(-1)
+
+  countries = args.countries if args.countries is not None else region_registry.countries()
+  for country in countries:
+    if region_registry.has_country(country) is False:
+      print(f"Cannot fetch coordinate info from internal database for {country}")
+      sys.exit(-1)
+
+  return args.num_iterations, countries
+
+def load_geojson_cold(geojson_filepath: str) -> list:
+  with open(geojson_filepath, "r") as geo_file:
+    geodata = json.load(geo_file)
+
+  return [prep(shape(feature["geometry"])) for feature in geodata["features"]]
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,128 @@
+import argparse
+import os
+import sys
+import time
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+
+MAP_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map_data")
+
+# A mix of the queries the map and analysts issue against the API
+API_QUERIES = [
+  "/api/districts?year=2000",
+  "/api/districts?year=2014&metric=cases",
+  "/api/districts?country=Pakistan",
+  "/api/districts?start_year=1995&end_year=2005&metric=temperature",
+  "/api/districts?country=Serbia&district=Kosovski%20okrug",
+  "/api/years"
+]
+
+"""
+Notes:
+
+By default the benchmark drives the flask app in process through its test client,
+which measures the handler throughput of a single worker without any network
+overhead. Pass --url to load test a running server instead.
+"""
+
+def main():
+
+  num_requests, url, concurrency = extract_arguments()
+
+  if url is None:
+    elapsed = run_in_process(num_requests=num_requests)
+  else:
+    elapsed = run_against_server(url=url, num_requests=num_requests, concurrency=concurrency)
+
+  print(f"Requests: {num_requests}")
+  print(f"Elapsed: {elapsed:.3f} s")
+  print(f"Throughput: {num_requests/elapsed:.1f} requests/second")
+
+def extract_arguments():
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: num_requests - The number of requests to issue
+          url - The base url of a running server (None to benchmark in process)
+          concurrency - The number of concurrent clients when hitting a server
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-n", "--num-requests", type=int, default=10000, help="The number of requests to issue")
+  parser.add_argument("-u", "--url", type=str, required=False, help="The base url of a running server e.g. http://127.0.0.1:5000")
+  parser.add_argument("-c", "--concurrency", type=int, default=8, help="The number of concurrent clients when load testing a server")
+
+  args = parser.parse_args()
+
+  if args.num_requests <= 0 or args.concurrency <= 0:
+    print("The number of requests and the concurrency must be positive")
+    sys.exit(-1)
+
+  return args.num_requests, args.url, args.concurrency
+
+def run_in_process(num_requests: int) -> float:
+  """
+  Purpose: Issues the API queries through the flask test client
+
+  Input: num_requests - The number of requests to issue
+
+  Output: The elapsed time in seconds
+  """
+
+  # The app resolves its data files relative to the map_data directory
+  os.chdir(MAP_DATA_DIR)
+  sys.path.append(MAP_DATA_DIR)
+  from main import app
+
+  client = app.test_client()
+  headers = {"Accept-Encoding" : "gzip"}
+
+  # Warm the response cache so we measure the steady state
+  for query in API_QUERIES:
+    client.get(query, headers=headers)
+
+  start = time.perf_counter()
+  for idx in range(0, num_requests):
+    response = client.get(API_QUERIES[idx % len(API_QUERIES)], headers=headers)
+    if response.status_code != 200:
+      print(f"Unexpected status code {response.status_code} for {API_QUERIES[idx % len(API_QUERIES)]}")
+      sys.exit(-1)
+
+  return time.perf_counter() - start
+
+def run_against_server(url: str, num_requests: int, concurrency: int) -> float:
+  """
+  Purpose: Load tests a running server with concurrent clients
+
+  Input: url - The base url of the server
+         num_requests - The number of requests to issue
+         concurrency - The number of concurrent clients
+
+  Output: The elapsed time in seconds
+  """
+
+  def fetch(idx: int) -> int:
+    req = urllib.request.Request(
+      f"{url.rstrip('/')}{API_QUERIES[idx % len(API_QUERIES)]}",
+      headers={"Accept-Encoding" : "gzip"}
+    )
+    with urllib.request.urlopen(req) as response:
+      response.read()
+      return response.status
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    statuses = list(executor.map(fetch, range(0, num_requests)))
+  elapsed = time.perf_counter() - start
+
+  failures = len([status for status in statuses if status != 200])
+  if failures > 0:
+    print(f"{failures} requests failed")
+
+  return elapsed
+
+if __name__ == "__main__":
+  main()
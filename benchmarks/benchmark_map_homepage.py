@@ -0,0 +1,94 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+MAP_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map_data")
+
+"""
+Notes:
+
+Measures the latency of selecting a year on the homepage and loading its map (served
+from the render cache once the warm-up has finished) through the flask test client, of
+rendering a year's map from scratch with render_map_html and of create_info_markers on
+its own.
+"""
+
+def main():
+
+  num_iterations = extract_arguments()
+
+  # The app resolves its data files relative to the map_data directory
+  os.chdir(MAP_DATA_DIR)
+  sys.path.append(MAP_DATA_DIR)
+  import folium
+  from main import app, create_info_markers, marker_index, map_render_cache, render_map_html
+
+  years = sorted(marker_index.frames_by_year.keys())
+
+  # Measure the steady state once every year has been pre-rendered
+  map_render_cache.wait_until_warm()
+
+  client = app.test_client()
+  homepage_latencies = []
+  for idx in range(0, num_iterations):
+    year = years[idx % len(years)]
+    start = time.perf_counter()
+    response = client.post("/", data={"year" : year})
+    map_response = client.get("/map")
+    homepage_latencies.append(time.perf_counter() - start)
+
+    if response.status_code != 200 or map_response.status_code != 200:
+      print(f"Unexpected status code {response.status_code}/{map_response.status_code} for {year}")
+      sys.exit(-1)
+
+  render_latencies = []
+  for idx in range(0, num_iterations):
+    start = time.perf_counter()
+    render_map_html(year=years[idx % len(years)])
+    render_latencies.append(time.perf_counter() - start)
+
+  marker_latencies = []
+  for idx in range(0, num_iterations):
+    folium_map = folium.Map(location=(34.00, 63.00), zoom_start=4)
+    start = time.perf_counter()
+    create_info_markers(year=years[idx % len(years)], folium_map=folium_map)
+    marker_latencies.append(time.perf_counter() - start)
+
+  print_latencies("POST / + GET /map", homepage_latencies)
+  print_latencies("render_map_html", render_latencies)
+  print_latencies("create_info_markers", marker_latencies)
+
+def extract_arguments() -> int:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: num_iterations - The number of requests to time
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-n", "--num-iterations", type=int, default=50, help="The number of requests to time")
+
+  args = parser.parse_args()
+
+  if args.num_iterations <= 0:
+    print("The number of iterations must be positive")
+    sys.exit(-1)
+
+  return args.num_iterations
+
+def print_latencies(name: str, latencies: list) -> None:
+  latencies_ms = sorted([latency * 1000 for latency in latencies])
+  p95_idx = min(len(latencies_ms) - 1, int(len(latencies_ms) * .95))
+
+  print(f"{name}:")
+  print(f"  mean: {statistics.mean(latencies_ms):.2f} ms")
+  print(f"  p50:  {statistics.median(latencies_ms):.2f} ms")
+  print(f"  p95:  {latencies_ms[p95_idx]:.2f} ms")
+  print(f"  max:  {latencies_ms[-1]:.2f} ms")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARKS_DIR, "..", "data_cleansing"))
+
+SUMMARY_COL = "summary"
+
+DEFAULT_MODELS = ["en_core_web_trf", "en_core_web_md", "en_core_web_sm"]
+DEFAULT_NUM_ARTICLES = 200
+
+# The extracted fields compared against the reference model
+AGREEMENT_FIELDS = {"location_name" : 4, "cases" : 7, "deaths" : 9, "dates_start" : 11}
+
+"""
+Notes:
+
+Compares the spaCy models EpiTator can parse with on the summaries of a summarized (or
+any ProMED) csv: the articles per second of parsing and annotating them, and how often
+each model's extraction (location, cases, deaths and start date) agrees with the first
+model's, which is taken as the reference (en_core_web_trf by default).
+
+EpiTator loads its model when it is imported and can't switch afterwards, so every model
+is run in its own process (this script with --worker) which writes its timings and
+extractions to a temporary json file. The time to load the model is reported apart from
+the time to parse and annotate.
+"""
+
+def main():
+
+  args = extract_arguments()
+
+  if args.worker_model is not None:
+    run_worker(args)
+    return
+
+  results = {}
+  with tempfile.TemporaryDirectory(prefix="spacy_models_") as temp_dir:
+    for model in args.models:
+      output_filepath = os.path.join(temp_dir, f"{model}.json")
+      command = [
+        sys.executable, os.path.abspath(__file__),
+        "-f", args.filepath,
+        "-n", str(args.num_articles),
+        "--batch-size", str(args.batch_size),
+        "--n-process", str(args.n_process),
+        "--worker-model", model,
+        "--worker-output", output_filepath
+      ]
+
+      print(f"Running {model}")
+      completed = subprocess.run(command)
+      if completed.returncode != 0:
+        print(f"  {model} failed (is it installed? python -m spacy download {model})")
+        continue
+
+      with open(output_filepath, "r") as output_file:
+        results[model] = json.load(output_file)
+
+  if len(results) <= 0:
+    return
+
+  reference_model = next(model for model in args.models if model in results)
+  reference = results[reference_model]["extractions"]
+
+  print(f"\nAgreement is measured against {reference_model}")
+  print(f"{'model':<20} {'load (s)':>9} {'articles/s':>11} " + " ".join(f"{field:>14}" for field in AGREEMENT_FIELDS))
+  for model, result in results.items():
+    num_articles = len(result["extractions"])
+    articles_per_s = num_articles / result["duration"] if result["duration"] > 0 else float("inf")
+
+    agreements = []
+    for field in AGREEMENT_FIELDS:
+      matches = sum(1 for extraction, reference_extraction in zip(result["extractions"], reference) if extraction[field] == reference_extraction[field])
+      agreements.append(matches / num_articles if num_articles > 0 else 0)
+
+    print(f"{model:<20} {result['load_duration']:>9.1f} {articles_per_s:>11.2f} " + " ".join(f"{agreement:>14.1%}" for agreement in agreements))
+
+def run_worker(args) -> None:
+  """
+  Purpose: Parses and annotates the summaries with a single model and writes the
+  timings and the extractions to the worker output
+
+  Input: args - The parsed arguments
+
+  Output: None
+  """
+  from epitator_backend import epitator_backend, epitator_extract
+
+  summaries = read_summaries(args.filepath, args.num_articles)
+
+  epitator_backend.configure(model=args.worker_model, batch_size=args.batch_size, n_process=args.n_process)
+  start = time.perf_counter()
+  epitator_backend.load()
+  load_duration = time.perf_counter() - start
+
+  start = time.perf_counter()
+  extractions = []
+  for doc in epitator_backend.parse_docs(summaries):
+    extraction = epitator_extract(doc)
+    extractions.append({field : first_value(extraction[idx]) for field, idx in AGREEMENT_FIELDS.items()})
+  duration = time.perf_counter() - start
+
+  with open(args.worker_output, "w") as output_file:
+    json.dump({"load_duration" : load_duration, "duration" : duration, "extractions" : extractions}, output_file, default=str)
+
+def read_summaries(csv_filepath: str, num_articles: int) -> list:
+  summaries = pd.read_csv(csv_filepath)[SUMMARY_COL].dropna().astype(str)
+  return summaries.head(num_articles).tolist()
+
+def first_value(vals: list):
+  if len(vals) <= 0:
+    return None
+  return str(vals[0])
+
+def extract_arguments():
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: The parsed arguments
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-f", "--filepath", type=str, required=True, help="A csv with a summary column e.g. a summarized promed csv")
+  parser.add_argument("-n", "--num-articles", type=int, default=DEFAULT_NUM_ARTICLES, help="The number of summaries to parse")
+  parser.add_argument("-m", "--models", type=str, nargs="+", default=DEFAULT_MODELS, help="The spaCy models to compare, the first is the reference")
+  parser.add_argument("--batch-size", type=int, default=64, help="The number of texts per nlp.pipe batch")
+  parser.add_argument("--n-process", type=int, default=1, help="The number of processes parsing with spaCy")
+  parser.add_argument("--worker-model", type=str, default=None, help=argparse.SUPPRESS)
+  parser.add_argument("--worker-output", type=str, default=None, help=argparse.SUPPRESS)
+
+  args = parser.parse_args()
+
+  if os.path.isfile(args.filepath) is False:
+    print(f"The filepath: {args.filepath} is not a valid file")
+    sys.exit(-1)
+
+  if args.num_articles <= 0 or args.batch_size <= 0 or args.n_process <= 0:
+    print("The number of articles, the batch size and the number of processes must be positive")
+    sys.exit(-1)
+
+  return args
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,457 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARKS_DIR, "..")
+MAP_DATA_DIR = os.path.join(ROOT_DIR, "map_data")
+HISTORY_FILEPATH = os.path.join(BENCHMARKS_DIR, "results", "history.jsonl")
+
+# The scripts import their sibling modules directly
+sys.path.append(ROOT_DIR)
+for script_dir in ["data_fetching", "data_cleansing", "data_analysis"]:
+  sys.path.append(os.path.join(ROOT_DIR, script_dir))
+
+from synthetic_data import (
+  write_district_geojson, write_cmg_hdf, write_merra2_netcdf, merra2_granule_name, write_promed_csv,
+  MIN_LAT_KEY, MAX_LAT_KEY, MIN_LON_KEY, MAX_LON_KEY
+)
+
+SYNTHETIC_COUNTRY = "synthetica"
+SYNTHETIC_BOUNDS = {
+  MIN_LAT_KEY : 24.0,
+  MAX_LAT_KEY : 36.0,
+  MIN_LON_KEY : 62.0,
+  MAX_LON_KEY : 76.0
+}
+MERRA2_VARIABLES = ["TLML", "PRECTOTCORR"]
+
+# The size of the synthetic inputs at every scale
+SCALES = {
+  "small" : {"districts" : 64, "hdf_granules" : 2, "merra2_granules" : 12, "reports" : 2000},
+  "medium" : {"districts" : 256, "hdf_granules" : 6, "merra2_granules" : 60, "reports" : 20000},
+  "large" : {"districts" : 1024, "hdf_granules" : 12, "merra2_granules" : 240, "reports" : 100000}
+}
+
+BENCHMARK_NAMES = [
+  "hdf_extraction",
+  "netcdf_extraction",
+  "district_assignment",
+  "merra2_yearly_rollup",
+  "cchf_yearly_rollup",
+  "correlation",
+  "map_render"
+]
+
+DEFAULT_REGRESSION_THRESHOLD = .2
+
+"""
+Notes:
+
+Runs every hot path of the pipeline against seeded synthetic inputs (see
+synthetic_data.py) and appends the results to benchmarks/results/history.jsonl
+
+  hdf_extraction - retrieve_country_vegetation_index over the CMG HDF4 granules
+  netcdf_extraction - retrieve_merra2_data + collapse_merra2_data over the MERRA-2 granules
+  district_assignment - correlate_cchf_cases_with_district over the ProMED reports
+  merra2_yearly_rollup - The yearly district averages of the MERRA-2 variables
+  cchf_yearly_rollup - construct_district_cchf_yearly_cases_and_deaths_df
+  correlation - gen_correlation_matrix_for_data with the plots written to the workspace
+  map_render - render_map_html of the map app (building and rendering a year's map)
+
+The inputs are generated into a temporary workspace laid out like the repo (data/geodata,
+data/cache and a working directory next to them) so the scripts' relative paths resolve
+into it. Every benchmark is run once untimed to warm the caches (geometry, area weights
+and the like) and then timed, so the numbers are for the steady state. map_render uses
+the repo's own data since the app loads it when imported.
+
+The benchmarks whose scripts need packages that aren't installed (matplotlib and
+seaborn for the analysis scripts) are recorded as skipped. Every run is compared to
+the last recorded run at the same scale and the benchmarks whose median slowed down by
+more than the regression threshold are reported.
+"""
+
+def main():
+
+  args = extract_arguments()
+
+  workspace_dir = tempfile.mkdtemp(prefix="cchf_benchmarks_")
+  original_dir = os.getcwd()
+
+  results = {}
+  try:
+    # The app loads the district geometry of the real countries when imported so it
+    # has to be imported before the registry is pointed at the synthetic country
+    map_app = None
+    if "map_render" in args.only:
+      map_app = import_map_app()
+
+    print(f"Generating the {args.scale} synthetic inputs in {workspace_dir}")
+    inputs = generate_inputs(workspace_dir, SCALES[args.scale])
+
+    benchmarks = build_benchmarks(inputs, map_app)
+
+    for name in BENCHMARK_NAMES:
+      if name not in args.only:
+        continue
+
+      setup = benchmarks[name]
+      try:
+        run = setup()
+      except ImportError as err:
+        results[name] = {"skipped" : f"missing dependency: {err.name}"}
+        print(f"{name}: skipped ({results[name]['skipped']})")
+        continue
+
+      results[name] = time_benchmark(run, args.num_iterations, inputs["work_dir"])
+      print(f"{name}: median {results[name]['median_s']*1000:.1f} ms, min {results[name]['min_s']*1000:.1f} ms")
+  finally:
+    os.chdir(original_dir)
+    shutil.rmtree(workspace_dir, ignore_errors=True)
+
+  record = {
+    "timestamp" : datetime.datetime.now().isoformat(timespec="seconds"),
+    "commit" : current_commit(),
+    "scale" : args.scale,
+    "num_iterations" : args.num_iterations,
+    "results" : results
+  }
+
+  previous = last_record(args.history, args.scale)
+  regressions = find_regressions(previous, record, args.regression_threshold)
+  append_record(args.history, record)
+
+  print(f"Results appended to {args.history}")
+
+  if previous is None:
+    print(f"No earlier {args.scale} run to compare against")
+  for name, (previous_median, median) in regressions.items():
+    print(f"REGRESSION {name}: {previous_median*1000:.1f} ms -> {median*1000:.1f} ms (was {previous['commit']})")
+
+  if args.fail_on_regression and len(regressions) > 0:
+    sys.exit(1)
+
+def extract_arguments() -> argparse.Namespace:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: The parsed arguments (scale, num_iterations, only, history,
+  regression_threshold and fail_on_regression)
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-s", "--scale", type=str, default="small", choices=list(SCALES.keys()), help="The size of the synthetic inputs")
+  parser.add_argument("-n", "--num-iterations", type=int, default=5, help="The number of timed runs of every benchmark")
+  parser.add_argument("-o", "--only", type=str, nargs="+", default=BENCHMARK_NAMES, choices=BENCHMARK_NAMES, help="The benchmarks to run (defaults to all of them)")
+  parser.add_argument("--history", type=str, default=HISTORY_FILEPATH, help="The JSON lines file the results are appended to")
+  parser.add_argument("--regression-threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD, help="The relative slow down of the median reported as a regression")
+  parser.add_argument("--fail-on-regression", action="store_true", help="Exit with a non zero status when a regression is found")
+
+  args = parser.parse_args()
+
+  if args.num_iterations <= 0:
+    print("The number of iterations must be positive")
+    sys.exit(-1)
+
+  if args.regression_threshold <= 0:
+    print("The regression threshold must be positive")
+    sys.exit(-1)
+
+  return args
+
+def generate_inputs(workspace_dir: str, scale: dict) -> dict:
+  """
+  Purpose: Writes the synthetic inputs of a scale into the workspace
+
+  Input: workspace_dir - The workspace directory
+         scale - The sizes of the inputs (see SCALES)
+
+  Output: A dictionary of the workspace's directories and the generated files
+  """
+  data_dir = os.path.join(workspace_dir, "data")
+  geodata_dir = os.path.join(data_dir, "geodata")
+  cache_dir = os.path.join(data_dir, "cache")
+  granule_dir = os.path.join(workspace_dir, "granules")
+  work_dir = os.path.join(workspace_dir, "work")
+
+  for directory in [geodata_dir, cache_dir, granule_dir, work_dir]:
+    os.makedirs(directory, exist_ok=True)
+
+  write_district_geojson(
+    filepath = os.path.join(geodata_dir, SYNTHETIC_COUNTRY, f"{SYNTHETIC_COUNTRY}-districts.geojson"),
+    bounds = SYNTHETIC_BOUNDS,
+    num_districts = scale["districts"]
+  )
+
+  hdf_fileinfos = []
+  for idx in range(0, scale["hdf_granules"]):
+    filepath = os.path.join(granule_dir, f"MOD13C2.A2000{idx:03d}.hdf")
+    write_cmg_hdf(filepath, seed=idx)
+    hdf_fileinfos.append((filepath, f"{2000 + idx // 12}.{idx % 12 + 1:02d}.01"))
+
+  merra2_fileinfos = []
+  for idx in range(0, scale["merra2_granules"]):
+    year = 2000 + idx // 12
+    month = idx % 12 + 1
+    filepath = os.path.join(granule_dir, merra2_granule_name(year, month))
+    write_merra2_netcdf(filepath, MERRA2_VARIABLES, seed=idx)
+    merra2_fileinfos.append((filepath, f"{year}-{month:02d}"))
+
+  promed_filepath = os.path.join(workspace_dir, "promed.csv")
+  write_promed_csv(promed_filepath, SYNTHETIC_COUNTRY.capitalize(), SYNTHETIC_BOUNDS, scale["reports"])
+
+  # Point the shared registries at the workspace
+  from common.geometry_store import geometry_store
+  from common.region_registry import region_registry
+  from common.district_ids import district_id_registry
+  import area_weights
+
+  region_registry.geodata_dir = geodata_dir
+  region_registry.cache_dir = os.path.join(cache_dir, "regions")
+  geometry_store.cache_dir = os.path.join(cache_dir, "geometry")
+  area_weights.CACHE_DIR = os.path.join(cache_dir, "area_weights")
+
+  # Give the synthetic districts their own ids, otherwise they all share the unknown id
+  # and the roll-ups time a single group
+  district_id_registry.filepath = os.path.join(data_dir, "district_ids.csv")
+  district_id_registry.build()
+
+  return {
+    "workspace_dir" : workspace_dir,
+    "work_dir" : work_dir,
+    "hdf_fileinfos" : hdf_fileinfos,
+    "merra2_fileinfos" : merra2_fileinfos,
+    "promed_filepath" : promed_filepath
+  }
+
+def build_benchmarks(inputs: dict, map_app) -> dict:
+  """
+  Purpose: Builds the setup function of every benchmark. A setup function imports
+  what the benchmark needs and prepares its inputs (outside of the timed section),
+  returning the function to time
+
+  Input: inputs - The generated inputs (see generate_inputs)
+         map_app - The map app's main module (None when map_render isn't run)
+
+  Output: A dictionary of benchmark name -> setup function
+  """
+  countries = [SYNTHETIC_COUNTRY]
+
+  def setup_hdf_extraction():
+    from fetch_nasa_vegetation_index_data import retrieve_country_vegetation_index
+
+    return lambda: retrieve_country_vegetation_index(fileinfos=inputs["hdf_fileinfos"], countries=countries)
+
+  def setup_netcdf_extraction():
+    from fetch_nasa_merra2_data import retrieve_merra2_data, collapse_merra2_data
+
+    def run():
+      merra2_data = retrieve_merra2_data(fileinfos=inputs["merra2_fileinfos"], variables=MERRA2_VARIABLES)
+      return collapse_merra2_data(merra2_data=merra2_data, countries=countries)
+
+    return run
+
+  def setup_district_assignment():
+    from clean_cchf_cases_per_districts import correlate_cchf_cases_with_district
+
+    promed_df = pd.read_csv(inputs["promed_filepath"])
+    return lambda: correlate_cchf_cases_with_district(promed_df.copy())
+
+  def setup_merra2_yearly_rollup():
+    from fetch_nasa_merra2_data import combine_data_to_be_yearly_average_per_district, variable_column
+
+    merra2_df = merra2_district_df(inputs)
+    columns = [variable_column(variable) for variable in MERRA2_VARIABLES]
+    return lambda: combine_data_to_be_yearly_average_per_district(df=merra2_df, columns=columns)
+
+  def setup_cchf_yearly_rollup():
+    from analyze_district_data_by_year import construct_district_cchf_yearly_cases_and_deaths_df
+
+    district_df = promed_district_df(inputs)
+    return lambda: construct_district_cchf_yearly_cases_and_deaths_df(district_df.copy())
+
+  def setup_correlation():
+    import analyze_district_data_by_year
+    from fetch_nasa_merra2_data import combine_data_to_be_yearly_average_per_district, variable_column
+
+    analyze_district_data_by_year.PLOTS_DIR = os.path.join(inputs["workspace_dir"], "plots")
+
+    columns = [variable_column(variable) for variable in MERRA2_VARIABLES]
+    combined_df = combine_data_to_be_yearly_average_per_district(df=merra2_district_df(inputs), columns=columns)
+    rng = np.random.default_rng(0)
+    combined_df["total cases"] = rng.integers(0, 100, combined_df.shape[0])
+    combined_df["total deaths"] = rng.integers(0, 10, combined_df.shape[0])
+
+    return lambda: analyze_district_data_by_year.gen_correlation_matrix_for_data(
+      combined_data = combined_df.copy(),
+      columns_to_comp = ["total cases", "total deaths"] + columns
+    )
+
+  def setup_map_render():
+    # Time the renders themselves rather than the render cache, after the warm-up
+    map_app.map_render_cache.wait_until_warm()
+    years = list(range(1995, 2021))
+    run_count = [0]
+
+    def run():
+      year = years[run_count[0] % len(years)]
+      run_count[0] += 1
+      map_app.render_map_html(year=year)
+
+    return run
+
+  return {
+    "hdf_extraction" : setup_hdf_extraction,
+    "netcdf_extraction" : setup_netcdf_extraction,
+    "district_assignment" : setup_district_assignment,
+    "merra2_yearly_rollup" : setup_merra2_yearly_rollup,
+    "cchf_yearly_rollup" : setup_cchf_yearly_rollup,
+    "correlation" : setup_correlation,
+    "map_render" : setup_map_render
+  }
+
+def merra2_district_df(inputs: dict) -> pd.DataFrame:
+  """
+  Purpose: Computes (once) the monthly MERRA-2 district values the roll-up and
+  correlation benchmarks start from
+
+  Input: inputs - The generated inputs
+
+  Output: The monthly district values
+  """
+  if "merra2_df" not in inputs:
+    from fetch_nasa_merra2_data import retrieve_merra2_data, collapse_merra2_data
+
+    os.chdir(inputs["work_dir"])
+    with contextlib.redirect_stdout(io.StringIO()):
+      merra2_data = retrieve_merra2_data(fileinfos=inputs["merra2_fileinfos"], variables=MERRA2_VARIABLES)
+      inputs["merra2_df"] = collapse_merra2_data(merra2_data=merra2_data, countries=[SYNTHETIC_COUNTRY])
+
+  return inputs["merra2_df"]
+
+def promed_district_df(inputs: dict) -> pd.DataFrame:
+  """
+  Purpose: Assigns (once) the synthetic ProMED reports their districts, as
+  clean_cchf_cases_per_districts.py does before the analysis
+
+  Input: inputs - The generated inputs
+
+  Output: The reports with a district column (NaN when none was found)
+  """
+  if "promed_district_df" not in inputs:
+    from clean_cchf_cases_per_districts import correlate_cchf_cases_with_district
+
+    with contextlib.redirect_stdout(io.StringIO()):
+      district_df = correlate_cchf_cases_with_district(pd.read_csv(inputs["promed_filepath"]))
+    inputs["promed_district_df"] = district_df.replace({"district" : {"" : np.nan}})
+
+  return inputs["promed_district_df"]
+
+def time_benchmark(run, num_iterations: int, work_dir: str) -> dict:
+  """
+  Purpose: Runs a benchmark once to warm it up and then times it, hiding whatever
+  the benchmark prints
+
+  Input: run - The function to time
+         num_iterations - The number of timed runs
+         work_dir - The directory the benchmark is run from
+
+  Output: A dictionary of the median and minimum run time (in seconds) and the runs
+  """
+  os.chdir(work_dir)
+
+  latencies = []
+  with contextlib.redirect_stdout(io.StringIO()):
+    run()
+    for idx in range(0, num_iterations):
+      start = time.perf_counter()
+      run()
+      latencies.append(time.perf_counter() - start)
+
+  return {
+    "median_s" : statistics.median(latencies),
+    "min_s" : min(latencies),
+    "runs" : num_iterations
+  }
+
+def import_map_app():
+  os.chdir(MAP_DATA_DIR)
+  sys.path.append(MAP_DATA_DIR)
+  with contextlib.redirect_stdout(io.StringIO()):
+    import main
+  return main
+
+def current_commit():
+  try:
+    return subprocess.check_output(
+      ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+    ).decode().strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def last_record(history_filepath: str, scale: str):
+  """
+  Purpose: Finds the last recorded run at a scale
+
+  Input: history_filepath - The history file
+         scale - The scale
+
+  Output: The record (None when there is none)
+  """
+  if os.path.isfile(history_filepath) is False:
+    return None
+
+  previous = None
+  with open(history_filepath, "r") as history_file:
+    for line in history_file:
+      if line.strip() == "":
+        continue
+      record = json.loads(line)
+      if record.get("scale") == scale:
+        previous = record
+
+  return previous
+
+def find_regressions(previous: dict, record: dict, threshold: float) -> dict:
+  """
+  Purpose: Finds the benchmarks whose median slowed down by more than the threshold
+
+  Input: previous - The previous record (or None)
+         record - The current record
+         threshold - The relative slow down reported
+
+  Output: A dictionary of benchmark name -> (previous median, median)
+  """
+  regressions = {}
+  if previous is None:
+    return regressions
+
+  for name, result in record["results"].items():
+    previous_result = previous["results"].get(name, {})
+    if "median_s" not in result or "median_s" not in previous_result:
+      continue
+    if result["median_s"] > previous_result["median_s"] * (1 + threshold):
+      regressions[name] = (previous_result["median_s"], result["median_s"])
+
+  return regressions
+
+def append_record(history_filepath: str, record: dict) -> None:
+  os.makedirs(os.path.dirname(os.path.abspath(history_filepath)), exist_ok=True)
+  with open(history_filepath, "a") as history_file:
+    history_file.write(json.dumps(record) + "\n")
+
+if __name__ == "__main__":
+  main()
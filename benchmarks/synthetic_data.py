@@ -0,0 +1,195 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import netCDF4 as nc
+
+from pyhdf.SD import SD, SDC
+
+MIN_LAT_KEY = "min_lat"
+MAX_LAT_KEY = "max_lat"
+MIN_LON_KEY = "min_lon"
+MAX_LON_KEY = "max_lon"
+
+# The layout of the granules the fetchers read
+CMG_NDVI_SDS = "CMG 0.05 Deg MONTHLY NDVI"
+CMG_SHAPE = (3600, 7200)
+MERRA2_LATS = np.arange(-90, 90.01, .5)
+MERRA2_LONS = np.arange(576) * .625 - 180
+
+PROMED_COLUMNS = [
+  "diseasename", "place", "country", "lat", "lon", "summary", "issue_date", "region/city",
+  "region/city lat", "region/city lon", "cases", "deaths", "total cases", "total deaths"
+]
+
+"""
+Notes:
+
+Generators for the synthetic inputs of the benchmark suite. Everything is seeded so
+the same scale always produces the same files:
+
+  1. District GeoJSONs - A bounding box split into a grid of districts whose edges are
+     jittered and densified so the polygons are about as expensive to test as real ones
+  2. MODIS CMG HDF4 granules - The full 3600 x 7200 NDVI grid the vegetation fetcher reads
+  3. MERRA-2 netCDF4 granules - Global 0.5 x 0.625 degree grids of the variables requested
+  4. ProMED CSVs - Reports with the columns of data/individual_data_sets/CCHF_data/cchf_data.csv
+"""
+
+def write_district_geojson(filepath: str, bounds: dict, num_districts: int, vertices_per_edge: int = 50, seed: int = 0) -> list:
+  """
+  Purpose: Writes a GeoJSON splitting a bounding box into roughly num_districts districts
+
+  Input: filepath - Where to write the GeoJSON
+         bounds - The bounding box of the country
+         num_districts - The number of districts (rounded to a full grid)
+         vertices_per_edge - The vertices along each edge of a district
+         seed - The random seed
+
+  Output: The names of the districts
+  """
+  rng = np.random.default_rng(seed)
+
+  num_rows = max(1, int(np.floor(np.sqrt(num_districts))))
+  num_cols = max(1, int(np.ceil(num_districts / num_rows)))
+
+  lat_edges = np.linspace(bounds[MIN_LAT_KEY], bounds[MAX_LAT_KEY], num_rows + 1)
+  lon_edges = np.linspace(bounds[MIN_LON_KEY], bounds[MAX_LON_KEY], num_cols + 1)
+
+  # Jitter the shared grid corners (not the country's border) so neighbours still tile
+  lat_step = (lat_edges[1] - lat_edges[0]) if num_rows > 0 else 0
+  lon_step = (lon_edges[1] - lon_edges[0]) if num_cols > 0 else 0
+  corner_lats = np.tile(lat_edges[:, None], (1, num_cols + 1))
+  corner_lons = np.tile(lon_edges[None, :], (num_rows + 1, 1))
+  corner_lats[1:-1, 1:-1] += rng.uniform(-.2, .2, (num_rows - 1, num_cols - 1)) * lat_step
+  corner_lons[1:-1, 1:-1] += rng.uniform(-.2, .2, (num_rows - 1, num_cols - 1)) * lon_step
+
+  def edge(start, end):
+    steps = np.linspace(0, 1, vertices_per_edge, endpoint=False)
+    return [[float(start[0] + (end[0] - start[0]) * step), float(start[1] + (end[1] - start[1]) * step)] for step in steps]
+
+  features = []
+  names = []
+  for row in range(0, num_rows):
+    for col in range(0, num_cols):
+      corners = [
+        (corner_lons[row, col], corner_lats[row, col]),
+        (corner_lons[row, col + 1], corner_lats[row, col + 1]),
+        (corner_lons[row + 1, col + 1], corner_lats[row + 1, col + 1]),
+        (corner_lons[row + 1, col], corner_lats[row + 1, col])
+      ]
+      ring = []
+      for idx in range(0, 4):
+        ring.extend(edge(corners[idx], corners[(idx + 1) % 4]))
+      ring.append(ring[0])
+
+      name = f"District {row * num_cols + col + 1}"
+      names.append(name)
+      features.append({
+        "type" : "Feature",
+        "properties" : {"name" : name},
+        "geometry" : {"type" : "Polygon", "coordinates" : [ring]}
+      })
+
+  os.makedirs(os.path.dirname(filepath), exist_ok=True)
+  with open(filepath, "w") as geo_file:
+    json.dump({"type" : "FeatureCollection", "features" : features}, geo_file)
+
+  return names
+
+def write_cmg_hdf(filepath: str, seed: int = 0) -> None:
+  """
+  Purpose: Writes a MODIS CMG style HDF4 file holding a random monthly NDVI grid
+
+  Input: filepath - Where to write the file
+         seed - The random seed
+
+  Output: None
+  """
+  rng = np.random.default_rng(seed)
+
+  hdf_file = SD(filepath, SDC.WRITE | SDC.CREATE | SDC.TRUNC)
+  sds = hdf_file.create(CMG_NDVI_SDS, SDC.INT16, CMG_SHAPE)
+  sds[:] = rng.integers(-2000, 10000, CMG_SHAPE, dtype=np.int16)
+  sds.endaccess()
+  hdf_file.end()
+
+def write_merra2_netcdf(filepath: str, variables: list, num_times: int = 1, seed: int = 0) -> None:
+  """
+  Purpose: Writes a MERRA-2 style netCDF4 granule holding random global grids of the
+  variables specified
+
+  Input: filepath - Where to write the granule
+         variables - The variables to write
+         num_times - The number of time steps in the granule
+         seed - The random seed
+
+  Output: None
+  """
+  rng = np.random.default_rng(seed)
+
+  with nc.Dataset(filepath, "w") as ds:
+    ds.createDimension("time", num_times)
+    ds.createDimension("lat", len(MERRA2_LATS))
+    ds.createDimension("lon", len(MERRA2_LONS))
+
+    ds.createVariable("time", "i4", ("time",))[:] = np.arange(num_times)
+    ds.createVariable("lat", "f8", ("lat",))[:] = MERRA2_LATS
+    ds.createVariable("lon", "f8", ("lon",))[:] = MERRA2_LONS
+
+    shape = (num_times, len(MERRA2_LATS), len(MERRA2_LONS))
+    for variable in variables:
+      ds.createVariable(variable, "f4", ("time", "lat", "lon"), zlib=True)[:] = rng.uniform(0, 1, shape).astype(np.float32)
+
+def merra2_granule_name(year: int, month: int) -> str:
+  return f"MERRA2_100.instM_2d_lfo_Nx.{year}{month:02d}.nc4"
+
+def write_promed_csv(filepath: str, country: str, bounds: dict, num_reports: int, disease: str = "Crimean-Congo Hemorrhagic Fever", seed: int = 0) -> pd.DataFrame:
+  """
+  Purpose: Writes a ProMED style CSV of reports scattered over a country's bounding box
+
+  Input: filepath - Where to write the CSV
+         country - The country of the reports
+         bounds - The bounding box of the country
+         num_reports - The number of reports
+         disease - The disease of the reports
+         seed - The random seed
+
+  Output: The reports written
+  """
+  rng = np.random.default_rng(seed)
+
+  years = rng.integers(1995, 2021, num_reports)
+  months = rng.integers(1, 13, num_reports)
+  days = rng.integers(1, 29, num_reports)
+  cases = rng.integers(1, 50, num_reports)
+  deaths = rng.binomial(cases, .1)
+
+  region_lats = rng.uniform(bounds[MIN_LAT_KEY], bounds[MAX_LAT_KEY], num_reports)
+  region_lons = rng.uniform(bounds[MIN_LON_KEY], bounds[MAX_LON_KEY], num_reports)
+  # Some reports can't be geocoded
+  region_lats[rng.uniform(0, 1, num_reports) < .1] = np.nan
+
+  # Only some reports state the running totals for the year
+  has_totals = rng.uniform(0, 1, num_reports) < .3
+
+  promed_df = pd.DataFrame({
+    "diseasename" : disease,
+    "place" : country,
+    "country" : country,
+    "lat" : (bounds[MIN_LAT_KEY] + bounds[MAX_LAT_KEY]) / 2,
+    "lon" : (bounds[MIN_LON_KEY] + bounds[MAX_LON_KEY]) / 2,
+    "summary" : [f"{case} cases and {death} deaths of {disease} were reported." for case, death in zip(cases, deaths)],
+    "issue_date" : [f"{month}/{day}/{year}" for month, day, year in zip(months, days, years)],
+    "region/city" : [f"City {idx}" for idx in range(0, num_reports)],
+    "region/city lat" : region_lats,
+    "region/city lon" : region_lons,
+    "cases" : cases,
+    "deaths" : deaths,
+    "total cases" : np.where(has_totals, cases * 3, np.nan),
+    "total deaths" : np.where(has_totals, deaths * 3, np.nan)
+  })[PROMED_COLUMNS]
+
+  os.makedirs(os.path.dirname(filepath), exist_ok=True)
+  promed_df.to_csv(filepath, index=False)
+
+  return promed_df
@@ -0,0 +1,3 @@
+"""
+Modules shared by the data fetching, data cleansing, data analysis and map scripts
+"""
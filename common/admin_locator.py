@@ -0,0 +1,377 @@
+import os
+import threading
+import numpy as np
+
+from shapely.geometry import Point, box
+
+# shapely >= 2 can test a whole array of points against a geometry in one call
+try:
+  from shapely import contains_xy, prepare
+except ImportError:
+  contains_xy = None
+  prepare = None
+
+from common.geometry_store import geometry_store
+from common.region_registry import region_registry, bounds_contain, MIN_LAT_KEY, MAX_LAT_KEY, MIN_LON_KEY, MAX_LON_KEY
+
+PROVINCE_LEVEL = "province"
+DISTRICT_LEVEL = "district"
+SUBDISTRICT_LEVEL = "subdistrict"
+
+ADMIN_LEVELS = [PROVINCE_LEVEL, DISTRICT_LEVEL, SUBDISTRICT_LEVEL]
+
+# The grid cells are tested against a unit in blocks of BLOCK_SIZE x BLOCK_SIZE cells
+BLOCK_SIZE = 8
+
+"""
+The admin levels we have geometry for beyond the districts. Every level lists
+
+  file - The file in data/geodata/<country> holding the level (None for the region
+         registry's <country>-districts.geojson)
+  name_property - The property naming a unit
+  parent_property - The property naming the unit's parent in the level above it
+  parent_aliases - Parent names spelled differently from the level above
+  exclude_property / require_property - Leave out the features that have / don't have
+                                        this property (for files that hold several levels)
+"""
+ADMIN_HIERARCHIES = {
+  "pakistan" : {
+    PROVINCE_LEVEL : {
+      "file" : "PAK_adm1.geojson",
+      "name_property" : "NAME_1",
+      "parent_property" : None
+    },
+    DISTRICT_LEVEL : {
+      "file" : None,
+      "name_property" : "name",
+      "parent_property" : "NAME_1"
+    },
+    SUBDISTRICT_LEVEL : {
+      "file" : "PAK_adm3.json",
+      "name_property" : "NAME_3",
+      "parent_property" : "NAME_2"
+    }
+  },
+  # The Afghan district file holds the provinces (without a provinceName) as well
+  "afghanistan" : {
+    PROVINCE_LEVEL : {
+      "file" : None,
+      "name_property" : "name",
+      "parent_property" : None,
+      "exclude_property" : "provinceName"
+    },
+    DISTRICT_LEVEL : {
+      "file" : None,
+      "name_property" : "name",
+      "parent_property" : "provinceName",
+      "require_property" : "provinceName",
+      "parent_aliases" : {
+        "Herat" : "Hirat",
+        "Wardak" : "Maydan Wardak"
+      }
+    }
+  }
+}
+
+"""
+Notes:
+
+Rather than testing a point against every district of a country the locator first finds
+the province containing it and then only tests that province's districts (and then only
+that district's subdistricts). For Pakistan that is at most 8 province polygons and a
+handful of districts instead of all 32 districts. Countries without a hierarchy in
+ADMIN_HIERARCHIES only have the district level.
+
+Every polygon test is preceded by a bounding box test, and if a point falls in a gap
+between the levels (the admin files don't share their borders exactly) every unit of the
+next level is tried so the result is never worse than a flat lookup.
+"""
+
+class AdminLocator:
+  """
+  Purpose: Resolves every admin level (province, district, subdistrict) of points in
+  the countries of the region registry
+
+  Input: registry - The region registry
+  """
+
+  def __init__(self, registry = region_registry):
+    self.registry = registry
+    self.lock = threading.Lock()
+    self.hierarchies = {}
+
+  def locate(self, country: str, lat: float, lon: float) -> dict:
+    """
+    Purpose: Finds the units of every admin level containing a point
+
+    Input: country - The country the point is in
+           lat, lon - The coordinates of the point
+
+    Output: A dictionary of admin level -> unit name (None for the levels the point
+    isn't in or the country has no geometry for)
+    """
+    located = {level : None for level in ADMIN_LEVELS}
+
+    if lat is None or lon is None or np.isnan(lat) or np.isnan(lon):
+      return located
+
+    if bounds_contain(self.registry.country_bounds(country), lat, lon) is False:
+      return located
+
+    point = Point(lon, lat)
+    parent = None
+
+    for level, units in self.load_hierarchy(country):
+      candidates = units
+      if parent is not None and parent["children"] is not None:
+        candidates = parent["children"]
+
+      unit = find_containing_unit(candidates, point, lat, lon)
+      if unit is None and candidates is not units:
+        unit = find_containing_unit(units, point, lat, lon)
+
+      if unit is None:
+        parent = None
+        continue
+
+      located[level] = unit["name"]
+      parent = unit
+
+    return located
+
+  def label_grid(self, country: str, lats: np.ndarray, lons: np.ndarray, level: str = DISTRICT_LEVEL) -> tuple:
+    """
+    Purpose: Works out which unit of an admin level every cell of a regular grid falls
+    in. The cells are first split between the provinces and each province's cells are
+    then only tested against the province's own districts
+
+    Input: country - The country
+           lats - The latitude of each row of the grid
+           lons - The longitude of each column of the grid
+           level - The admin level to label the cells with
+
+    Output: A tuple of (row indexes, column indexes, unit names) arrays with an entry
+    per cell that falls inside a unit of the level
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    hierarchy = self.load_hierarchy(country)
+    levels = [hierarchy_level for hierarchy_level, units in hierarchy]
+    if level not in levels:
+      raise ValueError(f"{country} has no {level} geometry. Expected one of {', '.join(levels)}")
+
+    country_bounds = self.registry.country_bounds(country)
+    rows, cols = np.meshgrid(
+      np.nonzero((lats >= country_bounds[MIN_LAT_KEY]) & (lats <= country_bounds[MAX_LAT_KEY]))[0],
+      np.nonzero((lons >= country_bounds[MIN_LON_KEY]) & (lons <= country_bounds[MAX_LON_KEY]))[0],
+      indexing="ij"
+    )
+    cells = (rows.ravel(), cols.ravel())
+
+    # Each entry is (units to test, cells they can contain)
+    pending = [(hierarchy[0][1], cells)]
+    for hierarchy_level, units in hierarchy:
+      labelled = []
+      leftover_rows = []
+      leftover_cols = []
+      for candidates, (cell_rows, cell_cols) in pending:
+        candidate_labels, candidate_leftovers = label_cells(candidates, lats, lons, cell_rows, cell_cols)
+        labelled.extend(candidate_labels)
+
+        # Cells a parent's children don't cover get a second chance against every unit
+        if candidates is not units and len(candidate_leftovers[0]) > 0:
+          candidate_labels, candidate_leftovers = label_cells(units, lats, lons, *candidate_leftovers)
+          labelled.extend(candidate_labels)
+
+        leftover_rows.append(candidate_leftovers[0])
+        leftover_cols.append(candidate_leftovers[1])
+
+      if hierarchy_level == level:
+        label_rows = [cell_rows for unit, (cell_rows, cell_cols) in labelled]
+        label_cols = [cell_cols for unit, (cell_rows, cell_cols) in labelled]
+        label_names = [np.full(len(cell_rows), unit["name"], dtype=object) for unit, (cell_rows, cell_cols) in labelled]
+        return (
+          np.concatenate(label_rows) if len(label_rows) > 0 else np.array([], dtype=np.intp),
+          np.concatenate(label_cols) if len(label_cols) > 0 else np.array([], dtype=np.intp),
+          np.concatenate(label_names) if len(label_names) > 0 else np.array([], dtype=object)
+        )
+
+      next_units = hierarchy[levels.index(hierarchy_level) + 1][1]
+      pending = []
+      for unit, unit_cells in labelled:
+        pending.append((unit["children"] if unit["children"] is not None else next_units, unit_cells))
+
+      # Cells in the gaps between the units of this level (the admin files don't share
+      # their borders exactly) are tested against every unit of the next level
+      pending.append((next_units, (np.concatenate(leftover_rows), np.concatenate(leftover_cols))))
+
+  def parent_names(self, country: str, level: str = DISTRICT_LEVEL) -> dict:
+    """
+    Purpose: Maps the units of an admin level to the unit of the level above them,
+    e.g. district -> province, so district data can be rolled up
+
+    Input: country - The country
+           level - The admin level whose units should be mapped
+
+    Output: A dictionary of unit name -> parent unit name
+    """
+    parents = {}
+    for hierarchy_level, units in self.load_hierarchy(country):
+      for unit in units:
+        if unit["children"] is None:
+          continue
+        for child in unit["children"]:
+          if child["level"] == level:
+            parents[child["name"]] = unit["name"]
+    return parents
+
+  def load_hierarchy(self, country: str) -> list:
+    """
+    Purpose: Retrieves the admin levels of a country, linking every unit to its children
+
+    Input: country - The country
+
+    Output: A list of (level, units) tuples from the coarsest level to the finest where
+    a unit is a dictionary of its level, name, parent name, geometry, prepared geometry,
+    bounds and children (None for the finest level)
+    """
+    country = country.lower()
+
+    with self.lock:
+      if country not in self.hierarchies:
+        self.hierarchies[country] = build_hierarchy(country, self.registry)
+      return self.hierarchies[country]
+
+def build_hierarchy(country: str, registry) -> list:
+  hierarchy_config = ADMIN_HIERARCHIES.get(country, {
+    DISTRICT_LEVEL : {
+      "file" : None,
+      "name_property" : "name",
+      "parent_property" : None
+    }
+  })
+
+  hierarchy = []
+  for level in ADMIN_LEVELS:
+    if level not in hierarchy_config:
+      continue
+
+    level_config = hierarchy_config[level]
+    if level_config["file"] is None:
+      geojson_filepath = registry.geojson_filepath(country)
+    else:
+      geojson_filepath = os.path.join(registry.geodata_dir, country, level_config["file"])
+
+    parent_property = level_config["parent_property"]
+    parent_aliases = level_config.get("parent_aliases", {})
+    exclude_property = level_config.get("exclude_property")
+    require_property = level_config.get("require_property")
+
+    units = []
+    for feature in geometry_store.load_districts(geojson_filepath):
+      properties = feature["properties"]
+      if prepare is not None:
+        prepare(feature["geometry"])
+      if exclude_property is not None and exclude_property in properties:
+        continue
+      if require_property is not None and require_property not in properties:
+        continue
+
+      parent = properties.get(parent_property) if parent_property is not None else None
+      units.append({
+        "level" : level,
+        "name" : properties.get(level_config["name_property"]),
+        "parent" : parent_aliases.get(parent, parent),
+        "geometry" : feature["geometry"],
+        "prepared" : feature["prepared"],
+        "bounds" : feature["bounds"],
+        "children" : None
+      })
+
+    if len(hierarchy) > 0:
+      parent_units = hierarchy[-1][1]
+      children_by_parent = {}
+      for unit in units:
+        children_by_parent.setdefault(unit["parent"], []).append(unit)
+      for parent_unit in parent_units:
+        parent_unit["children"] = children_by_parent.get(parent_unit["name"], [])
+
+    hierarchy.append((level, units))
+
+  return hierarchy
+
+def find_containing_unit(units: list, point: Point, lat: float, lon: float) -> dict:
+  for unit in units:
+    if bounds_contain(unit["bounds"], lat, lon) and unit["prepared"].contains(point):
+      return unit
+  return None
+
+def label_cells(units: list, lats: np.ndarray, lons: np.ndarray, cell_rows: np.ndarray, cell_cols: np.ndarray) -> list:
+  """
+  Purpose: Splits grid cells between the units containing them. A cell is only tested
+  against the units whose bounds contain it and is assigned to the first one containing it.
+  The candidate cells of a unit are tested in blocks of BLOCK_SIZE x BLOCK_SIZE cells:
+  a block inside the unit (or clear of it) is resolved with a single polygon test and
+  only the cells of blocks straddling the unit's border are tested one by one
+
+  Input: units - The units to test
+         lats, lons - The coordinates of the rows and columns of the grid
+         cell_rows, cell_cols - The cells to split
+
+  Output: A tuple of the list of (unit, (cell rows, cell columns)) tuples and the
+  (cell rows, cell columns) of the cells no unit contains
+  """
+  unassigned = np.ones(len(cell_rows), dtype=bool)
+  cell_lats = lats[cell_rows]
+  cell_lons = lons[cell_cols]
+  cell_blocks = (cell_rows // BLOCK_SIZE) * (len(lons) // BLOCK_SIZE + 1) + (cell_cols // BLOCK_SIZE)
+
+  labelled = []
+  for unit in units:
+    bounds = unit["bounds"]
+    candidates = np.nonzero(
+      unassigned &
+      (cell_lats >= bounds[MIN_LAT_KEY]) & (cell_lats <= bounds[MAX_LAT_KEY]) &
+      (cell_lons >= bounds[MIN_LON_KEY]) & (cell_lons <= bounds[MAX_LON_KEY])
+    )[0]
+    if len(candidates) <= 0:
+      continue
+
+    contained = []
+    order = candidates[np.argsort(cell_blocks[candidates], kind="stable")]
+    block_starts = np.flatnonzero(np.diff(cell_blocks[order], prepend=-1))
+    for block in np.split(order, block_starts[1:]):
+      block_lats = cell_lats[block]
+      block_lons = cell_lons[block]
+      block_box = box(block_lons.min(), block_lats.min(), block_lons.max(), block_lats.max())
+
+      if len(block) > 1 and unit["prepared"].contains(block_box):
+        contained.append(block)
+      elif len(block) == 1 or unit["prepared"].intersects(block_box):
+        contained.append(block[contains_points(unit, block_lats, block_lons)])
+
+    contained = np.concatenate(contained) if len(contained) > 0 else np.array([], dtype=np.intp)
+    if len(contained) <= 0:
+      continue
+
+    contained = np.sort(contained)
+    unassigned[contained] = False
+    labelled.append((unit, (cell_rows[contained], cell_cols[contained])))
+
+  return labelled, (cell_rows[unassigned], cell_cols[unassigned])
+
+def contains_points(unit: dict, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Tests which points fall inside a unit
+
+  Input: unit - The unit
+         lats, lons - The coordinates of the points
+
+  Output: A boolean mask with an entry per point
+  """
+  if contains_xy is not None:
+    return contains_xy(unit["geometry"], lons, lats)
+  return np.array([unit["prepared"].contains(Point(lon, lat)) for lat, lon in zip(lats, lons)], dtype=bool)
+
+admin_locator = AdminLocator()
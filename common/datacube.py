@@ -0,0 +1,360 @@
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+from common.region_registry import ROOT_DIR, file_signature
+from common.district_ids import district_id_registry, DISTRICT_ID_COL
+
+DATACUBE_DIR = os.path.join(ROOT_DIR, "data", "datacube")
+DATACUBE_FILEPATH = os.path.join(DATACUBE_DIR, "district_datacube.dat")
+
+MAGIC = b"CCHFCUBE"
+VERSION = 1
+
+# The header is padded to a page so the array starts page aligned
+HEADER_SIZE = 4096
+DTYPE = np.float32
+
+# MERRA-2 starts in 1980 and the NDVI record in 1981, the cube grows past LAST_YEAR when needed
+FIRST_YEAR = 1979
+LAST_YEAR = 2030
+NUM_MONTHS = 12
+
+# The variables of the cube and how their months add up to a year
+SUM = "sum"
+MEAN = "mean"
+VARIABLES = {
+  "cases" : SUM,
+  "deaths" : SUM,
+  "ndvi" : MEAN,
+  "temperature" : MEAN,
+  "precipitation" : MEAN,
+  "specific_humidity" : MEAN,
+  "soil_wetness" : MEAN
+}
+
+YEAR_COL = "year"
+MONTH_COL = "month"
+
+"""
+Notes:
+
+The datacube holds every monthly district value we have in a single float32 array of
+shape (district id, year, month, variable), with NaN where there is no value. The file
+is a HEADER_SIZE byte header (the magic, the length of the JSON metadata and the JSON
+metadata: shape, first year and variables) followed by the array in C order, so it is
+opened with np.memmap at offset HEADER_SIZE. Lookups and slices are views of the map
+(nothing is read until it is touched) and every process mapping the file shares the
+same pages of the page cache.
+
+The fetchers and clean_cchf_cases_per_districts.py write their monthly values straight
+into the cube. The cube is created on the first write with a row per district of the
+district id registry (see district_ids.py) and the years FIRST_YEAR to LAST_YEAR, and
+is rebuilt larger (rewritten to a temporary file and swapped in) when a write needs
+a district or a year it doesn't have. Readers remap the file when it changed on disk.
+"""
+
+class DistrictDatacube:
+  """
+  Purpose: Reads and writes the memory mapped district datacube
+
+  Input: filepath - The filepath to the datacube
+  """
+
+  def __init__(self, filepath: str = DATACUBE_FILEPATH):
+    self.filepath = filepath
+    self.lock = threading.Lock()
+    self.signature = None
+    self.metadata = None
+    self.cube = None
+
+  def exists(self) -> bool:
+    return os.path.isfile(self.filepath)
+
+  @property
+  def version(self) -> str:
+    # Changes whenever the file is written, for cache keys
+    if self.exists() is False:
+      return ""
+    return "-".join(str(val) for val in file_signature(self.filepath))
+
+  def create(self, num_districts: int, first_year: int = FIRST_YEAR, last_year: int = LAST_YEAR, variables: list = list(VARIABLES.keys())) -> None:
+    """
+    Purpose: Creates an empty (all NaN) datacube, replacing any existing one
+
+    Input: num_districts - The number of district ids
+           first_year - The first year of the cube
+           last_year - The last year of the cube
+           variables - The variables of the cube
+
+    Output: None
+    """
+    metadata = {
+      "version" : VERSION,
+      "dtype" : np.dtype(DTYPE).name,
+      "shape" : [num_districts, last_year - first_year + 1, NUM_MONTHS, len(variables)],
+      "first_year" : first_year,
+      "variables" : list(variables)
+    }
+    self.write_file(self.filepath, metadata, fill=np.nan)
+
+  def write_file(self, filepath: str, metadata: dict, fill: float = None) -> np.memmap:
+    header = encode_header(metadata)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "wb") as cube_file:
+      cube_file.write(header)
+      cube_file.truncate(HEADER_SIZE + int(np.prod(metadata["shape"])) * np.dtype(DTYPE).itemsize)
+
+    cube = np.memmap(filepath, dtype=DTYPE, mode="r+", offset=HEADER_SIZE, shape=tuple(metadata["shape"]))
+    if fill is not None:
+      cube[:] = fill
+      cube.flush()
+    return cube
+
+  def read_metadata(self) -> dict:
+    with open(self.filepath, "rb") as cube_file:
+      return decode_header(cube_file.read(HEADER_SIZE))
+
+  def open(self) -> tuple:
+    """
+    Purpose: Maps the datacube read-only, remapping it when the file changed since it
+    was last mapped
+
+    Input: None
+
+    Output: A (metadata, cube) tuple, where the cube is a read-only np.memmap
+    """
+    if self.exists() is False:
+      raise FileNotFoundError(f"No datacube at {self.filepath}, run one of the fetchers first")
+
+    signature = file_signature(self.filepath)
+    with self.lock:
+      if self.cube is None or signature != self.signature:
+        metadata = self.read_metadata()
+        self.cube = np.memmap(self.filepath, dtype=DTYPE, mode="r", offset=HEADER_SIZE, shape=tuple(metadata["shape"]))
+        self.metadata = metadata
+        self.signature = signature
+      return self.metadata, self.cube
+
+  def ensure_capacity(self, num_districts: int, first_year: int, last_year: int) -> dict:
+    """
+    Purpose: Makes sure the datacube covers the district ids and years, creating it or
+    rebuilding it larger when it doesn't
+
+    Input: num_districts - The number of district ids needed
+           first_year - The first year needed
+           last_year - The last year needed
+
+    Output: The metadata of the datacube
+    """
+    if self.exists() is False:
+      self.create(
+        num_districts = max(num_districts, district_id_count()),
+        first_year = min(first_year, FIRST_YEAR),
+        last_year = max(last_year, LAST_YEAR)
+      )
+      return self.read_metadata()
+
+    metadata = self.read_metadata()
+    old_districts, old_years = metadata["shape"][0], metadata["shape"][1]
+    old_first_year = metadata["first_year"]
+    old_last_year = old_first_year + old_years - 1
+    if num_districts <= old_districts and first_year >= old_first_year and last_year <= old_last_year:
+      return metadata
+
+    new_first_year = min(first_year, old_first_year)
+    new_metadata = {
+      **metadata,
+      "shape" : [max(num_districts, old_districts), max(last_year, old_last_year) - new_first_year + 1, NUM_MONTHS, len(metadata["variables"])],
+      "first_year" : new_first_year
+    }
+
+    temp_filepath = f"{self.filepath}.tmp"
+    new_cube = self.write_file(temp_filepath, new_metadata, fill=np.nan)
+    old_cube = np.memmap(self.filepath, dtype=DTYPE, mode="r", offset=HEADER_SIZE, shape=tuple(metadata["shape"]))
+    year_offset = old_first_year - new_first_year
+    new_cube[:old_districts, year_offset:year_offset + old_years] = old_cube
+    new_cube.flush()
+    del new_cube, old_cube
+
+    # Readers still holding the old map keep reading the old file until they remap
+    os.replace(temp_filepath, self.filepath)
+    return new_metadata
+
+  def write(self, variable: str, district_ids, years, months, values) -> int:
+    """
+    Purpose: Writes monthly values of a variable into the datacube
+
+    Input: variable - The variable (one of VARIABLES)
+           district_ids - The district id of every value
+           years - The year of every value
+           months - The month (1-12) of every value
+           values - The values
+
+    Output: The number of values written (values of unknown districts are skipped)
+    """
+    district_ids = np.asarray(district_ids, dtype=np.int64)
+    years = np.asarray(years, dtype=np.int64)
+    months = np.asarray(months, dtype=np.int64)
+    values = np.asarray(values, dtype=DTYPE)
+
+    known = district_ids >= 0
+    district_ids, years, months, values = district_ids[known], years[known], months[known], values[known]
+    if len(values) <= 0:
+      return 0
+
+    with self.lock:
+      metadata = self.ensure_capacity(int(district_ids.max()) + 1, int(years.min()), int(years.max()))
+      if variable not in metadata["variables"]:
+        raise ValueError(f"Unknown datacube variable: {variable}. Expected one of {', '.join(metadata['variables'])}")
+
+      cube = np.memmap(self.filepath, dtype=DTYPE, mode="r+", offset=HEADER_SIZE, shape=tuple(metadata["shape"]))
+      cube[district_ids, years - metadata["first_year"], months - 1, metadata["variables"].index(variable)] = values
+      cube.flush()
+      del cube
+
+      # Writes through a map don't always update the modification time readers remap on
+      os.utime(self.filepath)
+
+    return len(values)
+
+  def write_frame(self, df: pd.DataFrame, variable_columns: dict, year_col: str = YEAR_COL, month_col: str = MONTH_COL) -> int:
+    """
+    Purpose: Writes the columns of a monthly district table into the datacube
+
+    Input: df - The table, with a district id, a year and a month column
+           variable_columns - A dictionary of column -> datacube variable
+           year_col - The column holding the year
+           month_col - The column holding the month
+
+    Output: The number of values written
+    """
+    if df.shape[0] <= 0:
+      return 0
+
+    district_ids = df[DISTRICT_ID_COL].values
+    years = df[year_col].astype(int).values
+    months = df[month_col].astype(int).values
+
+    written = 0
+    for column, variable in variable_columns.items():
+      if column in df.columns:
+        written += self.write(variable, district_ids, years, months, df[column].values)
+    return written
+
+  def variable_index(self, variable: str) -> int:
+    metadata, cube = self.open()
+    if variable not in metadata["variables"]:
+      raise ValueError(f"Unknown datacube variable: {variable}. Expected one of {', '.join(metadata['variables'])}")
+    return metadata["variables"].index(variable)
+
+  def years(self) -> list:
+    metadata, cube = self.open()
+    return list(range(metadata["first_year"], metadata["first_year"] + metadata["shape"][1]))
+
+  def monthly(self, variable: str) -> np.ndarray:
+    """
+    Purpose: The monthly values of a variable for every district
+
+    Input: variable - The variable
+
+    Output: A (district id, year, month) view of the cube
+    """
+    metadata, cube = self.open()
+    return cube[:, :, :, self.variable_index(variable)]
+
+  def series(self, variable: str, district_id: int) -> np.ndarray:
+    """
+    Purpose: The monthly values of a variable for a district
+
+    Input: variable - The variable
+           district_id - The district id
+
+    Output: A (year, month) view of the cube
+    """
+    metadata, cube = self.open()
+    return cube[district_id, :, :, self.variable_index(variable)]
+
+  def month_values(self, variable: str, year: int, month: int) -> np.ndarray:
+    """
+    Purpose: The values of a variable for every district in a month
+
+    Input: variable - The variable
+           year - The year
+           month - The month (1-12)
+
+    Output: A view of the cube indexed by district id
+    """
+    metadata, cube = self.open()
+    return cube[:, year - metadata["first_year"], month - 1, self.variable_index(variable)]
+
+  def yearly(self, variable: str) -> np.ndarray:
+    """
+    Purpose: The yearly value of a variable for every district and year, the sum or the
+    mean of its months (see VARIABLES) and NaN for a year without any value
+
+    Input: variable - The variable
+
+    Output: A (district id, year) array
+    """
+    monthly = self.monthly(variable)
+    num_values = np.sum(~np.isnan(monthly), axis=2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+      totals = np.nansum(monthly, axis=2)
+      yearly = totals if VARIABLES.get(variable, MEAN) == SUM else totals / num_values
+
+    return np.where(num_values > 0, yearly, np.nan).astype(DTYPE)
+
+  def year_values(self, variable: str, year: int) -> np.ndarray:
+    metadata, cube = self.open()
+    return self.yearly(variable)[:, year - metadata["first_year"]]
+
+  def has_values(self, variable: str) -> bool:
+    if self.exists() is False:
+      return False
+    metadata, cube = self.open()
+    if variable not in metadata["variables"]:
+      return False
+    return bool(np.any(~np.isnan(cube[:, :, :, metadata["variables"].index(variable)])))
+
+  def yearly_frame(self, variable_columns: dict) -> pd.DataFrame:
+    """
+    Purpose: A tidy table of the yearly values of variables
+
+    Input: variable_columns - A dictionary of datacube variable -> column of the table
+
+    Output: A dataframe with a district id, a year and a column per variable, with a row
+    per district and year having a value for any of them
+    """
+    years = np.array(self.years(), dtype=np.int16)
+    yearly = {column : self.yearly(variable) for variable, column in variable_columns.items()}
+    num_districts = len(next(iter(yearly.values()))) if len(yearly) > 0 else 0
+
+    df = pd.DataFrame({
+      DISTRICT_ID_COL : np.repeat(np.arange(num_districts, dtype=np.int16), len(years)),
+      YEAR_COL : np.tile(years, num_districts),
+      **{column : values.ravel() for column, values in yearly.items()}
+    })
+    return df.dropna(subset=list(yearly.keys()), how="all").reset_index(drop=True)
+
+def encode_header(metadata: dict) -> bytes:
+  encoded = json.dumps(metadata).encode("utf-8")
+  header = MAGIC + len(encoded).to_bytes(4, "little") + encoded
+  if len(header) > HEADER_SIZE:
+    raise ValueError(f"The datacube metadata doesn't fit in {HEADER_SIZE} bytes")
+  return header.ljust(HEADER_SIZE, b"\0")
+
+def decode_header(header: bytes) -> dict:
+  if header[:len(MAGIC)] != MAGIC:
+    raise ValueError("Not a datacube file")
+  length = int.from_bytes(header[len(MAGIC):len(MAGIC) + 4], "little")
+  return json.loads(header[len(MAGIC) + 4:len(MAGIC) + 4 + length].decode("utf-8"))
+
+def district_id_count() -> int:
+  registry_df = district_id_registry.load()
+  return int(registry_df[DISTRICT_ID_COL].max()) + 1 if registry_df.shape[0] > 0 else 0
+
+district_datacube = DistrictDatacube()
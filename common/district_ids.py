@@ -0,0 +1,314 @@
+import os
+import re
+import sys
+import unicodedata
+import numpy as np
+import pandas as pd
+
+if __name__ == "__main__":
+  # Run as a script the common package has to be importable from the root of the repo
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from common.region_registry import region_registry, ROOT_DIR, NAME_KEY
+
+DISTRICT_IDS_FILEPATH = os.path.join(ROOT_DIR, "data", "district_ids.csv")
+
+# Columns of the registry csv
+DISTRICT_ID_COL = "district_id"
+COUNTRY_COL = "country"
+DISTRICT_COL = "district"
+ALIASES_COL = "aliases"
+
+ALIAS_SEPARATOR = "|"
+
+# The GeoJSON properties holding other names of a district (GADM separates several with "|")
+ALIAS_PROPERTIES = ["name_alt", "VARname", "NL_name"]
+
+# Suffixes some sources leave off (or add to) a district's name e.g. "Kolubarski okrug"
+DISTRICT_SUFFIXES = ["okrug", "district", "division", "agency"]
+
+# The id of a (country, district) pair the registry doesn't know
+UNKNOWN_DISTRICT_ID = -1
+
+# Columns loaded as categoricals by optimize_dtypes
+CATEGORICAL_COLS = ["diseasename", COUNTRY_COL, DISTRICT_COL, "province"]
+
+NON_ALPHANUMERIC_REGEX = re.compile(r"[\W_]+")
+
+"""
+Notes:
+
+Every (country, district) pair of the district GeoJSONs gets a stable integer id, kept
+in data/district_ids.csv along with the other names the district is known by. The ids
+are assigned in the order of the sorted countries and districts the first time the csv
+is built, and rebuilding it (python common/district_ids.py) keeps every existing id and
+only appends ids for new pairs, so ids written to csvs before stay valid. The fetchers and
+the case cleaner rebuild it themselves (register_missing_districts) when a GeoJSON has
+districts the csv doesn't, so a new country's districts don't all end up with
+UNKNOWN_DISTRICT_ID.
+
+Names are matched after normalization (lower case, accents and punctuation stripped,
+a trailing "okrug"/"district"/... dropped) so "Kolubarski okrug", "Kolubarski" and
+"KOLUBARSKI" are the same district. Joining tables on the id (an int16) instead of the
+country and district strings makes the merges integer joins, and optimize_dtypes loads
+the remaining string columns as categoricals and downcasts the numeric ones.
+"""
+
+class DistrictIdRegistry:
+  """
+  Purpose: Maps (country, district) pairs to stable integer ids and back
+
+  Input: filepath - The filepath to the registry csv
+  """
+
+  def __init__(self, filepath: str = DISTRICT_IDS_FILEPATH):
+    self.filepath = filepath
+    self.registry_df = None
+    self.ids_by_name = None
+
+  def load(self) -> pd.DataFrame:
+    """
+    Purpose: Loads the registry csv, building it from the GeoJSONs when it doesn't exist
+
+    Input: None
+
+    Output: The registry dataframe
+    """
+    if self.registry_df is not None:
+      return self.registry_df
+
+    if os.path.isfile(self.filepath):
+      registry_df = pd.read_csv(self.filepath, dtype={COUNTRY_COL : str, DISTRICT_COL : str, ALIASES_COL : str}, keep_default_na=False)
+    else:
+      registry_df = self.build()
+
+    self.set_registry(registry_df)
+    return self.registry_df
+
+  def set_registry(self, registry_df: pd.DataFrame) -> None:
+    ids_by_name = {}
+    rows = zip(registry_df[DISTRICT_ID_COL].values, registry_df[COUNTRY_COL].values, registry_df[DISTRICT_COL].values, registry_df[ALIASES_COL].values)
+    for district_id, country, district, aliases in rows:
+      country_key = normalize_name(country)
+      names = [district] + [alias for alias in aliases.split(ALIAS_SEPARATOR) if len(alias) > 0]
+      for name in names:
+        for key in name_keys(name):
+          # The canonical names win over the aliases of other districts
+          ids_by_name.setdefault((country_key, key), int(district_id))
+
+    self.registry_df = registry_df
+    self.ids_by_name = ids_by_name
+
+  def build(self) -> pd.DataFrame:
+    """
+    Purpose: Builds the registry from the district GeoJSONs, keeping the ids of the
+    existing csv and appending new ids for the pairs it doesn't have, and saves it
+
+    Input: None
+
+    Output: The registry dataframe
+    """
+    existing = {}
+    if os.path.isfile(self.filepath):
+      existing_df = pd.read_csv(self.filepath, dtype={COUNTRY_COL : str, DISTRICT_COL : str, ALIASES_COL : str}, keep_default_na=False)
+      for district_id, country, district in zip(existing_df[DISTRICT_ID_COL].values, existing_df[COUNTRY_COL].values, existing_df[DISTRICT_COL].values):
+        existing[(country, district)] = int(district_id)
+
+    aliases_by_district = {}
+    for country in region_registry.countries():
+      for feature in region_registry.districts(country):
+        aliases = aliases_by_district.setdefault((country, feature[NAME_KEY]), [])
+        for alias in feature_aliases(feature):
+          if alias != feature[NAME_KEY] and alias not in aliases:
+            aliases.append(alias)
+
+    next_id = max(existing.values(), default=-1) + 1
+    rows = []
+    for country, district in sorted(aliases_by_district.keys()):
+      district_id = existing.get((country, district))
+      if district_id is None:
+        district_id = next_id
+        next_id += 1
+
+      rows.append({
+        DISTRICT_ID_COL : district_id,
+        COUNTRY_COL : country,
+        DISTRICT_COL : district,
+        ALIASES_COL : ALIAS_SEPARATOR.join(aliases_by_district[(country, district)])
+      })
+
+    # Districts no longer in the GeoJSONs keep their ids so old tables still resolve
+    for (country, district), district_id in existing.items():
+      if (country, district) not in aliases_by_district:
+        rows.append({DISTRICT_ID_COL : district_id, COUNTRY_COL : country, DISTRICT_COL : district, ALIASES_COL : ""})
+
+    registry_df = pd.DataFrame(rows, columns=[DISTRICT_ID_COL, COUNTRY_COL, DISTRICT_COL, ALIASES_COL])
+    registry_df = registry_df.sort_values(DISTRICT_ID_COL, ignore_index=True)
+    registry_df.to_csv(self.filepath, index=False)
+
+    self.set_registry(registry_df)
+    return registry_df
+
+  def register_missing_districts(self, countries: list) -> list:
+    """
+    Purpose: Makes sure every district of the GeoJSONs of some countries has an id,
+    rebuilding the registry (which keeps the existing ids) when any of them is missing,
+    e.g. after a new country's GeoJSON was dropped in
+
+    Input: countries - The countries
+
+    Output: The (country, district) pairs that were missing
+    """
+    self.load()
+
+    missing = [
+      (country, feature[NAME_KEY])
+      for country in countries
+      for feature in region_registry.districts(country)
+      if self.district_id(country, feature[NAME_KEY]) == UNKNOWN_DISTRICT_ID
+    ]
+    if len(missing) > 0:
+      print(f"Adding {len(missing)} districts missing from {self.filepath} to it")
+      self.build()
+
+    return missing
+
+  def district_id(self, country: str, district: str) -> int:
+    """
+    Purpose: Looks up the id of a district
+
+    Input: country - The country
+           district - The name (or an alias) of the district
+
+    Output: The id of the district (UNKNOWN_DISTRICT_ID when it isn't known)
+    """
+    self.load()
+
+    if not isinstance(country, str) or not isinstance(district, str):
+      return UNKNOWN_DISTRICT_ID
+
+    country_key = normalize_name(country)
+    for key in name_keys(district):
+      district_id = self.ids_by_name.get((country_key, key))
+      if district_id is not None:
+        return district_id
+
+    return UNKNOWN_DISTRICT_ID
+
+  def district_ids(self, countries, districts) -> np.ndarray:
+    """
+    Purpose: Looks up the ids of many districts, resolving every distinct pair once
+
+    Input: countries - The country of every row
+           districts - The district of every row
+
+    Output: An int16 array of the ids (UNKNOWN_DISTRICT_ID for the unknown ones)
+    """
+    pairs = pd.DataFrame({COUNTRY_COL : np.asarray(countries, dtype=object), DISTRICT_COL : np.asarray(districts, dtype=object)})
+    if pairs.shape[0] <= 0:
+      return np.array([], dtype=np.int16)
+
+    # The groups are numbered in the order the pairs first appear, like drop_duplicates keeps them
+    codes = pairs.groupby([COUNTRY_COL, DISTRICT_COL], dropna=False, sort=False).ngroup().values
+    unique_pairs = pairs.drop_duplicates()
+    unique_ids = np.array([self.district_id(country, district) for country, district in zip(unique_pairs[COUNTRY_COL].values, unique_pairs[DISTRICT_COL].values)], dtype=np.int16)
+    return unique_ids[codes]
+
+  def district_name(self, district_id: int) -> tuple:
+    """
+    Purpose: Looks up the canonical country and name of a district id
+
+    Input: district_id - The id
+
+    Output: The (country, district) tuple (None when the id isn't known)
+    """
+    registry_df = self.load()
+    rows = registry_df[registry_df[DISTRICT_ID_COL] == district_id]
+    if rows.shape[0] <= 0:
+      return None
+    return rows[COUNTRY_COL].iloc[0], rows[DISTRICT_COL].iloc[0]
+
+def normalize_name(name: str) -> str:
+  """
+  Purpose: Normalizes a name for matching: accents and punctuation are stripped, the
+  case is folded and the white space collapsed
+
+  Input: name - The name
+
+  Output: The normalized name
+  """
+  decomposed = unicodedata.normalize("NFKD", name)
+  stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+  return NON_ALPHANUMERIC_REGEX.sub(" ", stripped.casefold()).strip()
+
+def name_keys(name: str) -> list:
+  # The normalized name and, when it has one, the name without its district suffix
+  key = normalize_name(name)
+  keys = [key]
+  for suffix in DISTRICT_SUFFIXES:
+    if key.endswith(f" {suffix}"):
+      keys.append(key[:-len(suffix)-1])
+  return keys
+
+def feature_aliases(feature: dict) -> list:
+  aliases = []
+  for alias_property in ALIAS_PROPERTIES:
+    val = feature["properties"].get(alias_property)
+    if isinstance(val, str):
+      aliases.extend(alias.strip() for alias in val.split(ALIAS_SEPARATOR) if len(alias.strip()) > 0)
+  return aliases
+
+def add_district_id_column(df: pd.DataFrame, country_col: str = COUNTRY_COL, district_col: str = DISTRICT_COL) -> pd.DataFrame:
+  """
+  Purpose: Adds the district id column to a table with country and district columns
+
+  Input: df - The table
+         country_col - The column holding the country
+         district_col - The column holding the district
+
+  Output: The table with a DISTRICT_ID_COL column
+  """
+  df[DISTRICT_ID_COL] = district_id_registry.district_ids(df[country_col].values, df[district_col].values)
+  return df
+
+def optimize_dtypes(df: pd.DataFrame, categorical_cols: list = CATEGORICAL_COLS) -> pd.DataFrame:
+  """
+  Purpose: Loads the repeated string columns as categoricals and downcasts the
+  integer and float columns to the smallest type holding their values
+
+  Input: df - The table
+         categorical_cols - The columns to turn into categoricals (when present)
+
+  Output: The table with the optimized dtypes
+  """
+  for col in df.columns:
+    if col in categorical_cols:
+      df[col] = df[col].astype("category")
+    elif pd.api.types.is_integer_dtype(df[col]):
+      df[col] = pd.to_numeric(df[col], downcast="integer")
+    elif pd.api.types.is_float_dtype(df[col]):
+      df[col] = pd.to_numeric(df[col], downcast="float")
+  return df
+
+def read_district_table(filepath: str, country_col: str = COUNTRY_COL, district_col: str = DISTRICT_COL, **kwargs) -> pd.DataFrame:
+  """
+  Purpose: Reads a district table with optimized dtypes, adding the district id
+  column when the table was written before it existed
+
+  Input: filepath - The filepath to the csv
+         country_col - The column holding the country
+         district_col - The column holding the district
+         kwargs - Passed on to pd.read_csv
+
+  Output: The table
+  """
+  df = pd.read_csv(filepath, **kwargs)
+  if DISTRICT_ID_COL not in df.columns:
+    df = add_district_id_column(df, country_col=country_col, district_col=district_col)
+  return optimize_dtypes(df)
+
+district_id_registry = DistrictIdRegistry()
+
+if __name__ == "__main__":
+  registry_df = district_id_registry.build()
+  print(f"{registry_df.shape[0]} districts saved to {district_id_registry.filepath}")
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+from shapely import wkb
+from shapely.geometry import shape
+from shapely.prepared import prep
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "geometry")
+
+MIN_LAT_KEY = "min_lat"
+MAX_LAT_KEY = "max_lat"
+MIN_LON_KEY = "min_lon"
+MAX_LON_KEY = "max_lon"
+
+FEATURES_KEY = "features"
+GEOMETRY_KEY = "geometry"
+PROPERTIES_KEY = "properties"
+NAME_KEY = "name"
+
+HASH_CHUNK_SIZE = 1 << 20
+
+"""
+Notes:
+
+Parsing a multi-megabyte GeoJSON and building its shapely geometries takes far longer
+than reading the same geometries back as WKB. The store converts each GeoJSON once into
+an uncompressed npz file in data/cache/geometry named after the sha1 of the GeoJSON,
+holding the columns
+
+  wkb - The WKB of every feature concatenated into a single byte array
+  offsets - Where each feature's WKB starts (with a final entry for the end)
+  bounds - A (num features x 4) array of min_lon, min_lat, max_lon, max_lat
+  names - The name of every feature
+  properties - The JSON encoded properties of every feature
+
+Editing a GeoJSON changes its hash so a stale cache is never read.
+"""
+
+class GeometryStore:
+  """
+  Purpose: Loads the features of GeoJSONs through the binary geometry cache, keeping the
+  features of every GeoJSON loaded in memory for the life of the process
+
+  Input: cache_dir - The directory the binary geometry files are kept in
+  """
+
+  def __init__(self, cache_dir: str = CACHE_DIR):
+    self.cache_dir = cache_dir
+    self.lock = threading.Lock()
+    self.features_by_filepath = {}
+
+  def load_districts(self, geojson_filepath: str) -> list:
+    """
+    Purpose: Retrieves the parsed features of a GeoJSON, converting it into the binary
+    cache the first time it is seen
+
+    Input: geojson_filepath - The filepath to the GeoJSON
+
+    Output: A list of dictionaries (one per feature) holding the feature's name,
+    properties, shapely geometry, prepared geometry and bounding box
+    """
+    key = (os.path.abspath(geojson_filepath), file_signature(geojson_filepath))
+
+    with self.lock:
+      if key not in self.features_by_filepath:
+        self.features_by_filepath[key] = features_from_columns(self.load_columns(geojson_filepath))
+      return self.features_by_filepath[key]
+
+  def load_columns(self, geojson_filepath: str) -> dict:
+    """
+    Purpose: Reads the binary columns of a GeoJSON, building the cache file if needed
+
+    Input: geojson_filepath - The filepath to the GeoJSON
+
+    Output: A dictionary of the wkb, offsets, bounds, names and properties columns
+    """
+    cache_filepath = self.cache_filepath(geojson_filepath)
+
+    if os.path.isfile(cache_filepath) is False:
+      columns = build_geometry_columns(geojson_filepath)
+
+      os.makedirs(self.cache_dir, exist_ok=True)
+      # Write to a temporary file first so a crash can't leave a truncated cache behind
+      temp_filepath = f"{cache_filepath}.{os.getpid()}.tmp.npz"
+      np.savez(temp_filepath, **columns)
+      os.replace(temp_filepath, cache_filepath)
+
+      return columns
+
+    with np.load(cache_filepath, allow_pickle=False) as cached:
+      return {name : cached[name] for name in cached.files}
+
+  def cache_filepath(self, geojson_filepath: str) -> str:
+    return os.path.join(self.cache_dir, f"{compute_source_hash(geojson_filepath)}.npz")
+
+def build_geometry_columns(geojson_filepath: str) -> dict:
+  """
+  Purpose: Parses a GeoJSON into the columns of the binary cache
+
+  Input: geojson_filepath - The filepath to the GeoJSON
+
+  Output: A dictionary of the wkb, offsets, bounds, names and properties columns
+  """
+  with open(geojson_filepath, "r") as geo_file:
+    geodata = json.load(geo_file)
+
+  features = []
+  if FEATURES_KEY in geodata:
+    features = geodata[FEATURES_KEY]
+  elif GEOMETRY_KEY in geodata:
+    features = [geodata]
+
+  wkbs = []
+  bounds = []
+  names = []
+  properties = []
+  for feature in features:
+    try:
+      geometry = shape(feature[GEOMETRY_KEY])
+    except ValueError:
+      geometry = shape(drop_degenerate_rings(feature[GEOMETRY_KEY]))
+    wkbs.append(geometry.wkb)
+    bounds.append(geometry.bounds)
+    names.append(feature[PROPERTIES_KEY].get(NAME_KEY, ""))
+    properties.append(json.dumps(feature[PROPERTIES_KEY]))
+
+  offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+  offsets[1:] = np.cumsum([len(geometry_wkb) for geometry_wkb in wkbs])
+
+  return {
+    "wkb" : np.frombuffer(b"".join(wkbs), dtype=np.uint8),
+    "offsets" : offsets,
+    "bounds" : np.array(bounds, dtype=np.float64).reshape(-1, 4),
+    "names" : np.array(names, dtype=str),
+    "properties" : np.array(properties, dtype=str)
+  }
+
+def drop_degenerate_rings(geometry: dict) -> dict:
+  """
+  Purpose: Removes the rings with fewer than 4 coordinates (zero area slivers some of
+  the admin GeoJSONs contain) which shapely refuses to build polygons from
+
+  Input: geometry - A GeoJSON Polygon or MultiPolygon geometry
+
+  Output: The geometry without the degenerate rings
+  """
+  MIN_RING_LENGTH = 4
+
+  def clean_polygon(rings):
+    if len(rings) <= 0 or len(rings[0]) < MIN_RING_LENGTH:
+      return None
+    return [rings[0]] + [ring for ring in rings[1:] if len(ring) >= MIN_RING_LENGTH]
+
+  if geometry["type"] == "Polygon":
+    rings = clean_polygon(geometry["coordinates"])
+    return {"type" : "Polygon", "coordinates" : rings if rings is not None else []}
+
+  if geometry["type"] == "MultiPolygon":
+    polygons = [clean_polygon(polygon) for polygon in geometry["coordinates"]]
+    return {"type" : "MultiPolygon", "coordinates" : [polygon for polygon in polygons if polygon is not None]}
+
+  return geometry
+
+def features_from_columns(columns: dict) -> list:
+  """
+  Purpose: Rebuilds the parsed features from the binary columns
+
+  Input: columns - The columns of the binary cache
+
+  Output: A list of dictionaries holding the name, properties, geometry, prepared
+  geometry and bounding box of each feature
+  """
+  wkb_bytes = columns["wkb"].tobytes()
+  offsets = columns["offsets"]
+
+  features = []
+  for idx, (name, feature_properties, bounds) in enumerate(zip(columns["names"], columns["properties"], columns["bounds"])):
+    geometry = wkb.loads(wkb_bytes[offsets[idx]:offsets[idx + 1]])
+    min_lon, min_lat, max_lon, max_lat = [float(val) for val in bounds]
+    features.append({
+      NAME_KEY : str(name),
+      "properties" : json.loads(str(feature_properties)),
+      "geometry" : geometry,
+      "prepared" : prep(geometry),
+      "bounds" : {
+        MIN_LAT_KEY : min_lat,
+        MAX_LAT_KEY : max_lat,
+        MIN_LON_KEY : min_lon,
+        MAX_LON_KEY : max_lon
+      }
+    })
+
+  return features
+
+def compute_source_hash(filepath: str) -> str:
+  source_hash = hashlib.sha1()
+  with open(filepath, "rb") as source_file:
+    for chunk in iter(lambda: source_file.read(HASH_CHUNK_SIZE), b""):
+      source_hash.update(chunk)
+  return source_hash.hexdigest()
+
+def file_signature(filepath: str) -> tuple:
+  stat = os.stat(filepath)
+  return (stat.st_size, stat.st_mtime_ns)
+
+geometry_store = GeometryStore()
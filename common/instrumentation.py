@@ -0,0 +1,274 @@
+import argparse
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+# The resource module is only available on unix
+try:
+  import resource
+except ImportError:
+  resource = None
+
+REPORTS_DIR_NAME = "run_reports"
+
+# The number of functions / allocation sites kept per stage in the report
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+BYTES_PER_MB = 1 << 20
+
+"""
+Notes:
+
+The run profiler is shared by the pipeline scripts. A script wraps its main in
+run_profiler.run() and each step of it in run_profiler.stage(), and the functions doing
+the work count what they process (granules, pixels, articles, rows, ...) with
+run_profiler.count(). Stages can be nested, and a count is added to every stage it
+happened in as well as to the run's totals.
+
+Every stage records its wall and CPU time and the peak RSS of the process when it ended.
+With --profile every top level stage is also run under cProfile (saved as a .prof file
+and summarized in the report) and every stage records the memory it allocated through
+tracemalloc, along with the lines allocating the most. Both slow the run down noticeably
+so they are opt-in.
+
+When the run ends (or fails) a JSON report is written to a run_reports directory next
+to the script's outputs, named after the script and the time the run started, so runs
+can be compared over time. Outside of run() stage() and count() do nothing, so the
+instrumented functions cost nothing when imported by other code.
+"""
+
+class RunProfiler:
+  """
+  Purpose: Collects the stage timings, counters and memory usage of a script's run
+  and writes them to a JSON run report
+  """
+
+  def __init__(self):
+    self.active = False
+    self.profile = False
+    self.stages = []
+    self.stage_stack = []
+    self.counters = {}
+
+  @contextmanager
+  def run(self, script: str, report_dir: str = ".", profile: bool = False):
+    """
+    Purpose: Instruments a run of a script, writing the run report once it ends
+
+    Input: script - The name of the script
+           report_dir - The directory of the script's outputs
+           profile - Whether to run the stages under cProfile and tracemalloc
+
+    Output: None
+    """
+    self.active = True
+    self.profile = profile
+    self.stages = []
+    self.stage_stack = []
+    self.counters = {}
+
+    started_at = datetime.datetime.now()
+    report_base = os.path.join(report_dir, REPORTS_DIR_NAME, f"{script}_{started_at.strftime('%Y%m%d-%H%M%S')}")
+    self.report_base = report_base
+
+    if profile:
+      tracemalloc.start()
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    status = "ok"
+
+    try:
+      yield self
+    except BaseException as err:
+      status = f"failed: {type(err).__name__}: {err}"
+      raise
+    finally:
+      report = {
+        "script" : script,
+        "argv" : sys.argv[1:],
+        "started_at" : started_at.isoformat(timespec="seconds"),
+        "status" : status,
+        "wall_s" : time.perf_counter() - start_wall,
+        "cpu_s" : time.process_time() - start_cpu,
+        "peak_rss_mb" : peak_rss_mb(),
+        "profile" : profile,
+        "python" : platform.python_version(),
+        "counters" : self.counters,
+        "stages" : self.stages
+      }
+
+      if profile:
+        tracemalloc.stop()
+      self.active = False
+
+      write_report(f"{report_base}.json", report)
+      print(f"Run report written to {report_base}.json")
+
+  @contextmanager
+  def stage(self, name: str):
+    """
+    Purpose: Times a stage of the run
+
+    Input: name - The name of the stage (nested stages are recorded as parent/child)
+
+    Output: None
+    """
+    if self.active is False:
+      yield
+      return
+
+    parent = self.stage_stack[-1] if len(self.stage_stack) > 0 else None
+    record = {
+      "name" : name if parent is None else f"{parent['record']['name']}/{name}",
+      "counters" : {}
+    }
+    frame = {"record" : record, "child_peak" : 0}
+
+    # cProfile can't be nested so only the top level stages are profiled
+    profiler = None
+    if self.profile and parent is None:
+      profiler = cProfile.Profile()
+
+    start_snapshot = None
+    if self.profile:
+      start_snapshot = tracemalloc.take_snapshot()
+      start_traced, traced_peak = tracemalloc.get_traced_memory()
+      # Keep the parent's peak so far since resetting the peak clears it
+      if parent is not None:
+        parent["child_peak"] = max(parent["child_peak"], traced_peak)
+      tracemalloc.reset_peak()
+
+    self.stage_stack.append(frame)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    if profiler is not None:
+      profiler.enable()
+
+    try:
+      yield
+    finally:
+      if profiler is not None:
+        profiler.disable()
+
+      record["wall_s"] = time.perf_counter() - start_wall
+      record["cpu_s"] = time.process_time() - start_cpu
+      record["peak_rss_mb"] = peak_rss_mb()
+      self.stage_stack.pop()
+
+      if self.profile:
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        traced_peak = max(traced_peak, frame["child_peak"])
+        record["tracemalloc"] = {
+          "allocated_mb" : (traced - start_traced) / BYTES_PER_MB,
+          "peak_mb" : traced_peak / BYTES_PER_MB,
+          "top_allocations" : top_allocations(tracemalloc.take_snapshot(), start_snapshot)
+        }
+        if parent is not None:
+          parent["child_peak"] = max(parent["child_peak"], traced_peak)
+
+      if profiler is not None:
+        profile_filepath = f"{self.report_base}.{len(self.stages)}.{name}.prof"
+        os.makedirs(os.path.dirname(profile_filepath), exist_ok=True)
+        profiler.dump_stats(profile_filepath)
+        record["profile"] = {
+          "filepath" : profile_filepath,
+          "top_functions" : top_functions(profiler)
+        }
+
+      self.stages.append(record)
+
+  def count(self, name: str, amount: int = 1) -> None:
+    """
+    Purpose: Adds to a counter of the current stages and of the run
+
+    Input: name - The name of the counter e.g. granules
+           amount - The amount to add
+
+    Output: None
+    """
+    if self.active is False:
+      return
+
+    amount = int(amount)
+    self.counters[name] = self.counters.get(name, 0) + amount
+    for frame in self.stage_stack:
+      frame["record"]["counters"][name] = frame["record"]["counters"].get(name, 0) + amount
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+  parser.add_argument("--profile", required=False, action="store_true", help="Profile every stage with cProfile and tracemalloc (slows the run down)")
+
+def peak_rss_mb():
+  if resource is None:
+    return None
+
+  max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+  if sys.platform == "darwin":
+    return max_rss / BYTES_PER_MB
+  return max_rss / 1024
+
+def top_functions(profiler: cProfile.Profile) -> list:
+  """
+  Purpose: Summarizes the functions a stage spent the most time in
+
+  Input: profiler - The stage's profiler
+
+  Output: A list of dictionaries of the function, the number of calls and the
+  total and cumulative time, sorted by cumulative time
+  """
+  stats = pstats.Stats(profiler).sort_stats("cumulative")
+
+  functions = []
+  for function_key in stats.fcn_list[:TOP_FUNCTIONS]:
+    primitive_calls, num_calls, total_time, cumulative_time, callers = stats.stats[function_key]
+    filename, line, function = function_key
+    functions.append({
+      "function" : f"{filename}:{line}({function})",
+      "calls" : num_calls,
+      "tottime_s" : total_time,
+      "cumtime_s" : cumulative_time
+    })
+
+  return functions
+
+def top_allocations(snapshot: tracemalloc.Snapshot, start_snapshot: tracemalloc.Snapshot) -> list:
+  """
+  Purpose: Summarizes the lines which allocated the most memory during a stage
+
+  Input: snapshot - The snapshot at the end of the stage
+         start_snapshot - The snapshot at the start of the stage
+
+  Output: A list of dictionaries of the line, the memory it allocated and the number
+  of allocations, sorted by the memory allocated
+  """
+  allocations = []
+  for stat in snapshot.compare_to(start_snapshot, "lineno")[:TOP_ALLOCATIONS]:
+    frame = stat.traceback[0]
+    allocations.append({
+      "line" : f"{frame.filename}:{frame.lineno}",
+      "size_diff_mb" : stat.size_diff / BYTES_PER_MB,
+      "count_diff" : stat.count_diff
+    })
+
+  return allocations
+
+def write_report(report_filepath: str, report: dict) -> None:
+  os.makedirs(os.path.dirname(report_filepath), exist_ok=True)
+
+  # Write to a temporary file first so a crash can't leave a truncated report behind
+  temp_filepath = f"{report_filepath}.{os.getpid()}.tmp"
+  with open(temp_filepath, "w") as report_file:
+    json.dump(report, report_file, indent=2, default=str)
+  os.replace(temp_filepath, report_filepath)
+
+run_profiler = RunProfiler()
@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+
+from common.geometry_store import geometry_store
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+GEODATA_DIR = os.path.join(ROOT_DIR, "data", "geodata")
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "regions")
+
+MIN_LAT_KEY = "min_lat"
+MAX_LAT_KEY = "max_lat"
+MIN_LON_KEY = "min_lon"
+MAX_LON_KEY = "max_lon"
+
+NAME_KEY = "name"
+
+"""
+Notes:
+
+The registry replaces the hand coded COORDS_RANGE bounding boxes. A country is any
+directory data/geodata/<country> holding a <country>-districts.geojson, and its bounds
+(and the bounds of each of its districts) are the exact bounds of the district polygons.
+
+The bounds are cached in data/cache/regions keyed by the size and modification time of
+the GeoJSON, so looking up a bounding box doesn't require parsing the polygons. The
+polygons themselves are loaded through the geometry store (see geometry_store.py) at most
+once per process, the first time they are needed.
+"""
+
+class RegionRegistry:
+  """
+  Purpose: Registry of the countries we have district geometry for
+
+  Input: geodata_dir - The directory holding the <country>/<country>-districts.geojson files
+         cache_dir - The directory the bounds are cached in
+  """
+
+  def __init__(self, geodata_dir: str = GEODATA_DIR, cache_dir: str = CACHE_DIR):
+    self.geodata_dir = geodata_dir
+    self.cache_dir = cache_dir
+    self.lock = threading.Lock()
+    self.bounds_by_country = {}
+    self.districts_by_country = {}
+
+  def countries(self) -> list:
+    """
+    Purpose: Lists the (lowercase) countries with a district GeoJSON
+
+    Input: None
+
+    Output: The sorted list of countries
+    """
+    if os.path.isdir(self.geodata_dir) is False:
+      return []
+
+    return sorted(
+      country for country in os.listdir(self.geodata_dir)
+      if os.path.isfile(district_geojson_filepath(country, self.geodata_dir))
+    )
+
+  def has_country(self, country: str) -> bool:
+    return os.path.isfile(district_geojson_filepath(country.lower(), self.geodata_dir))
+
+  def geojson_filepath(self, country: str) -> str:
+    return district_geojson_filepath(country.lower(), self.geodata_dir)
+
+  def country_bounds(self, country: str) -> dict:
+    """
+    Purpose: Retrieves the exact bounding box of a country's districts
+
+    Input: country - The country
+
+    Output: A dictionary of MIN_LAT_KEY, MAX_LAT_KEY, MIN_LON_KEY and MAX_LON_KEY
+    """
+    return self.load_bounds(country)["country"]
+
+  def district_bounds(self, country: str) -> dict:
+    """
+    Purpose: Retrieves the bounding box of every district of a country
+
+    Input: country - The country
+
+    Output: A dictionary of district name -> bounding box (see country_bounds)
+    """
+    return self.load_bounds(country)["districts"]
+
+  def districts(self, country: str) -> list:
+    """
+    Purpose: Retrieves the parsed districts of a country, loading them from the
+    geometry store on the first call
+
+    Input: country - The country
+
+    Output: A list of dictionaries (one per GeoJSON feature) holding the district's
+    name, shapely geometry, prepared geometry and bounding box
+    """
+    country = country.lower()
+
+    if country not in self.districts_by_country:
+      with self.lock:
+        if country not in self.districts_by_country:
+          self.districts_by_country[country] = geometry_store.load_districts(self.geojson_filepath(country))
+
+    return self.districts_by_country[country]
+
+  def load_bounds(self, country: str) -> dict:
+    country = country.lower()
+    geojson_filepath = self.geojson_filepath(country)
+
+    if os.path.isfile(geojson_filepath) is False:
+      raise ValueError(f"No district geometry found for {country} (expected {geojson_filepath})")
+
+    signature = file_signature(geojson_filepath)
+    cached = self.bounds_by_country.get(country)
+    if cached is not None and cached["signature"] == signature:
+      return cached
+
+    cache_filepath = os.path.join(self.cache_dir, f"{country}.json")
+    if os.path.isfile(cache_filepath):
+      with open(cache_filepath, "r") as cache_file:
+        cached = json.load(cache_file)
+      if cached.get("signature") == signature:
+        self.bounds_by_country[country] = cached
+        return cached
+
+    districts = self.districts(country)
+    district_bounds = {}
+    for district in districts:
+      name = district[NAME_KEY]
+      if name in district_bounds:
+        district_bounds[name] = union_bounds([district_bounds[name], district["bounds"]])
+      else:
+        district_bounds[name] = district["bounds"]
+
+    cached = {
+      "signature" : signature,
+      "country" : union_bounds([district["bounds"] for district in districts]),
+      "districts" : district_bounds
+    }
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+    with open(cache_filepath, "w") as cache_file:
+      json.dump(cached, cache_file)
+
+    self.bounds_by_country[country] = cached
+    return cached
+
+def district_geojson_filepath(country: str, geodata_dir: str = GEODATA_DIR) -> str:
+  return os.path.join(geodata_dir, country, f"{country}-districts.geojson")
+
+def union_bounds(bounds: list) -> dict:
+  return {
+    MIN_LAT_KEY : min(bound[MIN_LAT_KEY] for bound in bounds),
+    MAX_LAT_KEY : max(bound[MAX_LAT_KEY] for bound in bounds),
+    MIN_LON_KEY : min(bound[MIN_LON_KEY] for bound in bounds),
+    MAX_LON_KEY : max(bound[MAX_LON_KEY] for bound in bounds)
+  }
+
+def bounds_contain(bounds: dict, lat: float, lon: float) -> bool:
+  return (
+    bounds[MIN_LAT_KEY] <= lat <= bounds[MAX_LAT_KEY] and
+    bounds[MIN_LON_KEY] <= lon <= bounds[MAX_LON_KEY]
+  )
+
+def file_signature(filepath: str) -> list:
+  stat = os.stat(filepath)
+  return [stat.st_size, stat.st_mtime_ns]
+
+region_registry = RegionRegistry()
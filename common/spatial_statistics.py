@@ -0,0 +1,286 @@
+import math
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from common.datacube import district_datacube, VARIABLES, SUM
+from common.district_ids import DISTRICT_ID_COL
+
+DEFAULT_PERMUTATIONS = 999
+DEFAULT_ALPHA = 0.05
+SEED = 42
+
+# The random neighbour draws are made in chunks of at most this many (permutation,
+# district, neighbour) values so the tensors stay around a hundred MB
+CHUNK_ELEMENTS = 1 << 22
+
+# Permuted statistics this close (relative to the statistics' scale) to the observed one
+# are ties. The sums behind them add the same values in a different order
+TIE_TOLERANCE = 1e-9
+
+# Columns of the local statistics
+VALUE_COL = "value"
+NUM_NEIGHBOURS_COL = "num_neighbours"
+LOCAL_I_COL = "local_i"
+GI_STAR_COL = "gi_star_z"
+P_VALUE_COL = "p_value"
+CLUSTER_COL = "cluster"
+HOTSPOT_COL = "hotspot"
+
+# Labels of the local statistics
+HIGH_HIGH = "high-high"
+LOW_LOW = "low-low"
+HIGH_LOW = "high-low"
+LOW_HIGH = "low-high"
+HOT_SPOT = "hot spot"
+COLD_SPOT = "cold spot"
+NOT_SIGNIFICANT = "not significant"
+
+"""
+Notes:
+
+Every statistic is computed for the districts that have geometry and a value, with the
+contiguity weights (see spatial_weights.py) restricted to them. Summed variables (cases
+and deaths) count a district without a report as 0, like analyze_lagged_correlations.py
+does, so a year's cases are compared against every district rather than only those
+that reported some.
+
+  Global Moran's I - n / S0 * z'Wz / z'z with the row standardized weights W and the
+                     deviations z from the mean. Its pseudo p-value compares it with
+                     the I of random permutations of the values over the districts,
+                     computed for a whole chunk of permutations at once as the sparse
+                     product W @ Z of the (district, permutation) matrix Z
+  Local Moran's I - z_i (Wz)_i / m2 with m2 = z'z / n, labelled by the quadrant of the
+                    district's value and the mean of its neighbours' values
+  Getis-Ord Gi* - The z-score of the sum of the values of a district and its neighbours
+                  (binary weights including the district itself), a hot spot when high
+
+The local p-values are conditional permutation p-values: a district's own value stays
+put and its k neighbours are drawn at random from the other districts. A permutation
+draws one random order of the other districts, shared by every district, of which each
+district takes the first k (skipping itself), so all districts are tested together with
+one gather and sum per chunk of permutations. Both local statistics only depend on the
+sum of the neighbours' values once the district's own value is fixed, so a single
+p-value serves both of them. The p-values are two sided: twice (1 + the smaller of the
+number of permutations at least as large and at least as small as the observed
+statistic) / (1 + the permutations), at most 1. Ties count on both sides, otherwise the
+zero-inflated case counts (where most neighbour sums are exactly 0 in the data and the
+permutations alike) would get a p-value of 2 / (1 + the permutations) and be labelled
+cold spots. PySAL's pseudo p-values are the one sided half of these.
+"""
+
+def district_metric_values(variable: str, year: int, district_ids: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Reads the yearly values of a datacube variable for some districts
+
+  Input: variable - The datacube variable
+         year - The year
+         district_ids - The district ids
+
+  Output: A float64 array of the values, NaN where there is no value (0 for the summed
+  variables)
+  """
+  cube_values = district_datacube.year_values(variable, year)
+  values = np.full(len(district_ids), np.nan)
+  # The cube has no row yet for the districts added to the registry since it was built
+  in_cube = district_ids < len(cube_values)
+  values[in_cube] = cube_values[district_ids[in_cube]]
+  if VARIABLES.get(variable) == SUM:
+    values = np.nan_to_num(values, nan=0.0)
+  return values
+
+def row_standardize(weights: sparse.csr_matrix) -> sparse.csr_matrix:
+  num_neighbours = np.asarray(weights.sum(axis=1)).ravel()
+  # Districts without neighbours (islands) keep an empty row
+  return sparse.diags(np.where(num_neighbours > 0, 1.0 / np.maximum(num_neighbours, 1), 0.0)) @ weights
+
+def two_sided_p_values(num_larger: np.ndarray, num_smaller: np.ndarray, num_permutations: int) -> np.ndarray:
+  # num_larger and num_smaller both count the ties
+  return np.minimum(2 * (np.minimum(num_larger, num_smaller) + 1) / (num_permutations + 1), 1.0)
+
+def random_orders(generator: np.random.Generator, num_permutations: int, size: int, num_kept: int) -> np.ndarray:
+  # The first num_kept entries of num_permutations random orders of range(size)
+  return np.argsort(generator.random((num_permutations, size), dtype=np.float32), axis=1)[:, :num_kept]
+
+def global_morans_i(z_scores: np.ndarray, weights: sparse.csr_matrix, num_permutations: int, generator: np.random.Generator) -> dict:
+  """
+  Purpose: Computes global Moran's I and its permutation inference
+
+  Input: z_scores - The deviations of the values from their mean
+         weights - The row standardized weights of the districts
+         num_permutations - The number of permutations
+         generator - The random generator
+
+  Output: A dictionary of the statistic, its expectation, the mean and standard
+  deviation of the permuted statistics, its z-score and its pseudo p-value
+  """
+  num_districts = len(z_scores)
+  total_weight = weights.sum()
+  sum_squares = np.dot(z_scores, z_scores)
+
+  morans_i = {"morans_i" : math.nan, "expected_i" : -1 / (num_districts - 1) if num_districts > 1 else math.nan, "mean_i" : math.nan, "std_i" : math.nan, "z_score" : math.nan, "p_value" : math.nan}
+  if total_weight <= 0 or sum_squares <= 0:
+    return morans_i
+
+  scale = num_districts / total_weight / sum_squares
+  morans_i["morans_i"] = float(scale * np.dot(z_scores, weights @ z_scores))
+  if num_permutations <= 0:
+    return morans_i
+
+  chunk = max(1, min(num_permutations, CHUNK_ELEMENTS // num_districts))
+  permuted_i = []
+  remaining = num_permutations
+  while remaining > 0:
+    num_chunk = min(chunk, remaining)
+    # A (district, permutation) matrix so the lags of every permutation are one sparse product
+    permuted = z_scores[random_orders(generator, num_chunk, num_districts, num_districts)].T
+    permuted_i.append(scale * np.sum(permuted * (weights @ permuted), axis=0))
+    remaining -= num_chunk
+
+  permuted_i = np.concatenate(permuted_i)
+  tolerance = TIE_TOLERANCE * max(1.0, abs(morans_i["morans_i"]))
+  num_larger = np.sum(permuted_i >= morans_i["morans_i"] - tolerance)
+  num_smaller = np.sum(permuted_i <= morans_i["morans_i"] + tolerance)
+  morans_i["mean_i"] = float(permuted_i.mean())
+  morans_i["std_i"] = float(permuted_i.std())
+  morans_i["z_score"] = (morans_i["morans_i"] - morans_i["mean_i"]) / morans_i["std_i"] if morans_i["std_i"] > 0 else math.nan
+  morans_i["p_value"] = float(two_sided_p_values(num_larger, num_smaller, num_permutations))
+  return morans_i
+
+def conditional_p_values(values: np.ndarray, neighbour_sums: np.ndarray, num_neighbours: np.ndarray, num_permutations: int, generator: np.random.Generator) -> np.ndarray:
+  """
+  Purpose: Computes the conditional permutation p-value of the neighbour sum of every
+  district, drawing each district's neighbours at random from the other districts
+
+  Input: values - The value of every district
+         neighbour_sums - The sum of the values of every district's neighbours
+         num_neighbours - The number of neighbours of every district
+         num_permutations - The number of permutations
+         generator - The random generator
+
+  Output: The p-value of every district (NaN for the districts without neighbours)
+  """
+  num_districts = len(values)
+  max_neighbours = int(min(num_neighbours.max(initial=0), num_districts - 1))
+  p_values = np.full(num_districts, np.nan)
+  if max_neighbours <= 0 or num_permutations <= 0:
+    return p_values
+
+  district_idxs = np.arange(num_districts)[None, :, None]
+  # Only the first num_neighbours draws of every district count
+  draw_mask = np.arange(max_neighbours)[None, :] < num_neighbours[:, None]
+
+  chunk = max(1, min(num_permutations, CHUNK_ELEMENTS // (num_districts * max_neighbours)))
+  tolerance = TIE_TOLERANCE * max(1.0, np.abs(values).max() * max_neighbours)
+  num_larger = np.zeros(num_districts, dtype=np.int64)
+  num_smaller = np.zeros(num_districts, dtype=np.int64)
+  remaining = num_permutations
+  while remaining > 0:
+    num_chunk = min(chunk, remaining)
+    # Orders of the n - 1 other districts, shifted past the district itself
+    draws = random_orders(generator, num_chunk, num_districts - 1, max_neighbours)[:, None, :]
+    neighbour_idxs = draws + (draws >= district_idxs)
+    random_sums = np.sum(np.where(draw_mask[None], values[neighbour_idxs], 0.0), axis=2)
+    num_larger += np.sum(random_sums >= neighbour_sums[None, :] - tolerance, axis=0)
+    num_smaller += np.sum(random_sums <= neighbour_sums[None, :] + tolerance, axis=0)
+    remaining -= num_chunk
+
+  has_neighbours = num_neighbours > 0
+  p_values[has_neighbours] = two_sided_p_values(num_larger[has_neighbours], num_smaller[has_neighbours], num_permutations)
+  return p_values
+
+def getis_ord_gi_star(values: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+  """
+  Purpose: Computes the Getis-Ord Gi* z-score of every district with binary weights
+  including the district itself
+
+  Input: values - The value of every district
+         weights - The binary weights of the districts (without the diagonal)
+
+  Output: The Gi* z-scores (NaN where they are undefined e.g. for a constant metric)
+  """
+  num_districts = len(values)
+  if num_districts <= 0:
+    return np.array([])
+
+  weight_sums = np.asarray(weights.sum(axis=1)).ravel() + 1
+  local_sums = weights @ values + values
+
+  mean = values.mean()
+  std = math.sqrt(max(np.mean(values * values) - mean * mean, 0.0))
+  # The weights are binary so the sum of the squared weights is the sum of the weights
+  variances = (num_districts * weight_sums - weight_sums ** 2) / max(num_districts - 1, 1)
+  with np.errstate(invalid="ignore", divide="ignore"):
+    gi_star = (local_sums - mean * weight_sums) / (std * np.sqrt(variances))
+  return np.where((std > 0) & (variances > 0), gi_star, np.nan)
+
+def spatial_autocorrelation(
+  values: np.ndarray,
+  district_ids: np.ndarray,
+  weights: sparse.csr_matrix,
+  num_permutations: int = DEFAULT_PERMUTATIONS,
+  alpha: float = DEFAULT_ALPHA,
+  seed: int = SEED
+) -> tuple:
+  """
+  Purpose: Computes global Moran's I, local Moran's I and Getis-Ord Gi* of a metric
+
+  Input: values - The value of every district of district_ids (NaN for no value)
+         district_ids - The district ids
+         weights - The binary (district id x district id) weights (see spatial_weights.py)
+         num_permutations - The number of permutations of the p-values
+         alpha - The significance level of the cluster and hot spot labels
+         seed - The seed of the permutations
+
+  Output: global_stats - The global Moran's I dictionary (see global_morans_i) with the
+                         number of districts
+          local_df - A dataframe with a row per district with a value holding its
+                     value, number of neighbours, local Moran's I, Gi* z-score,
+                     p-value, cluster and hot spot labels
+  """
+  values = np.asarray(values, dtype=np.float64)
+  district_ids = np.asarray(district_ids)
+  has_value = ~np.isnan(values)
+  values = values[has_value]
+  district_ids = district_ids[has_value]
+
+  district_weights = weights[district_ids][:, district_ids].tocsr()
+  num_neighbours = np.diff(district_weights.indptr)
+  standardized_weights = row_standardize(district_weights)
+
+  generator = np.random.default_rng(seed)
+  z_scores = values - values.mean() if len(values) > 0 else values
+
+  global_stats = global_morans_i(z_scores, standardized_weights, num_permutations, generator)
+  global_stats["num_districts"] = len(values)
+
+  second_moment = np.dot(z_scores, z_scores) / max(len(values), 1)
+  lags = standardized_weights @ z_scores
+  with np.errstate(invalid="ignore", divide="ignore"):
+    local_i = np.where((num_neighbours > 0) & (second_moment > 0), z_scores * lags / second_moment, np.nan)
+  gi_star = getis_ord_gi_star(values, district_weights)
+  p_values = conditional_p_values(z_scores, district_weights @ z_scores, num_neighbours, num_permutations, generator)
+
+  significant = p_values < alpha
+  clusters = np.full(len(values), NOT_SIGNIFICANT, dtype=object)
+  clusters[significant & (z_scores > 0) & (lags > 0)] = HIGH_HIGH
+  clusters[significant & (z_scores < 0) & (lags < 0)] = LOW_LOW
+  clusters[significant & (z_scores > 0) & (lags < 0)] = HIGH_LOW
+  clusters[significant & (z_scores < 0) & (lags > 0)] = LOW_HIGH
+
+  hotspots = np.full(len(values), NOT_SIGNIFICANT, dtype=object)
+  hotspots[significant & (gi_star > 0)] = HOT_SPOT
+  hotspots[significant & (gi_star < 0)] = COLD_SPOT
+
+  local_df = pd.DataFrame({
+    DISTRICT_ID_COL : district_ids,
+    VALUE_COL : values,
+    NUM_NEIGHBOURS_COL : num_neighbours,
+    LOCAL_I_COL : local_i,
+    GI_STAR_COL : gi_star,
+    P_VALUE_COL : p_values,
+    CLUSTER_COL : clusters,
+    HOTSPOT_COL : hotspots
+  })
+  return global_stats, local_df
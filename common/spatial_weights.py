@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+from scipy import sparse
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+from common.admin_locator import admin_locator, DISTRICT_LEVEL
+from common.district_ids import district_id_registry, DISTRICT_IDS_FILEPATH, DISTRICT_ID_COL, UNKNOWN_DISTRICT_ID
+from common.geometry_store import compute_source_hash
+from common.region_registry import region_registry, ROOT_DIR, file_signature
+
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "spatial")
+
+# Bump when the way the weights are built changes so old cache files aren't read
+FORMAT_VERSION = 1
+
+QUEEN = "queen"
+ROOK = "rook"
+CONTIGUITIES = [QUEEN, ROOK]
+
+# Districts closer than this (in degrees, ~100m) are neighbours. The GeoJSONs of the
+# countries come from different sources and don't share their borders exactly
+SNAP_TOLERANCE = 1e-3
+
+# Rook neighbours share more border than the ~2 x SNAP_TOLERANCE a shared corner leaves
+MIN_SHARED_BORDER = 4 * SNAP_TOLERANCE
+
+"""
+Notes:
+
+The spatial weights are the binary contiguity matrix of the districts: queen neighbours
+touch (share a border or just a corner), rook neighbours share a stretch of border. The
+matrix is a scipy CSR matrix indexed by district id (see district_ids.py) so it lines up
+with the district axis of the datacube, with empty rows for the ids without geometry.
+
+The district polygons are those of the district level of the admin hierarchy (see
+admin_locator.py), which leaves out the provinces the Afghan district file holds as
+well. The candidate pairs come from an STRtree of the polygons queried with their
+bounding boxes grown by SNAP_TOLERANCE, and only the candidates get the exact distance
+(and shared border) test, so building the weights of every country takes well under a
+second instead of testing every pair. Countries are built together so districts on
+either side of a border are neighbours too.
+
+The matrix is cached in data/cache/spatial in an npz file named after the contiguity and
+a hash of the district GeoJSONs, the district id registry and the build settings, so
+editing any of them rebuilds it.
+"""
+
+class SpatialWeights:
+  """
+  Purpose: Builds, caches and serves the contiguity weights of the districts
+
+  Input: registry - The region registry
+         cache_dir - The directory the weights are cached in
+  """
+
+  def __init__(self, registry = region_registry, cache_dir: str = CACHE_DIR):
+    self.registry = registry
+    self.cache_dir = cache_dir
+    self.lock = threading.Lock()
+    self.weights_by_contiguity = {}
+
+  def load(self, contiguity: str = QUEEN) -> dict:
+    """
+    Purpose: Retrieves the weights of a contiguity, from memory, from the cache file or
+    by building them (in that order)
+
+    Input: contiguity - QUEEN or ROOK
+
+    Output: A dictionary of
+              version - A hash identifying the weights
+              matrix - The binary (district id x district id) CSR matrix
+              district_ids - The sorted ids of the districts with geometry
+    """
+    if contiguity not in CONTIGUITIES:
+      raise ValueError(f"Unknown contiguity: {contiguity}. Expected one of {', '.join(CONTIGUITIES)}")
+
+    signature = self.source_signature()
+    with self.lock:
+      weights = self.weights_by_contiguity.get(contiguity)
+      if weights is not None and weights["signature"] == signature:
+        return weights
+
+      weights = self.load_cache(contiguity)
+      weights["signature"] = signature
+      self.weights_by_contiguity[contiguity] = weights
+      return weights
+
+  def load_cache(self, contiguity: str) -> dict:
+    source_key = {
+      "format" : FORMAT_VERSION,
+      "contiguity" : contiguity,
+      "snap_tolerance" : SNAP_TOLERANCE,
+      "min_shared_border" : MIN_SHARED_BORDER,
+      "sources" : {os.path.basename(filepath) : compute_source_hash(filepath) for filepath in self.source_filepaths()}
+    }
+    version = hashlib.sha1(json.dumps(source_key, sort_keys=True).encode("utf-8")).hexdigest()
+    cache_filepath = os.path.join(self.cache_dir, f"{contiguity}-{version}.npz")
+
+    if os.path.isfile(cache_filepath):
+      with np.load(cache_filepath, allow_pickle=False) as cached:
+        matrix = sparse.csr_matrix((cached["data"], cached["indices"], cached["indptr"]), shape=tuple(cached["shape"]))
+        district_ids = cached["district_ids"]
+    else:
+      matrix, district_ids = build_weights(self.registry.countries(), contiguity)
+
+      os.makedirs(self.cache_dir, exist_ok=True)
+      # Write to a temporary file first so a crash can't leave a truncated cache behind
+      temp_filepath = f"{cache_filepath}.{os.getpid()}.tmp.npz"
+      np.savez(temp_filepath, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape), district_ids=district_ids)
+      os.replace(temp_filepath, cache_filepath)
+
+    return {"version" : version, "matrix" : matrix, "district_ids" : district_ids}
+
+  def source_filepaths(self) -> list:
+    filepaths = [self.registry.geojson_filepath(country) for country in self.registry.countries()]
+    if os.path.isfile(DISTRICT_IDS_FILEPATH):
+      filepaths.append(DISTRICT_IDS_FILEPATH)
+    return filepaths
+
+  def source_signature(self) -> list:
+    # Cheap to compute on every call, unlike the hashes of the cache file name
+    return [(filepath, file_signature(filepath)) for filepath in self.source_filepaths()]
+
+def build_weights(countries: list, contiguity: str) -> tuple:
+  """
+  Purpose: Builds the contiguity weights of the districts of some countries
+
+  Input: countries - The countries
+         contiguity - QUEEN or ROOK
+
+  Output: matrix - The binary (district id x district id) CSR matrix
+          district_ids - The sorted ids of the districts with geometry
+  """
+  geometries = []
+  ids = []
+  for country in countries:
+    for unit in dict(admin_locator.load_hierarchy(country))[DISTRICT_LEVEL]:
+      district_id = district_id_registry.district_id(country, unit["name"])
+      if district_id == UNKNOWN_DISTRICT_ID:
+        continue
+      geometries.append(unit["geometry"])
+      ids.append(district_id)
+
+  ids = np.array(ids, dtype=np.int64)
+  registry_df = district_id_registry.load()
+  num_districts = int(registry_df[DISTRICT_ID_COL].max()) + 1 if registry_df.shape[0] > 0 else 0
+
+  rows = []
+  cols = []
+  buffered = {}
+  for left, right in candidate_pairs(geometries):
+    # Several features of a district (islands, enclaves) make up a single district
+    if left >= right or ids[left] == ids[right]:
+      continue
+    if geometries[left].distance(geometries[right]) > SNAP_TOLERANCE:
+      continue
+    if contiguity == ROOK:
+      if right not in buffered:
+        buffered[right] = geometries[right].buffer(SNAP_TOLERANCE)
+      if geometries[left].boundary.intersection(buffered[right]).length <= MIN_SHARED_BORDER:
+        continue
+    rows.extend([ids[left], ids[right]])
+    cols.extend([ids[right], ids[left]])
+
+  matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(num_districts, num_districts))
+  # A pair found through several features of a district is still a single neighbour
+  matrix.data[:] = 1.0
+  return matrix, np.unique(ids)
+
+def candidate_pairs(geometries: list) -> list:
+  """
+  Purpose: Finds the pairs of geometries whose bounding boxes are within SNAP_TOLERANCE
+  of each other using an STRtree
+
+  Input: geometries - The shapely geometries
+
+  Output: A list of (index, index) tuples
+  """
+  tree = STRtree(geometries)
+  query_boxes = [box(*geometry.bounds).buffer(SNAP_TOLERANCE, join_style=2) for geometry in geometries]
+
+  # shapely >= 2 queries every box at once and answers with indexes
+  try:
+    lefts, rights = tree.query(query_boxes)
+    return list(zip(lefts.tolist(), rights.tolist()))
+  except (AttributeError, TypeError, ValueError):
+    pass
+
+  # shapely 1.x answers with the geometries themselves
+  idx_by_id = {id(geometry) : idx for idx, geometry in enumerate(geometries)}
+  return [
+    (idx, idx_by_id[id(candidate)])
+    for idx, query_box in enumerate(query_boxes)
+    for candidate in tree.query(query_box)
+  ]
+
+spatial_weights = SpatialWeights()
@@ -10,6 +10,10 @@ import seaborn as sn
 from numpy.core.numeric import NaN
 from typing import Iterable, Union
 
+# The run profiler lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+
 # Data set filepath and column information for the cattle data set
 CATTLE_DATA_FILEPATH = "../data/individual_data_sets/cattle_data/cattle-livestock-count-heads.csv"
 COUNTRY_CATTLE_COL = "Entity"
@@ -53,45 +57,71 @@ INCLUDE_CATTLE_DATA = True
 
 def main():
 
-  cattle_df = retrieve_data(filepath=CATTLE_DATA_FILEPATH)
-  cchf_df = retrieve_data(filepath=CCHF_PROMED_DATA_FILEPATH)
-  population_df = retrieve_data(filepath=POPULATION_DATA_FILEPATH)
-  yearly_cchf_data = cchf_yearly_cases_and_deaths_df(cchf_df=cchf_df)
+  profile = extract_arguments()
 
-  # assign yearly cchf data to avoid dual pathing
-  combined_df = yearly_cchf_data
+  with run_profiler.run(script="analyze_data_by_year", profile=profile):
+    with run_profiler.stage("retrieve_data"):
+      cattle_df = retrieve_data(filepath=CATTLE_DATA_FILEPATH)
+      cchf_df = retrieve_data(filepath=CCHF_PROMED_DATA_FILEPATH)
+      population_df = retrieve_data(filepath=POPULATION_DATA_FILEPATH)
 
-  if INCLUDE_CATTLE_DATA:
-    combined_df = combine_promed_and_cattle_data(
-      cchf_df = yearly_cchf_data,
-      cattle_df = cattle_df
-    )
+    with run_profiler.stage("cchf_yearly_cases_and_deaths_df"):
+      yearly_cchf_data = cchf_yearly_cases_and_deaths_df(cchf_df=cchf_df)
 
-  combined_df = combine_promed_and_population_data(
-    cchf_df = combined_df,
-    population_df = population_df
-  )
-  
-  interested_cols = [
-    CCHF_YEAR_COL, 
-    CCHF_TOTAL_NUM_OF_CASES_COL, 
-    CCHF_TOTAL_NUM_OF_DEATHS_COL, 
-    POPULATION_DATA_COL
-  ]
+    # assign yearly cchf data to avoid dual pathing
+    combined_df = yearly_cchf_data
+
+    with run_profiler.stage("combine_data"):
+      if INCLUDE_CATTLE_DATA:
+        combined_df = combine_promed_and_cattle_data(
+          cchf_df = yearly_cchf_data,
+          cattle_df = cattle_df
+        )
+
+      combined_df = combine_promed_and_population_data(
+        cchf_df = combined_df,
+        population_df = population_df
+      )
+    
+    interested_cols = [
+      CCHF_YEAR_COL, 
+      CCHF_TOTAL_NUM_OF_CASES_COL, 
+      CCHF_TOTAL_NUM_OF_DEATHS_COL, 
+      POPULATION_DATA_COL
+    ]
+
+    if INCLUDE_CATTLE_DATA:
+      interested_cols.append(NUM_OF_CATTLE_WITH_PROMED_COL)
+
+    combined_df.to_csv(f"complete_data.csv", index=False)
+
+    with run_profiler.stage("analyze_combined_data"):
+      analyze_combined_data(
+        combined_data = combined_df,
+        columns_to_comp = interested_cols,
+        include_cattle_data = INCLUDE_CATTLE_DATA
+      )
+
+def extract_arguments() -> bool:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: profile - Whether to profile the run
+  """
+  parser = argparse.ArgumentParser()
 
-  if INCLUDE_CATTLE_DATA:
-    interested_cols.append(NUM_OF_CATTLE_WITH_PROMED_COL)
+  add_profile_argument(parser)
 
-  combined_df.to_csv(f"complete_data.csv", index=False)
+  args = parser.parse_args()
 
-  analyze_combined_data(
-    combined_data = combined_df,
-    columns_to_comp = interested_cols,
-    include_cattle_data = INCLUDE_CATTLE_DATA
-  )
+  return args.profile
 
 def retrieve_data(filepath: str) -> pd.DataFrame:
-  return pd.read_csv(filepath)
+  df = pd.read_csv(filepath)
+  run_profiler.count("rows", df.shape[0])
+  return df
 
 def cchf_yearly_cases_and_deaths_df(cchf_df: pd.DataFrame) -> pd.DataFrame:
   """
@@ -289,6 +319,7 @@ def analyze_combined_data(combined_data: pd.DataFrame, columns_to_comp: list, in
     plt.title(f"{country} Correlation Matrix")
     plt.savefig(f"{file_name}")
     plt.clf()
+    run_profiler.count("plots")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
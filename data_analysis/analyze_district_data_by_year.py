@@ -1,3 +1,4 @@
+import argparse
 import pandas as pd
 import datetime
 import math
@@ -7,6 +8,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sn
 
+# The run profiler lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+from common.district_ids import read_district_table, add_district_id_column, optimize_dtypes, DISTRICT_ID_COL, UNKNOWN_DISTRICT_ID
+from common.datacube import district_datacube
+from correlation_significance import correlation_significance, DEFAULT_PERMUTATIONS, DEFAULT_BOOTSTRAPS, SEED, DISTRICT_IDX_COL, METRIC_A_COL, METRIC_B_COL, P_VALUE_COL
+
 # Data set filepath and column information for the promed data set
 CCHF_PROMED_DATA_FILEPATH = "../data/individual_data_sets/CCHF_data/cchf_district_data.csv"
 DISEASE_NAME_COL = "diseasename"
@@ -47,48 +55,147 @@ COUNTRY_TEMPERATURE_DISTRICT_COL = "district"
 COUNTRY_TEMPERATURE_YEAR_COL = "year" 
 COUNTRY_TEMPERATURE_COL = "temperature in (K)"
 
-# Plots directory
+# The datacube variable each climate column is read from
+DATACUBE_VARIABLES = {
+  VGI_AVG_NVDI_VAL : "ndvi",
+  COUNTRY_PRECIPITATION_COL : "precipitation",
+  COUNTRY_TEMPERATURE_COL : "temperature"
+}
+
+# Output directories
+DATA_DIR = "../data"
 PLOTS_DIR = "../plots"
 
+"""
+Notes:
+
+Every table is loaded with its country and district columns as categoricals and its
+numeric columns downcast, and carries the district id of the district id registry (see
+common/district_ids.py), added on load for the csvs written before it existed. The
+tables are merged on the integer district id and the year rather than on the strings.
+
+The yearly vegetation, precipitation and temperature values are read from the memory
+mapped district datacube (see common/datacube.py) for the districts and years it holds,
+and from the csvs for the others.
+
+Every correlation of every district's correlation matrix is tested at once (see
+correlation_significance.py): the p-values, q-values and bootstrap confidence intervals
+are saved to data/district_correlation_significance.csv and the heatmaps are annotated
+with the correlation and its p-value.
+"""
+
 def main():
-  cchf_df = retrieve_data(filepath=CCHF_PROMED_DATA_FILEPATH)
-  vgi_df = retrieve_data(filepath=VGI_DATA_FILEPATH)
-  precipitation_df = retrieve_data(filepath=PRECIPITATION_FILEPATH)
-  temperature_data = retrieve_data(filepath=TEMPERATURE_FILEPATH)
+  args = extract_arguments()
+
+  with run_profiler.run(script="analyze_district_data_by_year", report_dir=DATA_DIR, profile=args.profile):
+    with run_profiler.stage("retrieve_data"):
+      cchf_df = retrieve_data(filepath=CCHF_PROMED_DATA_FILEPATH)
+      vgi_df = retrieve_district_metric(filepath=VGI_DATA_FILEPATH, column=VGI_AVG_NVDI_VAL)
+      precipitation_df = retrieve_district_metric(filepath=PRECIPITATION_FILEPATH, column=COUNTRY_PRECIPITATION_COL)
+      temperature_data = retrieve_district_metric(filepath=TEMPERATURE_FILEPATH, column=COUNTRY_TEMPERATURE_COL)
+
+    with run_profiler.stage("construct_district_cchf_yearly_cases_and_deaths_df"):
+      cchf_district_df = construct_district_cchf_yearly_cases_and_deaths_df(
+        cchf_df = cchf_df
+      )
+      cchf_district_df[CCHF_YEAR_COL] = cchf_district_df[CCHF_YEAR_COL].astype(int)
+      cchf_district_df = optimize_dtypes(add_district_id_column(cchf_district_df))
+
+    # Merge the temperature and precipitation data and our combined data
+    with run_profiler.stage("merge"):
+      vgi_and_cchf_df = cchf_district_df.merge(
+        vgi_df[[DISTRICT_ID_COL, VGI_YEAR_COL, VGI_AVG_NVDI_VAL]],
+        on = [DISTRICT_ID_COL, CCHF_YEAR_COL]
+      )
+      combined_df = vgi_and_cchf_df.merge(
+        precipitation_df[[DISTRICT_ID_COL, COUNTRY_PRECIPITATION_YEAR_COL, COUNTRY_PRECIPITATION_COL]],
+        on = [DISTRICT_ID_COL, CCHF_YEAR_COL]
+      )
+      combined_df = combined_df.merge(
+        temperature_data[[DISTRICT_ID_COL, COUNTRY_TEMPERATURE_YEAR_COL, COUNTRY_TEMPERATURE_COL]],
+        on = [DISTRICT_ID_COL, CCHF_YEAR_COL]
+      )
+
+      combined_df.to_csv(f"{DATA_DIR}/combined_district_data.csv", index=False)
+
+    # gen_timeseries_for_vgi_district_years(
+    #   df = vgi_df,
+    #   interested_cols = [VGI_YEAR_COL, VGI_DISTRICT_COL, VGI_AVG_NVDI_VAL],
+    #   title="Average Vegetation Index",
+    #   ylabel="Avg NVDI"
+    # )
+
+    # gen_bar_plot_for_cchf_data(
+    #   df = cchf_district_df,
+    #   interested_cols = [CCHF_YEAR_COL, CCHF_DISTRICT_COL, CCHF_TOTAL_NUM_OF_CASES_COL, CCHF_TOTAL_NUM_OF_DEATHS_COL],
+    #   title="CCHF Cases and Deaths"
+    # )
+
+    with run_profiler.stage("gen_correlation_matrix_for_data"):
+      gen_correlation_matrix_for_data(
+        combined_data = combined_df,
+        columns_to_comp = [CCHF_TOTAL_NUM_OF_CASES_COL, CCHF_TOTAL_NUM_OF_DEATHS_COL, VGI_AVG_NVDI_VAL, COUNTRY_TEMPERATURE_COL, COUNTRY_PRECIPITATION_COL],
+        replace_nas=False,
+        num_permutations=args.permutations,
+        num_bootstraps=args.bootstraps,
+        workers=args.workers,
+        seed=args.seed
+      )
+
+def extract_arguments():
+  """
+  Purpose: extracts the arguments specified by the user
 
-  cchf_district_df = construct_district_cchf_yearly_cases_and_deaths_df(
-    cchf_df = cchf_df
-  )
-  cchf_district_df[CCHF_YEAR_COL] = cchf_district_df[CCHF_YEAR_COL].astype(int)
-
-  # Merge the temperature and precipitation data and our combined data
-  vgi_and_cchf_df = cchf_district_df.merge(vgi_df[[VGI_COUNTRY_COL, VGI_DISTRICT_COL, VGI_YEAR_COL, VGI_AVG_NVDI_VAL]])
-  combined_df = vgi_and_cchf_df.merge(precipitation_df[[COUNTRY_PRECIPITATION_COUNTRY_COL, COUNTRY_PRECIPITATION_DISTRICT_COL, COUNTRY_PRECIPITATION_YEAR_COL, COUNTRY_PRECIPITATION_COL]])
-  combined_df = combined_df.merge(temperature_data[[COUNTRY_TEMPERATURE_COUNTRY_COL, COUNTRY_TEMPERATURE_DISTRICT_COL, COUNTRY_TEMPERATURE_YEAR_COL, COUNTRY_TEMPERATURE_COL]])
-
-  combined_df.to_csv("../data/combined_district_data.csv", index=False)
-
-  # gen_timeseries_for_vgi_district_years(
-  #   df = vgi_df,
-  #   interested_cols = [VGI_YEAR_COL, VGI_DISTRICT_COL, VGI_AVG_NVDI_VAL],
-  #   title="Average Vegetation Index",
-  #   ylabel="Avg NVDI"
-  # )
-
-  # gen_bar_plot_for_cchf_data(
-  #   df = cchf_district_df,
-  #   interested_cols = [CCHF_YEAR_COL, CCHF_DISTRICT_COL, CCHF_TOTAL_NUM_OF_CASES_COL, CCHF_TOTAL_NUM_OF_DEATHS_COL],
-  #   title="CCHF Cases and Deaths"
-  # )
-
-  gen_correlation_matrix_for_data(
-    combined_data = combined_df,
-    columns_to_comp = [CCHF_TOTAL_NUM_OF_CASES_COL, CCHF_TOTAL_NUM_OF_DEATHS_COL, VGI_AVG_NVDI_VAL, COUNTRY_TEMPERATURE_COL, COUNTRY_PRECIPITATION_COL],
-    replace_nas=False
-  )
+  Input: None
+
+  Output: The parsed arguments
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("--permutations", type=int, default=DEFAULT_PERMUTATIONS, help="The number of permutations of the correlation p-values")
+  parser.add_argument("--bootstraps", type=int, default=DEFAULT_BOOTSTRAPS, help="The number of bootstrap resamples of the confidence intervals (0 for none)")
+  parser.add_argument("--workers", type=int, default=1, help="The number of processes to shard the districts across")
+  parser.add_argument("--seed", type=int, default=SEED, help="The seed of the resamples")
+  add_profile_argument(parser)
+
+  args = parser.parse_args()
+
+  if args.permutations <= 0 or args.bootstraps < 0 or args.workers <= 0:
+    print("The number of permutations and workers must be positive and the number of bootstraps can't be negative")
+    sys.exit(-1)
+
+  return args
 
 def retrieve_data(filepath: str) -> pd.DataFrame:
-  return pd.read_csv(filepath)
+  df = read_district_table(filepath)
+  run_profiler.count("rows", df.shape[0])
+  return df
+
+def retrieve_district_metric(filepath: str, column: str) -> pd.DataFrame:
+  """
+  Purpose: Retrieves the yearly values of a climate column per district, from the
+  datacube for the districts and years it holds and from the csv for the rest
+
+  Input: filepath - The csv filepath of the column
+         column - The column
+
+  Output: A dataframe with (at least) the district id, year and column
+  """
+  variable = DATACUBE_VARIABLES[column]
+  if district_datacube.has_values(variable) is False:
+    return retrieve_data(filepath=filepath)
+
+  cube_df = district_datacube.yearly_frame({variable : column}).dropna(subset=[column])
+  run_profiler.count("datacube_rows", cube_df.shape[0])
+  if os.path.isfile(filepath) is False:
+    return cube_df
+
+  # A fetch may only have written some countries or years to the cube, the csv fills in the rest
+  csv_df = retrieve_data(filepath=filepath)[[DISTRICT_ID_COL, CCHF_YEAR_COL, column]]
+  df = pd.concat([cube_df, csv_df], ignore_index=True)
+  df = df.drop_duplicates(subset=[DISTRICT_ID_COL, CCHF_YEAR_COL], keep="first").reset_index(drop=True)
+  run_profiler.count("csv_rows", df.shape[0] - cube_df.shape[0])
+  return df
 
 def construct_district_cchf_yearly_cases_and_deaths_df(cchf_df: pd.DataFrame) -> pd.DataFrame:
   """
@@ -290,7 +397,15 @@ def gen_bar_plot_for_cchf_data(df: pd.DataFrame, interested_cols: list, title: s
       plt.savefig(f"{PLOTS_DIR}/yearly_cchf_cases_and_deaths_data_for_{country}'s_{key}_district.png")
       plt.clf()
 
-def gen_correlation_matrix_for_data(combined_data: pd.DataFrame, columns_to_comp: list, replace_nas: bool = False):
+def gen_correlation_matrix_for_data(
+  combined_data: pd.DataFrame,
+  columns_to_comp: list,
+  replace_nas: bool = False,
+  num_permutations: int = DEFAULT_PERMUTATIONS,
+  num_bootstraps: int = DEFAULT_BOOTSTRAPS,
+  workers: int = 1,
+  seed: int = SEED
+):
 
   removed_nas = ""
   if replace_nas is True:
@@ -299,33 +414,69 @@ def gen_correlation_matrix_for_data(combined_data: pd.DataFrame, columns_to_comp
     combined_data.dropna(inplace=True)
     removed_nas = "removed_nas"
 
-  countries_in_df = set(combined_data[COUNTRY_PROMED_COL].values)
-  
-  for country in countries_in_df:
-    country_combined_df = combined_data[combined_data[COUNTRY_PROMED_COL] == country]
+  # The reports without a located district all share UNKNOWN_DISTRICT_ID across countries
+  combined_data = combined_data[combined_data[DISTRICT_ID_COL] != UNKNOWN_DISTRICT_ID]
+  district_groups = list(combined_data.groupby(DISTRICT_ID_COL, sort=False, observed=True))
+
+  # Test the correlations of every district at once
+  significance_df = correlation_significance(
+    district_dfs = [district_combined_df for district_id, district_combined_df in district_groups],
+    metrics = columns_to_comp,
+    num_permutations = num_permutations,
+    num_bootstraps = num_bootstraps,
+    workers = workers,
+    seed = seed
+  )
+  district_idxs = significance_df[DISTRICT_IDX_COL].to_numpy()
+  significance_df.insert(0, DISTRICT_ID_COL, np.array([district_id for district_id, district_combined_df in district_groups], dtype=np.int64)[district_idxs])
+  significance_df.insert(1, COUNTRY_PROMED_COL, [str(district_groups[idx][1][COUNTRY_PROMED_COL].iloc[0]) for idx in district_idxs])
+  significance_df.insert(2, CCHF_DISTRICT_COL, [str(district_groups[idx][1][CCHF_DISTRICT_COL].iloc[0]) for idx in district_idxs])
+  significance_df.drop(columns=[DISTRICT_IDX_COL]).to_csv(f"{DATA_DIR}/district_correlation_significance.csv", index=False)
+  run_profiler.count("correlations_tested", significance_df.shape[0])
+
+  for district_idx, (district_id, district_combined_df) in enumerate(district_groups):
+    country = district_combined_df[COUNTRY_PROMED_COL].iloc[0]
+    district = district_combined_df[CCHF_DISTRICT_COL].iloc[0]
+
+    # Grab the data we only care about which is the year, total cases, total deaths and the number of cattle
+    fiiltered_df = district_combined_df[columns_to_comp]
+
+    try:
+      correlation_df = fiiltered_df.corr()
+      p_value_df = significance_matrix(significance_df[district_idxs == district_idx], columns_to_comp, P_VALUE_COL)
+      print(correlation_df)
+      print(p_value_df)
+      # Generate a visual representation of the Correlation Matrix annotated with the p-values
+      # Series.map per column, DataFrame.map only exists from pandas 2.1 on
+      annotations = correlation_df.apply(lambda col: col.map(lambda val: f"{val:.2f}")) + "\n" + p_value_df.apply(lambda col: col.map(lambda val: f"p={val:.3f}" if not math.isnan(val) else ""))
+      sn.heatmap(correlation_df, annot=annotations, fmt="")
+      if not os.path.isdir(PLOTS_DIR):
+        os.mkdir(PLOTS_DIR)
+
+      file_name = f"{PLOTS_DIR}/{country}_{district}_district_data_correlation_matrix_{removed_nas}.png"
+      plt.tight_layout()
+      plt.title(f"{country}'s {district} Correlation Matrix")
+      plt.savefig(f"{file_name}")
+      plt.clf()
+      run_profiler.count("plots")
+    except Exception as err:
+      continue
 
-    districts = set(country_combined_df[CCHF_DISTRICT_COL].values)
+def significance_matrix(district_significance_df: pd.DataFrame, metrics: list, column: str) -> pd.DataFrame:
+  """
+  Purpose: Lays a column of a district's significance rows out as a metric by metric matrix
 
-    for district in districts:
-      district_combined_df = country_combined_df[country_combined_df[CCHF_DISTRICT_COL] == district]
-      
-      # Grab the data we only care about which is the year, total cases, total deaths and the number of cattle
-      fiiltered_df = district_combined_df[columns_to_comp]
-      
-      try:
-        print(fiiltered_df.corr())
-        # Generate a visual representation of the Correlation Matrix
-        sn.heatmap(fiiltered_df.corr(), annot=True)
-        if not os.path.isdir(PLOTS_DIR):
-          os.mkdir(PLOTS_DIR)
-
-        file_name = f"{PLOTS_DIR}/{country}_{district}_district_data_correlation_matrix_{removed_nas}.png"
-        plt.tight_layout()
-        plt.title(f"{country}'s {district} Correlation Matrix")
-        plt.savefig(f"{file_name}")
-        plt.clf()
-      except Exception as err:
-        continue
+  Input: district_significance_df - The significance rows of a district
+         metrics - The metrics
+         column - The column e.g. the p-value
+
+  Output: The symmetric matrix (NaN on the diagonal)
+  """
+  matrix_df = pd.DataFrame(np.nan, index=metrics, columns=metrics)
+  for metric_a, metric_b, val in zip(district_significance_df[METRIC_A_COL], district_significance_df[METRIC_B_COL], district_significance_df[column]):
+    matrix_df.loc[metric_a, metric_b] = val
+    matrix_df.loc[metric_b, metric_a] = val
+  return matrix_df
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,308 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from typing import Iterable, Union
+
+# The datacube lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+from common.datacube import district_datacube, NUM_MONTHS
+from common.district_ids import district_id_registry, DISTRICT_ID_COL, COUNTRY_COL, DISTRICT_COL
+
+# The case variable of the datacube and the climate drivers it is correlated with
+CASES_VARIABLE = "cases"
+DEFAULT_DRIVERS = ["temperature", "precipitation", "ndvi", "specific_humidity", "soil_wetness"]
+
+DEFAULT_MAX_LAG = 12
+
+# A lag needs at least this many months where both series have a value
+DEFAULT_MIN_PAIRS = 24
+
+# The direct sums cost a pass over the series per lag and the FFT a fixed few, they break
+# even at around 60 lags whatever the length of the series
+FFT_MIN_LAGS = 64
+
+# Variances this small relative to the energy of the series are rounding error
+DEGENERATE_TOLERANCE = 1e-9
+
+DIRECT = "direct"
+FFT = "fft"
+AUTO = "auto"
+
+# Columns of the output
+VARIABLE_COL = "variable"
+LAG_COL = "lag_months"
+CORRELATION_COL = "correlation"
+PAIRS_COL = "num_pairs"
+LAG0_CORRELATION_COL = "lag0_correlation"
+
+DATA_DIR = "../data"
+LAG_DATA_DIR = f"{DATA_DIR}/lag_analysis"
+
+"""
+Notes:
+
+Vector borne diseases respond to the climate with a delay of months, which the same year
+correlations of analyze_district_data_by_year.py can't show. This script reads the
+monthly cases and climate drivers of every district from the datacube (see
+common/datacube.py) as district x month matrices and correlates the driver at month t
+with the cases at month t + lag for every lag from 0 to --max-lag months, for every
+district at once.
+
+A month without any report counts as 0 cases as long as it falls within the years the
+reports cover (from the first to the last year any district has a report in), while the
+months outside of them and the months without a climate value are left out of the
+correlation. The Pearson correlation at each lag only uses the months
+where both have a value, which needs six sums over the pairs of months (the number of
+pairs, the sums, the sums of squares and the sum of products). Each of them is a cross
+correlation of two (masked) series, so they are computed for all districts and lags
+either directly (a loop over the lags) or, from FFT_MIN_LAGS lags on, through the FFT.
+
+The result is a tidy table with the lag of the strongest (absolute) correlation of every
+district and driver, its correlation, the number of months it is based on and the
+correlation at lag 0 for comparison.
+"""
+
+def main():
+
+  max_lag, drivers, min_pairs, method, all_lags, profile = extract_arguments()
+
+  with run_profiler.run(script="analyze_lagged_correlations", report_dir=LAG_DATA_DIR, profile=profile):
+    if district_datacube.has_values(CASES_VARIABLE) is False:
+      print("The datacube has no cases yet, run clean_cchf_cases_per_districts.py first")
+      sys.exit(-1)
+
+    with run_profiler.stage("monthly_matrices"):
+      cases = fill_unreported_months(monthly_matrix(CASES_VARIABLE))
+
+    results = []
+    for driver in drivers:
+      if district_datacube.has_values(driver) is False:
+        print(f"Skipping {driver}, the datacube has no values for it")
+        continue
+
+      with run_profiler.stage("lagged_correlations"):
+        climate = monthly_matrix(driver)
+        correlations, num_pairs = lagged_correlations(climate, cases, max_lag=max_lag, min_pairs=min_pairs, method=method)
+        results.append(lag_table(driver, correlations, num_pairs, all_lags=all_lags))
+        run_profiler.count("districts", correlations.shape[0])
+
+    if len(results) <= 0:
+      print("None of the drivers have values in the datacube")
+      return
+
+    lag_df = pd.concat(results, ignore_index=True)
+    print(lag_df.to_string(index=False, float_format=lambda val: f"{val:.3f}"))
+
+    if os.path.isdir(LAG_DATA_DIR) is False:
+      os.makedirs(LAG_DATA_DIR)
+
+    file_name = "lagged_correlations_all_lags.csv" if all_lags else "lagged_correlations.csv"
+    lag_df.to_csv(f"{LAG_DATA_DIR}/{file_name}", index=False)
+    run_profiler.count("rows", lag_df.shape[0])
+
+def extract_arguments() -> Iterable[Union[int, list, str, bool]]:
+  """
+  Name: extract_arguments
+
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: max_lag - The largest lag in months
+          drivers - The climate variables to correlate the cases with
+          min_pairs - The number of months a correlation needs
+          method - How the correlations are computed (auto, direct or fft)
+          all_lags - Whether to output every lag rather than the best one
+          profile - Whether to profile the run
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-k", "--max-lag", type=int, required=False, default=DEFAULT_MAX_LAG, help="The largest lag (in months) of the climate before the cases")
+  parser.add_argument("-v", "--drivers", nargs="+", required=False, default=DEFAULT_DRIVERS, help="The datacube variables to correlate the cases with")
+  parser.add_argument("--min-pairs", type=int, required=False, default=DEFAULT_MIN_PAIRS, help="The number of months with both values a correlation needs")
+  parser.add_argument("--method", type=str, required=False, default=AUTO, choices=[AUTO, DIRECT, FFT], help="Compute the correlations directly or through the FFT")
+  parser.add_argument("--all-lags", required=False, action="store_true", help="Output the correlation at every lag rather than the best one")
+  add_profile_argument(parser)
+
+  args = parser.parse_args()
+
+  if args.max_lag < 0:
+    print(f"The largest lag: {args.max_lag} can't be negative")
+    sys.exit(-1)
+
+  if args.min_pairs < 3:
+    print(f"A correlation needs at least 3 pairs, not {args.min_pairs}")
+    sys.exit(-1)
+
+  return args.max_lag, args.drivers, args.min_pairs, args.method, args.all_lags, args.profile
+
+def monthly_matrix(variable: str) -> np.ndarray:
+  """
+  Name: monthly_matrix
+
+  Purpose: Reads the monthly values of a variable for every district from the datacube
+
+  Input: variable - The datacube variable
+
+  Output: A (district id, month) float64 matrix, with the months of every year of the
+  cube one after the other and NaN where there is no value
+  """
+  monthly = district_datacube.monthly(variable)
+  num_districts, num_years, num_months = monthly.shape
+  return np.asarray(monthly, dtype=np.float64).reshape(num_districts, num_years * num_months)
+
+def fill_unreported_months(cases: np.ndarray) -> np.ndarray:
+  """
+  Name: fill_unreported_months
+
+  Purpose: Counts the months without a report as 0 cases, within the years the reports
+  cover only. The cube spans many more years than the reports do and a month before the
+  first or after the last report says nothing about the cases
+
+  Input: cases - A (district id, month) matrix from monthly_matrix
+
+  Output: The matrix with 0 in the months without a report of the reported years and NaN
+  outside of them
+  """
+  reported_years = np.flatnonzero(~np.isnan(cases).all(axis=0)) // NUM_MONTHS
+  if len(reported_years) <= 0:
+    return cases
+
+  start = reported_years[0] * NUM_MONTHS
+  end = (reported_years[-1] + 1) * NUM_MONTHS
+  cases = cases.copy()
+  cases[:, start:end] = np.nan_to_num(cases[:, start:end], nan=0.0)
+  return cases
+
+def lagged_cross_sums(a: np.ndarray, b: np.ndarray, max_lag: int, method: str = AUTO) -> np.ndarray:
+  """
+  Name: lagged_cross_sums
+
+  Purpose: Computes sum_t a[:, t] * b[:, t + lag] for every row and every lag
+
+  Input: a - A (rows, months) matrix
+         b - A (rows, months) matrix
+         max_lag - The largest lag
+         method - DIRECT, FFT or AUTO (FFT from FFT_MIN_LAGS lags on)
+
+  Output: A (rows, max_lag + 1) matrix of the sums
+  """
+  num_rows, length = a.shape
+  if method == AUTO:
+    method = FFT if max_lag + 1 >= FFT_MIN_LAGS else DIRECT
+
+  sums = np.zeros((num_rows, max_lag + 1))
+  if method == DIRECT:
+    for lag in range(min(max_lag, length - 1) + 1):
+      sums[:, lag] = np.einsum("ij,ij->i", a[:, :length - lag], b[:, lag:])
+    return sums
+
+  # Zero padded past length + max_lag so the circular correlation never wraps around
+  fft_length = 1 << (length + max_lag - 1).bit_length()
+  a_fft = np.fft.rfft(a, n=fft_length, axis=1)
+  b_fft = np.fft.rfft(b, n=fft_length, axis=1)
+  cross = np.fft.irfft(np.conj(a_fft) * b_fft, n=fft_length, axis=1)
+
+  num_lags = min(max_lag, length - 1) + 1
+  sums[:, :num_lags] = cross[:, :num_lags]
+  return sums
+
+def lagged_correlations(x: np.ndarray, y: np.ndarray, max_lag: int = DEFAULT_MAX_LAG, min_pairs: int = DEFAULT_MIN_PAIRS, method: str = AUTO) -> tuple:
+  """
+  Name: lagged_correlations
+
+  Purpose: Computes the Pearson correlation of x at month t with y at month t + lag for
+  every row and every lag from 0 to max_lag, over the months where both have a value
+
+  Input: x - A (rows, months) matrix of the leading series (NaN where missing)
+         y - A (rows, months) matrix of the following series (NaN where missing)
+         max_lag - The largest lag
+         min_pairs - The number of pairs below which a correlation is NaN
+         method - DIRECT, FFT or AUTO
+
+  Output: correlations - A (rows, max_lag + 1) matrix of the correlations
+          num_pairs - A (rows, max_lag + 1) matrix of the number of pairs behind them
+  """
+  x_mask = ~np.isnan(x)
+  y_mask = ~np.isnan(y)
+
+  # Centering every row first keeps the sums of squares from cancelling out
+  x = center_rows(x, x_mask)
+  y = center_rows(y, y_mask)
+  x_mask = x_mask.astype(np.float64)
+  y_mask = y_mask.astype(np.float64)
+
+  num_pairs = np.rint(lagged_cross_sums(x_mask, y_mask, max_lag, method))
+  sum_x = lagged_cross_sums(x, y_mask, max_lag, method)
+  sum_y = lagged_cross_sums(x_mask, y, max_lag, method)
+  sum_xx = lagged_cross_sums(x * x, y_mask, max_lag, method)
+  sum_yy = lagged_cross_sums(x_mask, y * y, max_lag, method)
+  sum_xy = lagged_cross_sums(x, y, max_lag, method)
+
+  with np.errstate(invalid="ignore", divide="ignore"):
+    covariance = num_pairs * sum_xy - sum_x * sum_y
+    variance_x = num_pairs * sum_xx - sum_x * sum_x
+    variance_y = num_pairs * sum_yy - sum_y * sum_y
+    correlations = covariance / np.sqrt(variance_x * variance_y)
+
+  # Constant series (e.g. a district without a single case) have no correlation, only
+  # the rounding error of the sums, which is tiny next to the energy of the series
+  degenerate = (
+    (num_pairs < min_pairs) |
+    (variance_x <= DEGENERATE_TOLERANCE * num_pairs * np.sum(x * x, axis=1, keepdims=True)) |
+    (variance_y <= DEGENERATE_TOLERANCE * num_pairs * np.sum(y * y, axis=1, keepdims=True))
+  )
+  correlations[degenerate] = np.nan
+
+  return np.clip(correlations, -1.0, 1.0), num_pairs.astype(np.int64)
+
+def center_rows(matrix: np.ndarray, mask: np.ndarray) -> np.ndarray:
+  # Subtracts the mean of the values of every row, with 0 where there is no value
+  values = np.where(mask, matrix, 0.0)
+  means = values.sum(axis=1, keepdims=True) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+  return np.where(mask, values - means, 0.0)
+
+def lag_table(variable: str, correlations: np.ndarray, num_pairs: np.ndarray, all_lags: bool = False) -> pd.DataFrame:
+  """
+  Name: lag_table
+
+  Purpose: Builds the tidy table of the lagged correlations of a driver
+
+  Input: variable - The driver
+         correlations - The (district id, lag) correlations
+         num_pairs - The (district id, lag) number of pairs
+         all_lags - Whether to keep every lag rather than the strongest one
+
+  Output: A dataframe with a row per district (or per district and lag) with a correlation
+  """
+  num_districts, num_lags = correlations.shape
+  registry_df = district_id_registry.load().set_index(DISTRICT_ID_COL)
+
+  if all_lags:
+    district_ids = np.repeat(np.arange(num_districts), num_lags)
+    lags = np.tile(np.arange(num_lags), num_districts)
+  else:
+    valid = ~np.isnan(correlations).all(axis=1)
+    district_ids = np.nonzero(valid)[0]
+    lags = np.nanargmax(np.abs(correlations[valid]), axis=1) if valid.any() else np.array([], dtype=np.int64)
+
+  names = registry_df.reindex(district_ids)
+  lag_df = pd.DataFrame({
+    DISTRICT_ID_COL : district_ids.astype(np.int16),
+    COUNTRY_COL : names[COUNTRY_COL].values,
+    DISTRICT_COL : names[DISTRICT_COL].values,
+    VARIABLE_COL : variable,
+    LAG_COL : lags.astype(np.int16),
+    CORRELATION_COL : correlations[district_ids, lags],
+    PAIRS_COL : num_pairs[district_ids, lags],
+    LAG0_CORRELATION_COL : correlations[district_ids, 0]
+  })
+
+  return lag_df.dropna(subset=[CORRELATION_COL]).reset_index(drop=True)
+
+if __name__ == "__main__":
+  main()
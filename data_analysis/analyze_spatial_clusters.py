@@ -0,0 +1,145 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from typing import Iterable, Union
+
+# The spatial weights and statistics live in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+from common.datacube import district_datacube, VARIABLES
+from common.district_ids import district_id_registry, DISTRICT_ID_COL, COUNTRY_COL, DISTRICT_COL
+from common.spatial_weights import spatial_weights, CONTIGUITIES, QUEEN
+from common.spatial_statistics import spatial_autocorrelation, district_metric_values, DEFAULT_PERMUTATIONS, DEFAULT_ALPHA, SEED
+
+DEFAULT_VARIABLE = "cases"
+
+# Columns of the output
+VARIABLE_COL = "variable"
+YEAR_COL = "year"
+
+DATA_DIR = "../data"
+SPATIAL_DATA_DIR = f"{DATA_DIR}/spatial_analysis"
+
+"""
+Notes:
+
+Looks for clusters of CCHF cases (or any other datacube variable) across neighbouring
+districts. For every year the datacube holds values of the variable for, the yearly
+values of the districts are tested for spatial autocorrelation with the contiguity
+weights of the districts (see common/spatial_weights.py and common/spatial_statistics.py):
+
+  <variable>_global_morans_i.csv - Global Moran's I of every year with its permutation
+                                   z-score and p-value
+  <variable>_local_clusters.csv - Local Moran's I and Getis-Ord Gi* of every district and
+                                  year with its p-value, cluster (high-high, low-low,
+                                  high-low, low-high) and hot spot (hot / cold spot) label
+
+Both are written to data/spatial_analysis.
+"""
+
+def main():
+
+  variable, years, contiguity, num_permutations, alpha, seed, profile = extract_arguments()
+
+  with run_profiler.run(script="analyze_spatial_clusters", report_dir=SPATIAL_DATA_DIR, profile=profile):
+    if district_datacube.has_values(variable) is False:
+      print(f"The datacube has no values for {variable} yet, run the fetchers and cleaners first")
+      sys.exit(-1)
+
+    with run_profiler.stage("spatial_weights"):
+      weights = spatial_weights.load(contiguity)
+      district_ids = weights["district_ids"]
+      run_profiler.count("districts", len(district_ids))
+
+    if years is None:
+      years = years_with_values(variable, district_ids)
+
+    global_rows = []
+    local_dfs = []
+    with run_profiler.stage("spatial_autocorrelation"):
+      for year in years:
+        values = district_metric_values(variable, year, district_ids)
+        global_stats, local_df = spatial_autocorrelation(
+          values = values,
+          district_ids = district_ids,
+          weights = weights["matrix"],
+          num_permutations = num_permutations,
+          alpha = alpha,
+          seed = seed
+        )
+
+        global_rows.append({VARIABLE_COL : variable, YEAR_COL : year, **global_stats})
+        local_df.insert(1, YEAR_COL, year)
+        local_dfs.append(local_df)
+        run_profiler.count("years")
+
+    if len(global_rows) <= 0:
+      print(f"No year has values for {variable}")
+      return
+
+    global_df = pd.DataFrame(global_rows)
+    print(global_df.to_string(index=False, float_format=lambda val: f"{val:.3f}"))
+
+    registry_df = district_id_registry.load().set_index(DISTRICT_ID_COL)
+    local_df = pd.concat(local_dfs, ignore_index=True)
+    names = registry_df.reindex(local_df[DISTRICT_ID_COL].values)
+    local_df.insert(1, COUNTRY_COL, names[COUNTRY_COL].values)
+    local_df.insert(2, DISTRICT_COL, names[DISTRICT_COL].values)
+
+    if os.path.isdir(SPATIAL_DATA_DIR) is False:
+      os.makedirs(SPATIAL_DATA_DIR)
+
+    global_df.to_csv(f"{SPATIAL_DATA_DIR}/{variable}_global_morans_i.csv", index=False)
+    local_df.to_csv(f"{SPATIAL_DATA_DIR}/{variable}_local_clusters.csv", index=False)
+    run_profiler.count("rows", local_df.shape[0])
+
+def extract_arguments() -> Iterable[Union[str, list, int, float, bool]]:
+  """
+  Name: extract_arguments
+
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: variable - The datacube variable to look for clusters of
+          years - The years to test (None for every year with values)
+          contiguity - The neighbours of a district (queen or rook)
+          num_permutations - The number of permutations of the p-values
+          alpha - The significance level of the cluster labels
+          seed - The seed of the permutations
+          profile - Whether to profile the run
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-v", "--variable", type=str, required=False, default=DEFAULT_VARIABLE, choices=list(VARIABLES.keys()), help="The datacube variable to look for clusters of")
+  parser.add_argument("-y", "--years", type=int, nargs="+", required=False, default=None, help="The years to test, every year with values by default")
+  parser.add_argument("-c", "--contiguity", type=str, required=False, default=QUEEN, choices=CONTIGUITIES, help="Queen (shared corner) or rook (shared border) neighbours")
+  parser.add_argument("--permutations", type=int, required=False, default=DEFAULT_PERMUTATIONS, help="The number of permutations of the p-values")
+  parser.add_argument("--alpha", type=float, required=False, default=DEFAULT_ALPHA, help="The significance level of the cluster and hot spot labels")
+  parser.add_argument("--seed", type=int, required=False, default=SEED, help="The seed of the permutations")
+  add_profile_argument(parser)
+
+  args = parser.parse_args()
+
+  if args.permutations <= 0:
+    print(f"The number of permutations: {args.permutations} must be positive")
+    sys.exit(-1)
+
+  if args.alpha <= 0 or args.alpha >= 1:
+    print(f"The significance level: {args.alpha} must be between 0 and 1")
+    sys.exit(-1)
+
+  return args.variable, args.years, args.contiguity, args.permutations, args.alpha, args.seed, args.profile
+
+def years_with_values(variable: str, district_ids: np.ndarray) -> list:
+  # The years of the cube where any of the districts has a value
+  yearly = district_datacube.yearly(variable)
+  district_ids = district_ids[district_ids < yearly.shape[0]]
+  has_values = ~np.isnan(yearly[district_ids]).all(axis=0)
+  return [year for year, has_value in zip(district_datacube.years(), has_values) if has_value]
+
+if __name__ == "__main__":
+  main()
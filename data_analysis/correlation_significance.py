@@ -0,0 +1,340 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_PERMUTATIONS = 5000
+DEFAULT_BOOTSTRAPS = 2000
+DEFAULT_CONFIDENCE = 0.95
+SEED = 42
+
+# The resamples are computed in chunks of at most this many (resample, district, row,
+# metric) values so the tensors stay around a hundred MB whatever the number of resamples
+CHUNK_ELEMENTS = 1 << 24
+
+# Columns of the output
+DISTRICT_IDX_COL = "district_idx"
+METRIC_A_COL = "metric_a"
+METRIC_B_COL = "metric_b"
+ROWS_COL = "num_rows"
+CORRELATION_COL = "correlation"
+P_VALUE_COL = "p_value"
+Q_VALUE_COL = "q_value"
+CI_LOW_COL = "ci_low"
+CI_HIGH_COL = "ci_high"
+
+"""
+Notes:
+
+With around 20 years per district most of the correlations of a district's correlation
+matrix are noise, so every correlation gets a permutation p-value and a bootstrap
+confidence interval.
+
+The districts are packed into a (district, row, metric) tensor, padded with zero rows
+up to the longest district, and every resample is a tensor of row indexes drawn for all
+districts at once: a permutation of a district's rows for the permutation test (the
+padding sorts last so it is never mixed in) and rows drawn with replacement for the
+bootstrap. The correlations of every metric pair of every district under every resample
+of a chunk then come out of a single batched matrix product, so there is no Python loop
+per resample.
+
+Under a permutation the mean and standard deviation of a metric don't change, so the
+standardized metrics are permuted directly and the correlation is their mean product.
+Each metric is permuted against the unpermuted others, which is the null hypothesis of
+every pair at once. The p-value is two sided, (1 + the permutations at least as extreme)
+/ (1 + the permutations). The bootstrap recomputes the moments of every resample and the
+confidence interval is its percentile interval. The q-value is the Benjamini-Hochberg
+adjusted p-value over every correlation tested.
+
+The districts can be sharded across a process pool with workers, every shard drawing
+from its own stream of the seed's SeedSequence so the results don't depend on timing.
+"""
+
+def pack_districts(district_dfs: list, metrics: list) -> tuple:
+  """
+  Purpose: Packs the rows of every district into a padded tensor
+
+  Input: district_dfs - A dataframe per district
+         metrics - The metric columns
+
+  Output: values - A (district, row, metric) float64 tensor, 0 in the padding
+          num_rows - The number of rows of every district
+  """
+  num_rows = np.array([district_df.shape[0] for district_df in district_dfs], dtype=np.int64)
+  values = np.zeros((len(district_dfs), num_rows.max() if len(num_rows) > 0 else 0, len(metrics)))
+  for district_idx, district_df in enumerate(district_dfs):
+    values[district_idx, :num_rows[district_idx]] = district_df[metrics].to_numpy(dtype=np.float64)
+  return values, num_rows
+
+def row_mask(num_rows: np.ndarray, max_rows: int) -> np.ndarray:
+  return np.arange(max_rows)[None, :] < num_rows[:, None]
+
+def standardize(values: np.ndarray, num_rows: np.ndarray) -> np.ndarray:
+  # The z-scores of every metric of every district (population std), 0 in the padding
+  mask = row_mask(num_rows, values.shape[1])[:, :, None]
+  counts = np.maximum(num_rows, 1)[:, None, None]
+  means = values.sum(axis=1, keepdims=True) / counts
+  centered = np.where(mask, values - means, 0.0)
+  stds = np.sqrt((centered * centered).sum(axis=1, keepdims=True) / counts)
+  # A constant metric is all 0 so it correlates with nothing
+  return np.where(mask & (stds > 0), centered / np.where(stds > 0, stds, 1.0), 0.0)
+
+def correlations_from_moments(sums: np.ndarray, products: np.ndarray, num_rows: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Computes the correlation matrices from the sums and the sums of products of
+  the metrics
+
+  Input: sums - A (..., metric) tensor of the sums of every metric
+         products - A (..., metric, metric) tensor of the sums of the products of every pair
+         num_rows - The number of rows, broadcastable against the leading dimensions
+
+  Output: A (..., metric, metric) tensor of the correlations (NaN for a constant metric)
+  """
+  num_rows = num_rows[..., None, None]
+  covariances = num_rows * products - sums[..., :, None] * sums[..., None, :]
+  variances = np.diagonal(covariances, axis1=-2, axis2=-1)
+  with np.errstate(invalid="ignore", divide="ignore"):
+    correlations = covariances / np.sqrt(variances[..., :, None] * variances[..., None, :])
+  # A resample with a (nearly) constant metric has no correlation
+  tolerance = 1e-10 * num_rows * np.diagonal(products, axis1=-2, axis2=-1)[..., None]
+  degenerate = (variances[..., :, None] <= tolerance) | (variances[..., None, :] <= np.swapaxes(tolerance, -1, -2))
+  return np.where(degenerate, np.nan, np.clip(correlations, -1.0, 1.0))
+
+def chunk_size(num_resamples: int, values: np.ndarray) -> int:
+  return int(max(1, min(num_resamples, CHUNK_ELEMENTS // max(1, values.size))))
+
+def permutation_indexes(generator: np.random.Generator, num_permutations: int, num_rows: np.ndarray, max_rows: int) -> np.ndarray:
+  # Random keys with the padding sorted last, so argsort permutes only the real rows
+  keys = generator.random((num_permutations, len(num_rows), max_rows), dtype=np.float32)
+  keys[:, ~row_mask(num_rows, max_rows)] = np.inf
+  return np.argsort(keys, axis=2)
+
+def bootstrap_indexes(generator: np.random.Generator, num_bootstraps: int, num_rows: np.ndarray, max_rows: int) -> np.ndarray:
+  # Rows drawn with replacement from every district's own rows
+  draws = generator.random((num_bootstraps, len(num_rows), max_rows))
+  return np.minimum((draws * num_rows[None, :, None]).astype(np.int64), np.maximum(num_rows - 1, 0)[None, :, None])
+
+def permutation_p_values(values: np.ndarray, num_rows: np.ndarray, num_permutations: int, generator: np.random.Generator) -> tuple:
+  """
+  Purpose: Computes the correlation matrix of every district and the two sided
+  permutation p-value of every correlation
+
+  Input: values - The (district, row, metric) tensor
+         num_rows - The number of rows of every district
+         num_permutations - The number of permutations
+         generator - The random generator
+
+  Output: correlations - The (district, metric, metric) correlations
+          p_values - The (district, metric, metric) p-values
+  """
+  num_districts, max_rows, num_metrics = values.shape
+  z_scores = standardize(values, num_rows)
+  counts = np.maximum(num_rows, 1)[:, None, None]
+
+  z_scores_t = np.swapaxes(z_scores, 1, 2)
+  correlations = (z_scores_t @ z_scores) / counts
+  constant = np.all(z_scores == 0, axis=1)
+  correlations[constant[:, :, None] | constant[:, None, :]] = np.nan
+  observed = np.abs(correlations) - 1e-12
+
+  extreme = np.zeros(correlations.shape, dtype=np.int64)
+  district_idxs = np.arange(num_districts)[None, :, None]
+  remaining = num_permutations
+  while remaining > 0:
+    num_chunk = min(remaining, chunk_size(num_permutations, values))
+    permutations = permutation_indexes(generator, num_chunk, num_rows, max_rows)
+    permuted = z_scores[district_idxs, permutations]
+    # A batched matmul, much faster than the equivalent einsum
+    permuted_correlations = (z_scores_t[None] @ permuted) / counts[None]
+    extreme += np.sum(np.abs(permuted_correlations) >= observed[None], axis=0)
+    remaining -= num_chunk
+
+  p_values = (1 + extreme) / (1 + num_permutations)
+  p_values[np.isnan(correlations)] = np.nan
+  return correlations, p_values
+
+def bootstrap_intervals(values: np.ndarray, num_rows: np.ndarray, num_bootstraps: int, confidence: float, generator: np.random.Generator) -> tuple:
+  """
+  Purpose: Computes the percentile bootstrap confidence interval of every correlation of
+  every district
+
+  Input: values - The (district, row, metric) tensor
+         num_rows - The number of rows of every district
+         num_bootstraps - The number of bootstrap resamples
+         confidence - The confidence level of the intervals
+         generator - The random generator
+
+  Output: ci_low - The (district, metric, metric) lower bounds
+          ci_high - The (district, metric, metric) upper bounds
+  """
+  num_districts, max_rows, num_metrics = values.shape
+  mask = row_mask(num_rows, max_rows)
+
+  # Centering first keeps the moments from cancelling out
+  centered = np.where(mask[:, :, None], values - values.sum(axis=1, keepdims=True) / np.maximum(num_rows, 1)[:, None, None], 0.0)
+
+  # Only the pairs above the diagonal are kept for the percentiles
+  metric_a, metric_b = np.triu_indices(num_metrics, k=1)
+
+  district_idxs = np.arange(num_districts)[None, :, None]
+  resampled_correlations = []
+  remaining = num_bootstraps
+  while remaining > 0:
+    num_chunk = min(remaining, chunk_size(num_bootstraps, values))
+    resampled = centered[district_idxs, bootstrap_indexes(generator, num_chunk, num_rows, max_rows)]
+    resampled = np.where(mask[None, :, :, None], resampled, 0.0)
+    sums = resampled.sum(axis=2)
+    products = np.swapaxes(resampled, 2, 3) @ resampled
+    resampled_correlations.append(correlations_from_moments(sums, products, num_rows[None, :])[:, :, metric_a, metric_b])
+    remaining -= num_chunk
+
+  tail = (1 - confidence) / 2
+  pair_bounds = percentiles(np.concatenate(resampled_correlations, axis=0), [tail, 1 - tail])
+
+  ci_low, ci_high = np.full((2, num_districts, num_metrics, num_metrics), np.nan)
+  for ci, bounds in zip([ci_low, ci_high], pair_bounds):
+    ci[:, metric_a, metric_b] = bounds
+    ci[:, metric_b, metric_a] = bounds
+  return ci_low, ci_high
+
+def percentiles(samples: np.ndarray, quantiles: list) -> list:
+  """
+  Purpose: Computes quantiles over the first axis ignoring NaNs, interpolating linearly
+  like np.nanpercentile but with a single sort (np.nanpercentile is several times slower)
+
+  Input: samples - A (sample, ...) array, NaN for the samples to ignore
+         quantiles - The quantiles (between 0 and 1)
+
+  Output: A list with a (...) array per quantile, NaN where every sample is NaN
+  """
+  # NaNs sort last so the valid samples come first
+  ordered = np.sort(samples, axis=0)
+  num_valid = np.sum(~np.isnan(samples), axis=0)
+  last = np.maximum(num_valid - 1, 0)
+
+  results = []
+  for quantile in quantiles:
+    position = quantile * last
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, last)
+    lower_vals = np.take_along_axis(ordered, lower[None], axis=0)[0]
+    upper_vals = np.take_along_axis(ordered, upper[None], axis=0)[0]
+    result = lower_vals + (upper_vals - lower_vals) * (position - lower)
+    results.append(np.where(num_valid > 0, result, np.nan))
+  return results
+
+def significance_shard(values: np.ndarray, num_rows: np.ndarray, num_permutations: int, num_bootstraps: int, confidence: float, seed_sequence: np.random.SeedSequence) -> tuple:
+  """
+  Purpose: Computes the correlations, p-values and confidence intervals of a shard of
+  the districts (run in a worker process when sharded)
+
+  Input: values - The (district, row, metric) tensor of the shard
+         num_rows - The number of rows of every district of the shard
+         num_permutations - The number of permutations
+         num_bootstraps - The number of bootstrap resamples
+         confidence - The confidence level of the intervals
+         seed_sequence - The seed sequence of the shard
+
+  Output: A (correlations, p_values, ci_low, ci_high) tuple of (district, metric, metric) arrays
+  """
+  permutation_seed, bootstrap_seed = seed_sequence.spawn(2)
+  correlations, p_values = permutation_p_values(values, num_rows, num_permutations, np.random.default_rng(permutation_seed))
+
+  if num_bootstraps > 0:
+    ci_low, ci_high = bootstrap_intervals(values, num_rows, num_bootstraps, confidence, np.random.default_rng(bootstrap_seed))
+  else:
+    ci_low = np.full(correlations.shape, np.nan)
+    ci_high = np.full(correlations.shape, np.nan)
+
+  return correlations, p_values, ci_low, ci_high
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Adjusts p-values for the false discovery rate (Benjamini-Hochberg)
+
+  Input: p_values - The p-values (NaN ones are left out and stay NaN)
+
+  Output: The q-values
+  """
+  q_values = np.full(p_values.shape, np.nan)
+  tested = ~np.isnan(p_values)
+  num_tests = tested.sum()
+  if num_tests <= 0:
+    return q_values
+
+  order = np.argsort(p_values[tested])
+  ranked = p_values[tested][order] * num_tests / np.arange(1, num_tests + 1)
+  # The q-value of a rank is the smallest adjusted p-value at or above it
+  ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+
+  adjusted = np.empty(num_tests)
+  adjusted[order] = np.minimum(ranked, 1.0)
+  q_values[tested] = adjusted
+  return q_values
+
+def correlation_significance(
+  district_dfs: list,
+  metrics: list,
+  num_permutations: int = DEFAULT_PERMUTATIONS,
+  num_bootstraps: int = DEFAULT_BOOTSTRAPS,
+  confidence: float = DEFAULT_CONFIDENCE,
+  workers: int = 1,
+  seed: int = SEED
+) -> pd.DataFrame:
+  """
+  Purpose: Tests every correlation between the metrics of every district
+
+  Input: district_dfs - A dataframe per district (without missing values in the metrics)
+         metrics - The metric columns
+         num_permutations - The number of permutations of the p-values
+         num_bootstraps - The number of bootstrap resamples of the intervals (0 for none)
+         confidence - The confidence level of the intervals
+         workers - The number of processes to shard the districts across
+         seed - The seed of the resamples
+
+  Output: A tidy dataframe with a row per district (its position in district_dfs) and
+  metric pair with the number of rows, the correlation, its p-value and q-value and its
+  confidence interval
+  """
+  values, num_rows = pack_districts(district_dfs, metrics)
+  shards = np.array_split(np.arange(len(district_dfs)), max(1, min(workers, len(district_dfs))))
+  seed_sequences = np.random.SeedSequence(seed).spawn(len(shards))
+
+  if workers > 1 and len(shards) > 1:
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+      futures = [
+        executor.submit(significance_shard, values[shard], num_rows[shard], num_permutations, num_bootstraps, confidence, seed_sequence)
+        for shard, seed_sequence in zip(shards, seed_sequences)
+      ]
+      results = [future.result() for future in futures]
+  else:
+    results = [
+      significance_shard(values[shard], num_rows[shard], num_permutations, num_bootstraps, confidence, seed_sequence)
+      for shard, seed_sequence in zip(shards, seed_sequences)
+      if len(shard) > 0
+    ]
+
+  if len(results) <= 0:
+    return pd.DataFrame(columns=[DISTRICT_IDX_COL, METRIC_A_COL, METRIC_B_COL, ROWS_COL, CORRELATION_COL, P_VALUE_COL, Q_VALUE_COL, CI_LOW_COL, CI_HIGH_COL])
+
+  correlations, p_values, ci_low, ci_high = [np.concatenate(arrays, axis=0) for arrays in zip(*results)]
+
+  pairs = list(itertools.combinations(range(len(metrics)), 2))
+  metric_a = np.array([a for a, b in pairs])
+  metric_b = np.array([b for a, b in pairs])
+  district_idxs = np.repeat(np.arange(len(district_dfs)), len(pairs))
+
+  significance_df = pd.DataFrame({
+    DISTRICT_IDX_COL : district_idxs,
+    METRIC_A_COL : np.array(metrics, dtype=object)[np.tile(metric_a, len(district_dfs))],
+    METRIC_B_COL : np.array(metrics, dtype=object)[np.tile(metric_b, len(district_dfs))],
+    ROWS_COL : num_rows[district_idxs],
+    CORRELATION_COL : correlations[:, metric_a, metric_b].ravel(),
+    P_VALUE_COL : p_values[:, metric_a, metric_b].ravel(),
+    CI_LOW_COL : ci_low[:, metric_a, metric_b].ravel(),
+    CI_HIGH_COL : ci_high[:, metric_a, metric_b].ravel()
+  })
+  significance_df.insert(6, Q_VALUE_COL, benjamini_hochberg(significance_df[P_VALUE_COL].to_numpy()))
+
+  return significance_df
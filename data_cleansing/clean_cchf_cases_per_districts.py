@@ -6,7 +6,14 @@ import json
 import math
 
 from typing import Iterable, Union
-from shapely.geometry import shape, Point
+
+# The region registry lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.region_registry import region_registry
+from common.admin_locator import admin_locator, PROVINCE_LEVEL, DISTRICT_LEVEL
+from common.instrumentation import run_profiler, add_profile_argument
+from common.district_ids import district_id_registry, add_district_id_column, DISTRICT_ID_COL
+from common.datacube import district_datacube
 
 """
 Original column names for the extracted and validated CCHF data
@@ -26,51 +33,44 @@ CCHF_NUM_OF_DEATHS_COL = "deaths"
 CCHF_NUM_OF_TOT_CASES_COL = "total cases"	
 CCHF_NUM_OF_TOT_DEATHS_COL = "total deaths"
 
+CCHF_PROVINCE_COL = "province"
 CCHF_DISTRICT_COL = "district"
 
-MIN_LAT_KEY = "min_lat"
-MAX_LAT_KEY = "max_lat"
-MIN_LON_KEY = "min_lon"
-MAX_LON_KEY = "max_lon"
-
-COORDS_RANGE = {
-  "serbia" : {
-    MIN_LAT_KEY : 40,
-    MAX_LAT_KEY : 48,
-    MIN_LON_KEY : 18,
-    MAX_LON_KEY : 25
-  },
-  "pakistan" : {
-    MIN_LAT_KEY : 22,
-    MAX_LAT_KEY : 38,
-    MIN_LON_KEY : 60,
-    MAX_LON_KEY : 77
-  },
-  "afghanistan" : {
-    MIN_LAT_KEY : 29,
-    MAX_LAT_KEY : 39,
-    MIN_LON_KEY : 63,
-    MAX_LON_KEY : 70
-  }
+CCHF_DATA_DIR = "../data/individual_data_sets/CCHF_data"
+
+ISSUE_DATE_FORMAT = "%m/%d/%Y"
+
+# The datacube variable each column is written to
+DATACUBE_COLUMNS = {
+  CCHF_NUM_OF_CASES_COL : "cases",
+  CCHF_NUM_OF_DEATHS_COL : "deaths"
 }
 
 def main():
   
-  csv_datapath = extract_arguments()
+  csv_datapath, profile = extract_arguments()
+
+  with run_profiler.run(script="clean_cchf_cases_per_districts", report_dir=CCHF_DATA_DIR, profile=profile):
+    with run_profiler.stage("read_data"):
+      cchf_df = read_data(filepath = csv_datapath)
 
-  cchf_df = read_data(filepath = csv_datapath)
+    with run_profiler.stage("correlate_cchf_cases_with_district"):
+      cchf_df = correlate_cchf_cases_with_district(extracted_cchf_data=cchf_df)
 
-  cchf_df = correlate_cchf_cases_with_district(extracted_cchf_data=cchf_df)
+    with run_profiler.stage("save"):
+      cchf_df.to_csv(f"{CCHF_DATA_DIR}/cchf_district_data.csv", index=False)
 
-  cchf_df.to_csv("../data/individual_data_sets/CCHF_data/cchf_district_data.csv", index=False)
+    with run_profiler.stage("datacube"):
+      write_cchf_to_datacube(cchf_df=cchf_df)
 
-def extract_arguments() -> str:
+def extract_arguments() -> tuple:
   """
   Purpose: extracts the arguments specified by the user
 
   Input: None
 
   Output: filepath - The csv filepath specified by the user
+          profile - Whether to profile the run
   """
 
   CSV_FILE_ENDING = ".csv"
@@ -78,6 +78,7 @@ def extract_arguments() -> str:
   parser = argparse.ArgumentParser()
   
   parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the text file containing the links to pull the files from")
+  add_profile_argument(parser)
 
   args = parser.parse_args()
 
@@ -98,67 +99,81 @@ def extract_arguments() -> str:
     print(f"The filepath: {filepath} is either not a valid file or is not a csv.")
     sys.exit(-1)
 
-  return filepath
+  return filepath, args.profile
 
 def read_data(filepath: str) -> pd.DataFrame:
 
   return pd.read_csv(filepath)
 
 def correlate_cchf_cases_with_district(extracted_cchf_data: pd.DataFrame) -> pd.DataFrame:
+  """
+  Purpose: Assigns every report the province and district its region/city coordinates
+  fall in. The admin locator resolves the province first and then only tests that
+  province's districts
 
-  FEATURES_KEY = "features"
-  GEOMETRY_KEY = "geometry"
-  PROPERTIES_KEY = "properties"
-  NAME_KEY = "name"
+  Input: extracted_cchf_data - The extracted CCHF data
 
+  Output: The CCHF data with a province and a district column ("" when none was found)
+  and the district's id (see common/district_ids.py)
+  """
+  provinces = [""] * extracted_cchf_data.shape[0]
   districts = [""] * extracted_cchf_data.shape[0]
 
-  for cchf_idx, row in extracted_cchf_data.iterrows():
+  rows = zip(
+    extracted_cchf_data[CCHF_COUNTRY_COL].values,
+    extracted_cchf_data[CCHF_REG_CITY_LAT_COL].values,
+    extracted_cchf_data[CCHF_REG_CITY_LON_COL].values
+  )
 
-    COUNTRY_LOWERCASE = row[CCHF_COUNTRY_COL].lower()
-    GEOJSON_DATA = f"../data/geodata/{COUNTRY_LOWERCASE}/{COUNTRY_LOWERCASE}-districts.geojson"
+  for cchf_idx, (country, lat, lon) in enumerate(rows):
 
-    geodata = None
-    with open(GEOJSON_DATA, "r") as geo_file:
-      geodata = json.load(geo_file)
-
-    if COUNTRY_LOWERCASE not in COORDS_RANGE:
-      print(f"Cannot fetch coordinate info from internal database for {COUNTRY_LOWERCASE}")
+    if region_registry.has_country(country) is False:
+      print(f"Cannot fetch coordinate info from internal database for {country.lower()}")
       sys.exit(-1)
 
-    min_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LAT_KEY]
-    max_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LAT_KEY]
-    min_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LON_KEY]
-    max_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LON_KEY]
+    if math.isnan(lat) or math.isnan(lon):
+      continue
 
-    lat = row[CCHF_REG_CITY_LAT_COL]
-    lon = row[CCHF_REG_CITY_LON_COL]
+    located = admin_locator.locate(country, lat, lon)
+    run_profiler.count("points")
+
+    if located[PROVINCE_LEVEL] is not None:
+      provinces[cchf_idx] = located[PROVINCE_LEVEL]
+    if located[DISTRICT_LEVEL] is not None:
+      districts[cchf_idx] = located[DISTRICT_LEVEL]
 
-    if math.isnan(lat) or math.isnan(lon):
-      districts[cchf_idx] = ("")
-    else:
-      coordinate = Point(lon, lat)
-
-      polygon = None
-      if FEATURES_KEY in geodata:
-        for feature in geodata[FEATURES_KEY]:
-          properties = feature[PROPERTIES_KEY]
-          feature_name = properties[NAME_KEY]
-          polygon = shape(feature[GEOMETRY_KEY])
-          if polygon.contains(coordinate):
-            districts[cchf_idx] = feature_name
-
-      elif GEOMETRY_KEY in geodata:
-        properties = geodata[PROPERTIES_KEY]
-        feature_name = properties[NAME_KEY]
-        polygon = shape(geodata[GEOMETRY_KEY])
-        if polygon.contains(coordinate):
-          districts[cchf_idx] = feature_name
-        
   extracted_cchf_data.reset_index(inplace=True)
+  extracted_cchf_data[CCHF_PROVINCE_COL] = provinces
   extracted_cchf_data[CCHF_DISTRICT_COL] = districts
+  # A country whose GeoJSON was just dropped in has no district ids yet
+  district_id_registry.register_missing_districts(list(extracted_cchf_data[CCHF_COUNTRY_COL].unique()))
+  extracted_cchf_data = add_district_id_column(extracted_cchf_data, country_col=CCHF_COUNTRY_COL, district_col=CCHF_DISTRICT_COL)
+  run_profiler.count("rows", extracted_cchf_data.shape[0])
 
   return extracted_cchf_data
 
+def write_cchf_to_datacube(cchf_df: pd.DataFrame) -> None:
+  """
+  Purpose: Writes the cases and deaths reported in every district and month (by the
+  issue date of the reports) into the district datacube. Months without a report are
+  left empty rather than 0
+
+  Input: cchf_df - The CCHF data with the district ids
+
+  Output: None
+  """
+  issue_dates = pd.to_datetime(cchf_df[CCHF_ISSUE_DATE_COL], format=ISSUE_DATE_FORMAT, errors="coerce")
+
+  monthly_df = pd.DataFrame({
+    DISTRICT_ID_COL : cchf_df[DISTRICT_ID_COL].values,
+    "year" : issue_dates.dt.year.values,
+    "month" : issue_dates.dt.month.values,
+    **{column : cchf_df[column].values for column in DATACUBE_COLUMNS}
+  })
+  monthly_df = monthly_df[(monthly_df[DISTRICT_ID_COL] >= 0) & monthly_df["year"].notna()]
+  monthly_df = monthly_df.groupby([DISTRICT_ID_COL, "year", "month"], as_index=False)[list(DATACUBE_COLUMNS.keys())].sum(min_count=1)
+
+  run_profiler.count("datacube_values", district_datacube.write_frame(monthly_df, DATACUBE_COLUMNS))
+
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -2,26 +2,25 @@ import argparse
 import os
 import pandas as pd
 import re
-import spacy
 import sys
+import time
 
 from datetime import datetime
 
 from geopy.extra.rate_limiter import RateLimiter
 from geopy import Nominatim
 
-from epitator.geoname_annotator import GeonameAnnotator
-from epitator.date_annotator import DateAnnotator
-from epitator.count_annotator import CountAnnotator
-from epitator.annotator import AnnoDoc
-
 from typing import Iterable, Union
-from transformers import BartForConditionalGeneration, BartTokenizer
 from tqdm import tqdm
 
-os.environ['SPACY_MODEL_SHORTCUT_LINK'] = 'en_core_web_trf'
+# The run profiler lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
 
-spacy.prefer_gpu()
+from rule_extractors import EXTRACTION_COLS, RULE_SUMMARY_KEY, RULE_TIER_KEY, RULE_TIERS, extract_with_rules
+from near_duplicates import DEFAULT_THRESHOLD, DIFF, REPRESENTATIVE, REUSE, plan_summaries
+from summarization import add_summarizer_arguments, bart_summarizer, summarizer_settings
+from epitator_backend import add_nlp_arguments, epitator_backend, epitator_extract, nlp_settings
 
 sys.path.append('../EpiTator')
 
@@ -30,25 +29,39 @@ geocode = RateLimiter(locator.geocode, min_delay_seconds=1/20)
 
 locator = Nominatim(user_agent="ppcoom")
 geocode = RateLimiter(locator.geocode, min_delay_seconds=1/20)
-dengue_regex = re.compile(
-    r'([A-Za-z ]+).*\[w\/e (.+)\] \/ (.+) \/ (.+) \/ (.+) \/ (.+) \/ (.+)', re.MULTILINE)
-
-tqdm.pandas()
-
-# setup our BART transformer summarization model
-print('loading transformers')
-tokenizer = BartTokenizer.from_pretrained('facebook/bart-large-cnn')
-model = BartForConditionalGeneration.from_pretrained(
-    'facebook/bart-large-cnn')
 
 COUNTRY_COL = "country"
+DISEASE_NAME_COL = "diseasename"
+ISSUE_DATE_COL = "issue_date"
 CONTENT_COL = "content"
 SUMMARY_COL = "summary"
+EXTRACTION_TIER_COL = "extraction_tier"
+
+# The tier of the articles the rule extractors couldn't parse confidently
+MODEL_TIER = "model"
 
 DATA_DIR = "../data"
 SUMMARIZED_DATA_DIR = f"{DATA_DIR}/summarized"
 EXTRACTED_DATA_DIR = f"{DATA_DIR}/extracted"
 
+DEFAULT_DISEASES = ["Crimean-Congo Hemorrhagic Fever"]
+
+# The short names used in the output filenames (any other disease gets a slug of its name)
+DISEASE_FILE_NAMES = {
+  "crimean-congo hemorrhagic fever" : "cchf",
+  "dengue/dhf" : "dengue",
+  "dengue" : "dengue"
+}
+
+# The number of rows of the promed export read at a time
+READ_CHUNK_SIZE = 10000
+
+# The columns of the yearly roll-ups
+YEAR_COL = "year"
+REPORTS_COL = "reports"
+CASES_COL = "cases"
+DEATHS_COL = "deaths"
+
 def extract_arguments() -> Iterable[Union[str, list]]:
   """
   Name: extract_arguments
@@ -58,7 +71,12 @@ def extract_arguments() -> Iterable[Union[str, list]]:
   Input: None
 
   Output: filepath - The csv filepath specified by the user
+          diseases - The diseases specified by the user
           countries - The countries specified by the user
+          near_duplicate_threshold - The similarity above which articles are summarized once (0 to disable)
+          settings - The settings of the BART summarizer
+          spacy_settings - The settings of EpiTator's spaCy backend
+          profile - Whether to profile the run
   """
 
   CSV_FILE_ENDING = ".csv"
@@ -66,7 +84,12 @@ def extract_arguments() -> Iterable[Union[str, list]]:
   parser = argparse.ArgumentParser()
   
   parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the promed data to analyze")
+  parser.add_argument("-d", "--diseases", nargs="+", required=False, default=DEFAULT_DISEASES, help="The diseases (as in the diseasename column) to process, each gets its own outputs")
   parser.add_argument("-c", "--countries", nargs="+", required=True, help="The countries to filter for in the data")
+  parser.add_argument("--near-duplicate-threshold", type=float, required=False, default=DEFAULT_THRESHOLD, help="The estimated Jaccard similarity above which articles are treated as near duplicates and summarized once (0 to disable)")
+  add_summarizer_arguments(parser)
+  add_nlp_arguments(parser)
+  add_profile_argument(parser)
 
   args = parser.parse_args()
 
@@ -100,41 +123,127 @@ def extract_arguments() -> Iterable[Union[str, list]]:
   if invalid_country_specified:
     sys.exit(-1)
 
-  return filepath, args.countries
+  """
+  Validate the diseases specified are valid strings
+  """
+  for disease in args.diseases:
+    if len(disease.strip()) <= 0:
+      print(f"The disease: {disease} is not valid")
+      sys.exit(-1)
 
-def read_data(csv_filepath: str) -> pd.DataFrame:
   """
-  Name: read_data
+  Validate the near duplicate threshold is within [0, 1]
+  """
+  near_duplicate_threshold = args.near_duplicate_threshold
+  if near_duplicate_threshold < 0 or near_duplicate_threshold > 1:
+    print(f"The near duplicate threshold: {near_duplicate_threshold} must be between 0 and 1")
+    sys.exit(-1)
 
-  Purpose: To read the data inside the csv filepath specified
+  """
+  Validate the generation and spaCy settings are positive
+  """
+  for setting, val in [("number of beams", args.num_beams), ("max length", args.max_length), ("spaCy batch size", args.spacy_batch_size), ("number of spaCy processes", args.spacy_n_process)]:
+    if val is not None and val <= 0:
+      print(f"The {setting}: {val} must be positive")
+      sys.exit(-1)
+
+  return filepath, args.diseases, args.countries, near_duplicate_threshold, summarizer_settings(args), nlp_settings(args), args.profile
+
+def read_filtered_data(csv_filepath: str, diseases: list, countries: list) -> pd.DataFrame:
+  """
+  Name: read_filtered_data
+
+  Purpose: Reads the articles of the specified diseases and countries in a single pass
+  over the promed export, a chunk of rows at a time so the whole export is never in memory
 
   Input: csv_filepath - The filepath to the csv
+         diseases - The diseases we should filter on
+         countries - The countries we should filter on
 
-  Output: A DataFrame representation of the csv data
+  Output: A DataFrame of the articles of every disease and country
   """
-  return pd.read_csv(csv_filepath)
+  filtered_chunks = []
+  for promed_chunk in pd.read_csv(csv_filepath, chunksize=READ_CHUNK_SIZE):
+    run_profiler.count("rows", promed_chunk.shape[0])
+    filtered_chunks.append(filter_df(promed_chunk, diseases, countries))
 
-def filter_df_by_countries(promed_df: pd.DataFrame, countries_to_srch_for: list) -> pd.DataFrame:
+  # An export without any rows has no chunks
+  if len(filtered_chunks) <= 0:
+    return pd.read_csv(csv_filepath, nrows=0)
+
+  return pd.concat(filtered_chunks, ignore_index=True)
+
+def filter_df(promed_df: pd.DataFrame, diseases: list, countries: list) -> pd.DataFrame:
   """
-  Name: filter_df_by_countries
+  Name: filter_df
 
-  Purpose: Filter the specified data frame by the countries specified
+  Purpose: Filter the specified data frame by the diseases and countries specified
 
   Input: promed_df - The promed dataframe
-         countries_to_srch_for - The countries we shoud filter on
+         diseases - The diseases we should filter on
+         countries - The countries we shoud filter on
 
   Output: A new filtered dataframe
   """
-  filtered_pd = None
-  for country in countries_to_srch_for:
-    country_filtered_df = promed_df.loc[(promed_df[COUNTRY_COL].str.lower() == country.lower())]
-    
-    if filtered_pd is None:
-      filtered_pd = country_filtered_df
-    else:
-      filtered_pd.append(country_filtered_df)
-  
-  return filtered_pd
+  diseases = [disease.lower() for disease in diseases]
+  countries = [country.lower() for country in countries]
+
+  return promed_df.loc[
+    promed_df[DISEASE_NAME_COL].str.lower().isin(diseases) &
+    promed_df[COUNTRY_COL].str.lower().isin(countries)
+  ]
+
+def disease_file_name(disease: str) -> str:
+  disease = disease.lower().strip()
+  if disease in DISEASE_FILE_NAMES:
+    return DISEASE_FILE_NAMES[disease]
+  return re.sub(r"[^a-z0-9]+", "_", disease).strip("_")
+
+def split_by_disease(promed_df: pd.DataFrame, diseases: list) -> dict:
+  """
+  Name: split_by_disease
+
+  Purpose: Routes the rows of a dataframe to the disease they are about
+
+  Input: promed_df - The dataframe of every disease
+         diseases - The diseases specified
+
+  Output: A dictionary of the rows of every disease (empty for a disease without articles)
+  """
+  disease_names = promed_df[DISEASE_NAME_COL].str.lower() if DISEASE_NAME_COL in promed_df.columns else pd.Series(dtype=str)
+  return {disease : promed_df.loc[disease_names == disease.lower()] for disease in diseases}
+
+def yearly_rollup(extracted_df: pd.DataFrame) -> pd.DataFrame:
+  """
+  Name: yearly_rollup
+
+  Purpose: Rolls the extracted articles of a disease up into the number of reports and
+  the extracted cases and deaths per country and year (of the article's issue date)
+
+  Input: extracted_df - The extracted articles of a disease
+
+  Output: A dataframe of the country, year, reports, cases and deaths
+  """
+  rollup_cols = [COUNTRY_COL, YEAR_COL, REPORTS_COL, CASES_COL, DEATHS_COL]
+  if extracted_df.shape[0] <= 0:
+    return pd.DataFrame(columns=rollup_cols)
+
+  rollup_df = pd.DataFrame({
+    COUNTRY_COL : extracted_df[COUNTRY_COL],
+    YEAR_COL : pd.to_datetime(extracted_df[ISSUE_DATE_COL], errors="coerce").dt.year,
+    CASES_COL : pd.to_numeric(extracted_df[CASES_COL], errors="coerce"),
+    DEATHS_COL : pd.to_numeric(extracted_df[DEATHS_COL], errors="coerce")
+  }).dropna(subset=[YEAR_COL])
+  rollup_df[YEAR_COL] = rollup_df[YEAR_COL].astype(int)
+
+  # A year where no article had a count stays empty rather than becoming 0
+  rollup_df = rollup_df.groupby([COUNTRY_COL, YEAR_COL]).agg(**{
+    REPORTS_COL : (CASES_COL, "size"),
+    CASES_COL : (CASES_COL, lambda counts: counts.sum(min_count=1)),
+    DEATHS_COL : (DEATHS_COL, lambda counts: counts.sum(min_count=1))
+  }).reset_index()
+
+  return rollup_df[rollup_cols]
 
 def clean_df_content(promed_df: pd.DataFrame, debug: bool = False) -> pd.DataFrame:
 
@@ -145,6 +254,7 @@ def clean_df_content(promed_df: pd.DataFrame, debug: bool = False) -> pd.DataFra
     content = row[CONTENT_COL]
 
     cleaned_content = clean(content)
+    run_profiler.count("articles")
 
     if (debug):
       print("---------------------------")
@@ -176,15 +286,17 @@ def clean(content):
   cleaned = split[12:last_index]
   return '\n'.join([x for x in cleaned if x])
 
-def summarize_df_content(promed_df: pd.DataFrame) -> pd.DataFrame:
+def summarize_df_content(promed_df: pd.DataFrame, cleaned_promed_df: pd.DataFrame, near_duplicate_threshold: float = DEFAULT_THRESHOLD) -> pd.DataFrame:
   
   summarized_df = {}
 
-  for index, row in promed_df.iterrows():
-
-    content = row[CONTENT_COL]
+  summaries = summarize_near_duplicates(
+    contents = promed_df[CONTENT_COL].tolist(),
+    cleaned_contents = cleaned_promed_df[CONTENT_COL].tolist(),
+    near_duplicate_threshold = near_duplicate_threshold
+  )
 
-    summarized_content = summarizer(content)
+  for (index, row), summarized_content in zip(promed_df.iterrows(), summaries):
 
     for col in promed_df.columns:
 
@@ -200,151 +312,273 @@ def summarize_df_content(promed_df: pd.DataFrame) -> pd.DataFrame:
 
   return pd.DataFrame(summarized_df)
 
+def summarize_near_duplicates(contents: list, cleaned_contents: list, near_duplicate_threshold: float = DEFAULT_THRESHOLD) -> list:
+  """
+  Name: summarize_near_duplicates
+
+  Purpose: Summarizes the articles, summarizing every cluster of near duplicate articles once
+
+  Input: contents - The contents of the articles
+         cleaned_contents - The cleaned contents of the articles (which are compared)
+         near_duplicate_threshold - The similarity above which articles are near duplicates (0 to disable)
+
+  Output: The summary of every article
+  """
+  if near_duplicate_threshold > 0:
+    plan = plan_summaries(cleaned_contents, threshold=near_duplicate_threshold)
+  else:
+    plan = [(REPRESENTATIVE, position, None) for position in range(len(contents))]
+
+  summaries = []
+  full_durations = []
+  diff_durations = []
+
+  for position, (action, representative, new_text) in enumerate(plan):
+    start = time.perf_counter()
+
+    # The representative of a cluster always comes before the rest of it
+    if action == REPRESENTATIVE:
+      summaries.append(summarizer(contents[position]))
+      full_durations.append(time.perf_counter() - start)
+    elif action == REUSE:
+      summaries.append(" ".join(new_text.split() + [summaries[representative]]))
+    else:
+      summaries.append(summarizer(new_text))
+      diff_durations.append(time.perf_counter() - start)
+
+    run_profiler.count("articles")
+    run_profiler.count(f"summaries_{action}")
+
+  report_near_duplicates(plan, full_durations, diff_durations)
+
+  return summaries
+
+def report_near_duplicates(plan: list, full_durations: list, diff_durations: list) -> None:
+  total = len(plan)
+  if total <= 0:
+    return
+
+  num_clusters = sum(1 for action, representative, new_text in plan if action == REPRESENTATIVE)
+  num_reused = sum(1 for action, representative, new_text in plan if action == REUSE)
+  num_diffed = sum(1 for action, representative, new_text in plan if action == DIFF)
+
+  # Estimate the time saved from the average time of a full summary
+  mean_full_duration = sum(full_durations) / len(full_durations) if len(full_durations) > 0 else 0
+  time_saved = mean_full_duration * num_reused + sum(mean_full_duration - duration for duration in diff_durations)
+  run_profiler.count("near_duplicate_clusters", num_clusters)
+
+  print(f"Near duplicates: {total} articles in {num_clusters} clusters (cluster ratio {num_clusters / total:.2f})")
+  print(f"  {num_reused} reused a summary, {num_diffed} summarized only their new lines, {num_clusters + num_diffed} model invocations instead of {total}")
+  print(f"  Estimated time saved: {time_saved:.1f}s")
+
 def summarizer(text: str) -> str:
-  input_ids = tokenizer(text, return_tensors='pt', max_length=1024,
-                        padding=True, truncation=True)['input_ids']
-  summary_ids = model.generate(input_ids)
-  summary = ''.join([tokenizer.decode(s) for s in summary_ids])
-  summary = summary.replace('<s>', '').replace('</s>', '')
-  return summary
+  return bart_summarizer.summarize(text)
+
+def apply_rule_extractors(promed_df: pd.DataFrame) -> list:
+  """
+  Name: apply_rule_extractors
+
+  Purpose: Runs the rule extractors over the content of every article
+
+  Input: promed_df - The cleaned promed dataframe
+
+  Output: A list with the rule extraction of every row (None where no rule parsed
+  the article confidently, those fall through to the model path)
+  """
+  rule_extractions = []
+
+  for content in promed_df[CONTENT_COL]:
+    rule_extraction = extract_with_rules(content)
+    run_profiler.count("articles")
+
+    if rule_extraction is not None:
+      run_profiler.count(f"tier_{rule_extraction[RULE_TIER_KEY]}")
+    else:
+      run_profiler.count(f"tier_{MODEL_TIER}")
+
+    rule_extractions.append(rule_extraction)
+
+  return rule_extractions
+
+def build_rule_tier_dfs(promed_df: pd.DataFrame, rule_extractions: list) -> Iterable[pd.DataFrame]:
+  """
+  Name: build_rule_tier_dfs
+
+  Purpose: Builds the summarized and extracted rows of the articles parsed by the
+  rule extractors, in the same shape as summarize_df_content and extract_cchf_data_from_df.
+  The summary of an article is the text its counts were extracted from
+
+  Input: promed_df - The promed dataframe
+         rule_extractions - The rule extraction of every row of promed_df
+
+  Output: summarized_df - The summarized rows of the articles parsed by the rules
+          extracted_df - The extracted rows of the articles parsed by the rules
+  """
+  summarized_df = {}
+  extracted_df = {}
+
+  for (index, row), rule_extraction in zip(promed_df.iterrows(), rule_extractions):
+
+    if rule_extraction is None:
+      continue
+
+    for col in promed_df.columns:
+
+      row_val = row[col]
+      if col == SUMMARY_COL:
+        row_val = rule_extraction[RULE_SUMMARY_KEY]
+
+      if col != CONTENT_COL:
+        summarized_df.setdefault(col, []).append(row_val)
+        extracted_df.setdefault(col, []).append(row_val)
+
+    for col in EXTRACTION_COLS:
+      extracted_df.setdefault(col, []).append(rule_extraction[col])
+    extracted_df.setdefault(EXTRACTION_TIER_COL, []).append(rule_extraction[RULE_TIER_KEY])
+
+  return pd.DataFrame(summarized_df), pd.DataFrame(extracted_df)
+
+def merge_tiers(rule_tier_df: pd.DataFrame, rule_tier_positions: list, model_tier_df: pd.DataFrame, model_tier_positions: list) -> pd.DataFrame:
+  # Put the articles of both tiers back in the order they were read in
+  rule_tier_df = rule_tier_df.set_axis(rule_tier_positions)
+  model_tier_df = model_tier_df.set_axis(model_tier_positions)
+  return pd.concat([rule_tier_df, model_tier_df]).sort_index().reset_index(drop=True)
+
+def report_extraction_tiers(rule_extractions: list) -> None:
+  total = len(rule_extractions)
+  tier_counts = {tier : 0 for tier in RULE_TIERS + [MODEL_TIER]}
+  for rule_extraction in rule_extractions:
+    tier = rule_extraction[RULE_TIER_KEY] if rule_extraction is not None else MODEL_TIER
+    tier_counts[tier] += 1
+
+  print("Articles handled by each extraction tier:")
+  for tier, count in tier_counts.items():
+    share = count / total * 100 if total > 0 else 0
+    print(f"  {tier}: {count} ({share:.1f}%)")
 
 def extract_cchf_data_from_df(promed_df: pd.DataFrame) -> pd.DataFrame:
 
-  promed_df[[
-    'admin1_code',
-    'admin2_code',
-    'admin3_code',
-    'admin4_code',
-    'location_name',
-    'location_lat',
-    'location_lon',
-    'cases',
-    'cases_tags',
-    'deaths',
-    'deaths_tags',
-    'dates_start',
-    'dates_end',
-  ]] = promed_df[SUMMARY_COL].progress_apply(epitator_extract)
+  # The summaries are parsed by spaCy in batches and the parsed docs handed to the annotators
+  docs = epitator_backend.parse_docs(promed_df[SUMMARY_COL].tolist())
+
+  extractions = []
+  for doc in tqdm(docs, total=len(promed_df)):
+    extractions.append(epitator_extract(doc).tolist())
+    run_profiler.count("articles")
+
+  promed_df[EXTRACTION_COLS] = pd.DataFrame(extractions, index=promed_df.index)
   promed_df = promed_df.applymap(lambda x: x[0] if isinstance(
       x, list) and len(x) > 0 else x)
   promed_df = promed_df.applymap(lambda y: pd.NA if isinstance(
       y, (list, str)) and len(y) == 0 else y)
+  promed_df[EXTRACTION_TIER_COL] = MODEL_TIER
   promed_df = promed_df.reset_index(drop=True)
 
   return promed_df
 
-# function that extracts location names/admin codes/lat/lng, case and death counts, and date ranges from the input string
-# uses epitator since it already trained rules for extracting medical/infectious disease data
-def epitator_extract(txt: str, max_ents: int = 1) -> dict:
-  # input string and add annotators
-  doc = AnnoDoc(txt)
-  doc.add_tiers(GeonameAnnotator())
-  doc.add_tiers(CountAnnotator())
-  doc.add_tiers(DateAnnotator())
-
-  # extract geographic data
-  geos = doc.tiers["geonames"].spans
-  geo_admin1s = [x.geoname.admin1_code for x in geos]
-  geo_admin2s = [x.geoname.admin2_code for x in geos]
-  geo_admin3s = [x.geoname.admin3_code for x in geos]
-  geo_admin4s = [x.geoname.admin4_code for x in geos]
-  geo_names = [x.geoname.name for x in geos]
-  geo_lats = [x.geoname.latitude for x in geos]
-  geo_lons = [x.geoname.longitude for x in geos]
-
-  # extract case counts and death counts
-  counts = doc.tiers["counts"].spans
-  cases_counts = [x.metadata['count'] for x in counts if 'case' in x.metadata['attributes']
-                  and 'death' not in x.metadata['attributes']]
-  cases_tags = [x.metadata['attributes']
-                for x in counts if 'case' in x.metadata['attributes'] and 'death' not in x.metadata['attributes']]
-  death_counts = [x.metadata['count']
-                  for x in counts if 'death' in x.metadata['attributes']]
-  death_tags = [x.metadata['attributes']
-                for x in counts if 'death' in x.metadata['attributes']]
-
-  # extract the date range
-  dates = doc.tiers["dates"].spans
-  dates_start = [pd.to_datetime(
-      x.metadata["datetime_range"][0], errors='coerce') for x in dates]
-  dates_end = [pd.to_datetime(
-      x.metadata["datetime_range"][1], errors='coerce') for x in dates]
-
-  # return only max_ents entities from the extracted lists
-  # currently set to the first result for each list, since that is usually the most important one
-  # and other ones can be filler/garbage data
-  return pd.Series([
-    geo_admin1s[:max_ents],
-    geo_admin2s[:max_ents],
-    geo_admin3s[:max_ents],
-    geo_admin4s[:max_ents],
-    geo_names[:max_ents],
-    geo_lats[:max_ents],
-    geo_lons[:max_ents],
-    cases_counts[:max_ents],
-    cases_tags[:max_ents],
-    death_counts[:max_ents],
-    death_tags[:max_ents],
-    dates_start[:max_ents],
-    dates_end[:max_ents],
-  ])
-
 def main():
   
   print("Extracting the specified arguments")
 
-  csv_filepath, countries = extract_arguments()
+  csv_filepath, diseases, countries, near_duplicate_threshold, settings, spacy_settings, profile = extract_arguments()
 
-  print("Reading the promed data")
+  bart_summarizer.configure(**settings)
+  epitator_backend.configure(**spacy_settings)
 
-  orig_promed_df = read_data(
-    csv_filepath = csv_filepath
-  )
+  with run_profiler.run(script="clean_cchf_data", report_dir=EXTRACTED_DATA_DIR, profile=profile):
+    print("Reading and filtering the promed data")
 
-  print("Filtering the promed data")
+    # Every disease is read in the same pass over the export
+    with run_profiler.stage("read_filtered_data"):
+      filtered_promed_df = read_filtered_data(
+        csv_filepath = csv_filepath,
+        diseases = diseases,
+        countries = countries
+      )
 
-  filtered_promed_df = filter_df_by_countries(
-    promed_df = orig_promed_df,
-    countries_to_srch_for = countries
-  )
+    print(filtered_promed_df)
 
-  print(filtered_promed_df)
+    print("Cleaning the promed data")
 
-  print("Cleaning the promed data")
+    with run_profiler.stage("clean_df_content"):
+      cleaned_promed_content_df = clean_df_content(
+        promed_df = filtered_promed_df
+      )
 
-  cleaned_promed_content_df = clean_df_content(
-    promed_df = filtered_promed_df
-  )
+    print("Extracting the structured articles with the rule extractors")
 
-  print("Summarizing dataframe contents")
-  summarized_promed_data = summarize_df_content(
-    promed_df = filtered_promed_df
-  )
-  
-  if os.path.isdir(SUMMARIZED_DATA_DIR) is False:
-    os.mkdir(SUMMARIZED_DATA_DIR)
+    with run_profiler.stage("apply_rule_extractors"):
+      rule_extractions = apply_rule_extractors(
+        promed_df = cleaned_promed_content_df
+      )
 
-  csv_countries_selected = ""
-  for country in countries:
-    csv_countries_selected += f"_{country.lower()}"
+    report_extraction_tiers(rule_extractions)
 
-  print("Saving summarized promed data")
+    with run_profiler.stage("build_rule_tier_dfs"):
+      rule_summarized_df, rule_extracted_df = build_rule_tier_dfs(
+        promed_df = cleaned_promed_content_df,
+        rule_extractions = rule_extractions
+      )
 
-  csv_country_summarized_data = f"summarized_promed_cchf_data"
-  summarized_promed_data.to_csv(f"{SUMMARIZED_DATA_DIR}/{csv_country_summarized_data}{csv_countries_selected}.csv", index=False)
+    # Only the articles the rules couldn't parse go through BART and EpiTator
+    rule_tier_positions = [idx for idx, rule_extraction in enumerate(rule_extractions) if rule_extraction is not None]
+    model_tier_positions = [idx for idx, rule_extraction in enumerate(rule_extractions) if rule_extraction is None]
+    model_tier_promed_df = filtered_promed_df.iloc[model_tier_positions]
 
-  print("Extracting promed data")
+    print("Summarizing dataframe contents")
+    with run_profiler.stage("summarize_df_content"):
+      model_summarized_df = summarize_df_content(
+        promed_df = model_tier_promed_df,
+        cleaned_promed_df = cleaned_promed_content_df.iloc[model_tier_positions],
+        near_duplicate_threshold = near_duplicate_threshold
+      )
 
-  extraced_promed_data_df = extract_cchf_data_from_df(
-    promed_df = summarized_promed_data
-  )
+    summarized_promed_data = merge_tiers(rule_summarized_df, rule_tier_positions, model_summarized_df, model_tier_positions)
+    
+    if os.path.isdir(SUMMARIZED_DATA_DIR) is False:
+      os.mkdir(SUMMARIZED_DATA_DIR)
+
+    csv_countries_selected = ""
+    for country in countries:
+      csv_countries_selected += f"_{country.lower()}"
+
+    print("Saving summarized promed data")
+
+    for disease, disease_summarized_df in split_by_disease(summarized_promed_data, diseases).items():
+      csv_disease_summarized_data = f"summarized_promed_{disease_file_name(disease)}_data"
+      disease_summarized_df.to_csv(f"{SUMMARIZED_DATA_DIR}/{csv_disease_summarized_data}{csv_countries_selected}.csv", index=False)
+
+    print("Extracting promed data")
+
+    with run_profiler.stage("extract_cchf_data_from_df"):
+      model_extracted_df = pd.DataFrame()
+      if len(model_summarized_df) > 0:
+        model_extracted_df = extract_cchf_data_from_df(
+          promed_df = model_summarized_df
+        )
+
+    extraced_promed_data_df = merge_tiers(rule_extracted_df, rule_tier_positions, model_extracted_df, model_tier_positions)
+
+    print("Saving extracted promed data")
+
+    if os.path.isdir(EXTRACTED_DATA_DIR) is False:
+      os.mkdir(EXTRACTED_DATA_DIR)
+
+    # Every disease gets its own extracted data and yearly roll-up
+    for disease, disease_extracted_df in split_by_disease(extraced_promed_data_df, diseases).items():
+      print(f"{disease}: {disease_extracted_df.shape[0]} articles")
+      run_profiler.count(f"articles_{disease_file_name(disease)}", disease_extracted_df.shape[0])
+
+      csv_disease_extracted_data = f"extracted_promed_{disease_file_name(disease)}_data"
+      disease_extracted_df.to_csv(f"{EXTRACTED_DATA_DIR}/{csv_disease_extracted_data}{csv_countries_selected}.csv", index=False)
 
-  print("Saving extracted promed data")
+      with run_profiler.stage("yearly_rollup"):
+        disease_yearly_df = yearly_rollup(
+          extracted_df = disease_extracted_df
+        )
 
-  if os.path.isdir(EXTRACTED_DATA_DIR) is False:
-    os.mkdir(EXTRACTED_DATA_DIR)
-  csv_country_extracted_data = f"extracted_promed_cchf_data"
-  extraced_promed_data_df.to_csv(f"{EXTRACTED_DATA_DIR}/{csv_country_extracted_data}{csv_countries_selected}.csv", index=False)
+      csv_disease_yearly_data = f"yearly_promed_{disease_file_name(disease)}_data"
+      disease_yearly_df.to_csv(f"{EXTRACTED_DATA_DIR}/{csv_disease_yearly_data}{csv_countries_selected}.csv", index=False)
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,259 @@
+import os
+import re
+import pandas as pd
+import spacy
+
+DEFAULT_SPACY_MODEL = "en_core_web_md"
+
+# The components EpiTator reads from (tags, lemmas, dependencies, noun chunks and entities).
+# Every other component of the model is disabled
+EPITATOR_COMPONENTS = ["tok2vec", "transformer", "tagger", "morphologizer", "parser", "attribute_ruler", "lemmatizer", "ner"]
+
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_N_PROCESS = 1
+
+# The number of articles parsed before their docs are handed to the annotators
+CHUNK_SIZE = 512
+
+# SpacyAnnotator parses a document in groups of 10 sentences to bound spaCy's memory use
+SENTENCE_GROUP_SIZE = 10
+
+AMBIGUOUS_YEAR_REGEX = re.compile(r'\d{1,4}$', re.I)
+
+"""
+Notes:
+
+EpiTator loads its spaCy model when it is first imported, from SPACY_MODEL_SHORTCUT_LINK
+(en_core_web_md when it isn't set), and its annotators then parse every document on
+their own, one at a time. The backend sets the model before importing EpiTator (so it
+has to be configured before anything imports epitator), disables the components EpiTator
+never reads and parses the articles with nlp.pipe in batches (across n_process processes
+when asked to). The parsed docs are turned into the spacy.* tiers the same way
+SpacyAnnotator does, so the annotators find them already there and never parse again.
+
+The transformer model (en_core_web_trf) is the most accurate but several times slower
+than en_core_web_md on CPU, benchmarks/benchmark_spacy_models.py compares their speed and
+how often their extractions agree. The GPU is only used when prefer_gpu is set.
+"""
+
+class EpiTatorBackend:
+  """
+  Purpose: Loads EpiTator with a configurable spaCy model and parses the articles in batches
+
+  Input: model - The name of the spaCy model
+         disable - The components to disable on top of the ones EpiTator doesn't read
+         batch_size - The number of texts per nlp.pipe batch
+         n_process - The number of processes nlp.pipe parses with
+         prefer_gpu - Whether to run spaCy on the GPU when there is one
+  """
+
+  def __init__(self, model: str = DEFAULT_SPACY_MODEL, disable: list = [], batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = DEFAULT_N_PROCESS, prefer_gpu: bool = False):
+    self.nlp = None
+    self.configure(model, disable, batch_size, n_process, prefer_gpu)
+
+  def configure(self, model: str = DEFAULT_SPACY_MODEL, disable: list = [], batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = DEFAULT_N_PROCESS, prefer_gpu: bool = False) -> None:
+    """
+    Purpose: Changes the settings of the backend. The model can't be changed once loaded
+    since EpiTator keeps the model it imported with
+
+    Input: model - The name of the spaCy model
+           disable - The components to disable on top of the ones EpiTator doesn't read
+           batch_size - The number of texts per nlp.pipe batch
+           n_process - The number of processes nlp.pipe parses with
+           prefer_gpu - Whether to run spaCy on the GPU when there is one
+
+    Output: None
+    """
+    if self.nlp is not None and model != self.model:
+      raise ValueError(f"EpiTator has already loaded {self.model}, it can't switch to {model}")
+
+    self.model = model
+    self.disable = list(disable)
+    self.batch_size = batch_size
+    self.n_process = n_process
+    self.prefer_gpu = prefer_gpu
+
+  def load(self) -> None:
+    if self.nlp is not None:
+      return
+
+    print(f"loading epitator ({self.model})")
+    if self.prefer_gpu:
+      spacy.prefer_gpu()
+
+    os.environ['SPACY_MODEL_SHORTCUT_LINK'] = self.model
+
+    # Imported here so EpiTator loads the configured model
+    from epitator.annotator import AnnoDoc, AnnoTier, AnnoSpan
+    from epitator.spacy_annotator import SentSpan, TokenSpan
+    from epitator.spacy_nlp import spacy_nlp, custom_sentencizer
+    from epitator.geoname_annotator import GeonameAnnotator
+    from epitator.count_annotator import CountAnnotator
+    from epitator.date_annotator import DateAnnotator
+
+    self.AnnoDoc, self.AnnoTier, self.AnnoSpan = AnnoDoc, AnnoTier, AnnoSpan
+    self.SentSpan, self.TokenSpan = SentSpan, TokenSpan
+    self.custom_sentencizer = custom_sentencizer
+
+    # The annotators are reused across the articles (the geoname annotator opens its database once)
+    self.annotators = [GeonameAnnotator(), CountAnnotator(), DateAnnotator()]
+
+    disabled = [name for name in spacy_nlp.pipe_names if name not in EPITATOR_COMPONENTS or name in self.disable]
+    if len(disabled) > 0:
+      # Disables them in place so EpiTator's own uses of the model skip them too
+      spacy_nlp.select_pipes(disable=disabled)
+    self.nlp = spacy_nlp
+
+  def parse_docs(self, texts: list):
+    """
+    Purpose: Parses the texts with spaCy in batches and builds their annotated documents
+
+    Input: texts - The texts
+
+    Output: A generator of the AnnoDoc of every text (in order), with the spacy.* tiers added
+    """
+    self.load()
+
+    for chunk_start in range(0, len(texts), CHUNK_SIZE):
+      docs = [self.AnnoDoc(text) for text in texts[chunk_start:chunk_start+CHUNK_SIZE]]
+
+      # Split every document into the sentence groups SpacyAnnotator would parse
+      groups = []
+      for doc_idx, doc in enumerate(docs):
+        sentences = self.AnnoTier([self.SentSpan(sent, doc) for sent in self.custom_sentencizer(doc.text)])
+        doc.tiers['spacy.sentences'] = sentences
+        for sent_group_idx in range(0, len(sentences), SENTENCE_GROUP_SIZE):
+          doc_offset = sentences.spans[sent_group_idx].start
+          sent_group_end = sentences.spans[min(sent_group_idx + SENTENCE_GROUP_SIZE, len(sentences)) - 1].end
+          groups.append((doc_idx, doc_offset, sent_group_end))
+
+      spacy_docs = self.nlp.pipe(
+        (docs[doc_idx].text[doc_offset:sent_group_end] for doc_idx, doc_offset, sent_group_end in groups),
+        batch_size = self.batch_size,
+        n_process = self.n_process
+      )
+
+      # The token, entity and noun chunk spans of every document
+      spans = [([], [], []) for doc in docs]
+      for (doc_idx, doc_offset, sent_group_end), spacy_doc in zip(groups, spacy_docs):
+        token_spans, ne_spans, noun_chunks = spans[doc_idx]
+        self.add_spacy_spans(docs[doc_idx], doc_offset, spacy_doc, token_spans, ne_spans, noun_chunks)
+
+      for doc, (token_spans, ne_spans, noun_chunks) in zip(docs, spans):
+        for ne_span in ne_spans:
+          # Counts like 1500 are sometimes parsed as the year of a date
+          if ne_span.label == 'DATE' and AMBIGUOUS_YEAR_REGEX.match(ne_span.text) and int(ne_span.text) < 1900:
+            ne_span.label = 'QUANTITY'
+
+        doc.tiers['spacy.noun_chunks'] = self.AnnoTier(noun_chunks, presorted=True)
+        doc.tiers['spacy.tokens'] = self.AnnoTier(token_spans, presorted=True)
+        doc.tiers['spacy.nes'] = self.AnnoTier(ne_spans, presorted=True)
+        yield doc
+
+  def add_spacy_spans(self, doc, doc_offset: int, spacy_doc, token_spans: list, ne_spans: list, noun_chunks: list) -> None:
+    # Mirrors SpacyAnnotator.annotate for a single sentence group
+    noun_chunks.extend(self.SentSpan(chunk, doc, offset=doc_offset) for chunk in spacy_doc.noun_chunks)
+
+    ne_chunk_start = None
+    ne_chunk_end = None
+    ne_chunk_type = None
+    for token in spacy_doc:
+      start = token.idx + doc_offset
+      end = start + len(token)
+      # White space tokens are skipped
+      if not re.match(r"^\s", token.text):
+        token_spans.append(self.TokenSpan(token, doc, offset=doc_offset))
+      if ne_chunk_start is not None and token.ent_iob_ != "I":
+        ne_spans.append(self.AnnoSpan(ne_chunk_start, ne_chunk_end, doc, label=ne_chunk_type))
+        ne_chunk_start = None
+        ne_chunk_end = None
+        ne_chunk_type = None
+      if token.ent_type_:
+        if token.ent_iob_ == "B":
+          ne_chunk_start = start
+          ne_chunk_end = end
+          ne_chunk_type = token.ent_type_
+        elif token.ent_iob_ == "I":
+          ne_chunk_end = end
+        elif token.ent_iob_ == "O":
+          ne_spans.append(self.AnnoSpan(start, end, doc, label=token.ent_type_))
+        else:
+          raise ValueError(f"Unexpected IOB tag: {token.ent_iob_}")
+    if ne_chunk_start is not None:
+      ne_spans.append(self.AnnoSpan(ne_chunk_start, ne_chunk_end, doc, label=ne_chunk_type))
+
+  def annotate(self, doc) -> None:
+    for annotator in self.annotators:
+      doc.add_tiers(annotator)
+
+def add_nlp_arguments(parser) -> None:
+  parser.add_argument("--spacy-model", type=str, required=False, default=DEFAULT_SPACY_MODEL, help="The spaCy model EpiTator parses with e.g. en_core_web_sm, en_core_web_md or en_core_web_trf")
+  parser.add_argument("--spacy-disable", nargs="+", required=False, default=[], help="Further spaCy components to disable")
+  parser.add_argument("--spacy-batch-size", type=int, required=False, default=DEFAULT_BATCH_SIZE, help="The number of texts per nlp.pipe batch")
+  parser.add_argument("--spacy-n-process", type=int, required=False, default=DEFAULT_N_PROCESS, help="The number of processes parsing with spaCy")
+  parser.add_argument("--spacy-gpu", required=False, action="store_true", help="Run spaCy on the GPU when there is one")
+
+def nlp_settings(args) -> dict:
+  return {
+    "model" : args.spacy_model,
+    "disable" : args.spacy_disable,
+    "batch_size" : args.spacy_batch_size,
+    "n_process" : args.spacy_n_process,
+    "prefer_gpu" : args.spacy_gpu
+  }
+
+# function that extracts location names/admin codes/lat/lng, case and death counts, and date ranges from a parsed document
+# uses epitator since it already trained rules for extracting medical/infectious disease data
+def epitator_extract(doc, max_ents: int = 1) -> pd.Series:
+
+  # add the annotators to the parsed document
+  epitator_backend.annotate(doc)
+
+  # extract geographic data
+  geos = doc.tiers["geonames"].spans
+  geo_admin1s = [x.geoname.admin1_code for x in geos]
+  geo_admin2s = [x.geoname.admin2_code for x in geos]
+  geo_admin3s = [x.geoname.admin3_code for x in geos]
+  geo_admin4s = [x.geoname.admin4_code for x in geos]
+  geo_names = [x.geoname.name for x in geos]
+  geo_lats = [x.geoname.latitude for x in geos]
+  geo_lons = [x.geoname.longitude for x in geos]
+
+  # extract case counts and death counts
+  counts = doc.tiers["counts"].spans
+  cases_counts = [x.metadata['count'] for x in counts if 'case' in x.metadata['attributes']
+                  and 'death' not in x.metadata['attributes']]
+  cases_tags = [x.metadata['attributes']
+                for x in counts if 'case' in x.metadata['attributes'] and 'death' not in x.metadata['attributes']]
+  death_counts = [x.metadata['count']
+                  for x in counts if 'death' in x.metadata['attributes']]
+  death_tags = [x.metadata['attributes']
+                for x in counts if 'death' in x.metadata['attributes']]
+
+  # extract the date range
+  dates = doc.tiers["dates"].spans
+  dates_start = [pd.to_datetime(
+      x.metadata["datetime_range"][0], errors='coerce') for x in dates]
+  dates_end = [pd.to_datetime(
+      x.metadata["datetime_range"][1], errors='coerce') for x in dates]
+
+  # return only max_ents entities from the extracted lists
+  # currently set to the first result for each list, since that is usually the most important one
+  # and other ones can be filler/garbage data
+  return pd.Series([
+    geo_admin1s[:max_ents],
+    geo_admin2s[:max_ents],
+    geo_admin3s[:max_ents],
+    geo_admin4s[:max_ents],
+    geo_names[:max_ents],
+    geo_lats[:max_ents],
+    geo_lons[:max_ents],
+    cases_counts[:max_ents],
+    cases_tags[:max_ents],
+    death_counts[:max_ents],
+    death_tags[:max_ents],
+    dates_start[:max_ents],
+    dates_end[:max_ents],
+  ])
+
+epitator_backend = EpiTatorBackend()
@@ -0,0 +1,245 @@
+import argparse
+import collections
+import datetime
+import itertools
+import os
+import re
+import sys
+import time
+import pandas as pd
+
+from typing import Iterable, Union
+
+# The run profiler lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+
+from summarization import BartSummarizer, DEFAULT_CHECKPOINT, DISTILLED_CHECKPOINT
+
+CONTENT_COL = "content"
+
+DATA_DIR = "../data"
+EVALUATION_DATA_DIR = f"{DATA_DIR}/summarizer_evaluation"
+
+DEFAULT_NUM_ARTICLES = 50
+SEED = 42
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+"""
+Notes:
+
+Summarizes a sample of the ProMED articles with the float32 bart-large-cnn (the
+summarizer clean_cchf_data.py uses by default) and with every candidate setting, i.e.
+every combination of the checkpoints, the number of beams and the maximum lengths given,
+each in float32 and quantized to int8. Every candidate is scored against the float32
+summaries with the F1 of ROUGE-1, ROUGE-2 and ROUGE-L, and its speed is measured in
+articles per second (not counting loading the model, which is reported separately).
+The results are printed and saved to data/summarizer_evaluation so a speed/quality
+point can be picked for --summarizer-checkpoint, --quantize, --num-beams and --max-length.
+"""
+
+def extract_arguments() -> Iterable[Union[str, int, list, bool]]:
+  """
+  Name: extract_arguments
+
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: filepath - The csv filepath of the promed data
+          num_articles - The number of articles to evaluate on
+          checkpoints - The checkpoints to evaluate
+          num_beams - The numbers of beams to evaluate
+          max_lengths - The maximum summary lengths to evaluate
+          profile - Whether to profile the run
+  """
+
+  CSV_FILE_ENDING = ".csv"
+
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the promed data to summarize")
+  parser.add_argument("-n", "--num-articles", type=int, required=False, default=DEFAULT_NUM_ARTICLES, help="The number of articles to evaluate on")
+  parser.add_argument("--checkpoints", nargs="+", required=False, default=[DEFAULT_CHECKPOINT, DISTILLED_CHECKPOINT], help="The checkpoints to evaluate")
+  parser.add_argument("--num-beams", nargs="+", type=int, required=False, default=[None], help="The numbers of beams to evaluate (the checkpoint's by default)")
+  parser.add_argument("--max-lengths", nargs="+", type=int, required=False, default=[None], help="The maximum summary lengths to evaluate (the checkpoint's by default)")
+  add_profile_argument(parser)
+
+  args = parser.parse_args()
+
+  filepath = args.filepath
+  if (
+    len(filepath) <= 0 or
+    os.path.isfile(filepath) is False or
+    filepath.endswith(CSV_FILE_ENDING) is False
+  ):
+    print(f"The filepath: {filepath} is either not a valid csv or a valid file.")
+    sys.exit(-1)
+
+  if args.num_articles <= 0:
+    print(f"The number of articles: {args.num_articles} must be positive")
+    sys.exit(-1)
+
+  return filepath, args.num_articles, args.checkpoints, args.num_beams, args.max_lengths, args.profile
+
+def sample_articles(csv_filepath: str, num_articles: int) -> list:
+  promed_df = pd.read_csv(csv_filepath)
+  contents = promed_df[CONTENT_COL].dropna()
+  contents = contents[contents.str.strip().str.len() > 0]
+  return contents.sample(n=min(num_articles, len(contents)), random_state=SEED).tolist()
+
+def summarize_all(summarizer: BartSummarizer, articles: list) -> Iterable[Union[list, float]]:
+  """
+  Name: summarize_all
+
+  Purpose: Summarizes the articles, timing the summaries apart from loading the model
+
+  Input: summarizer - The summarizer
+         articles - The articles
+
+  Output: summaries - The summary of every article
+          duration - The seconds taken to summarize them
+  """
+  summarizer.load()
+
+  start = time.perf_counter()
+  summaries = []
+  for article in articles:
+    summaries.append(summarizer.summarize(article))
+    run_profiler.count("articles")
+
+  return summaries, time.perf_counter() - start
+
+def tokenize(text: str) -> list:
+  return TOKEN_REGEX.findall(text.lower())
+
+def f1(overlap: int, candidate_total: int, reference_total: int) -> float:
+  if overlap <= 0 or candidate_total <= 0 or reference_total <= 0:
+    return 0.0
+  precision = overlap / candidate_total
+  recall = overlap / reference_total
+  return 2 * precision * recall / (precision + recall)
+
+def rouge_n(reference: str, candidate: str, n: int) -> float:
+  """
+  Name: rouge_n
+
+  Purpose: Computes the ROUGE-N F1 of a summary against a reference summary
+
+  Input: reference - The reference summary
+         candidate - The summary to score
+         n - The length of the n-grams
+
+  Output: The F1 of the overlapping n-grams
+  """
+  reference_tokens = tokenize(reference)
+  candidate_tokens = tokenize(candidate)
+  reference_ngrams = collections.Counter(tuple(reference_tokens[idx:idx+n]) for idx in range(len(reference_tokens) - n + 1))
+  candidate_ngrams = collections.Counter(tuple(candidate_tokens[idx:idx+n]) for idx in range(len(candidate_tokens) - n + 1))
+
+  overlap = sum((reference_ngrams & candidate_ngrams).values())
+  return f1(overlap, sum(candidate_ngrams.values()), sum(reference_ngrams.values()))
+
+def rouge_l(reference: str, candidate: str) -> float:
+  """
+  Name: rouge_l
+
+  Purpose: Computes the ROUGE-L F1 of a summary against a reference summary
+
+  Input: reference - The reference summary
+         candidate - The summary to score
+
+  Output: The F1 of the longest common subsequence of tokens
+  """
+  reference_tokens = tokenize(reference)
+  candidate_tokens = tokenize(candidate)
+
+  # The longest common subsequence, keeping a single row of the table
+  lengths = [0] * (len(candidate_tokens) + 1)
+  for reference_token in reference_tokens:
+    previous_diagonal = 0
+    for idx, candidate_token in enumerate(candidate_tokens):
+      previous_row = lengths[idx + 1]
+      if reference_token == candidate_token:
+        lengths[idx + 1] = previous_diagonal + 1
+      else:
+        lengths[idx + 1] = max(lengths[idx + 1], lengths[idx])
+      previous_diagonal = previous_row
+
+  return f1(lengths[-1], len(candidate_tokens), len(reference_tokens))
+
+def score(references: list, candidates: list) -> dict:
+  scores = {"rouge1" : 0.0, "rouge2" : 0.0, "rougeL" : 0.0}
+  for reference, candidate in zip(references, candidates):
+    scores["rouge1"] += rouge_n(reference, candidate, 1)
+    scores["rouge2"] += rouge_n(reference, candidate, 2)
+    scores["rougeL"] += rouge_l(reference, candidate)
+  return {metric : total / len(references) for metric, total in scores.items()}
+
+def main():
+
+  print("Extracting the specified arguments")
+
+  csv_filepath, num_articles, checkpoints, num_beams, max_lengths, profile = extract_arguments()
+
+  with run_profiler.run(script="evaluate_summarizer", report_dir=EVALUATION_DATA_DIR, profile=profile):
+    with run_profiler.stage("sample_articles"):
+      articles = sample_articles(
+        csv_filepath = csv_filepath,
+        num_articles = num_articles
+      )
+
+    print(f"Evaluating on {len(articles)} articles")
+
+    baseline = BartSummarizer(checkpoint=DEFAULT_CHECKPOINT)
+    with run_profiler.stage("baseline"):
+      references, baseline_duration = summarize_all(baseline, articles)
+
+    results = [{
+      "checkpoint" : DEFAULT_CHECKPOINT,
+      "quantize" : False,
+      "num_beams" : None,
+      "max_length" : None,
+      "load_s" : baseline.load_time,
+      "articles_per_s" : len(articles) / baseline_duration,
+      "speedup" : 1.0,
+      "rouge1" : 1.0,
+      "rouge2" : 1.0,
+      "rougeL" : 1.0
+    }]
+
+    for checkpoint, beams, max_length, quantize in itertools.product(checkpoints, num_beams, max_lengths, [False, True]):
+      # The baseline itself
+      if checkpoint == DEFAULT_CHECKPOINT and beams is None and max_length is None and quantize is False:
+        continue
+
+      candidate = BartSummarizer(checkpoint=checkpoint, quantize=quantize, num_beams=beams, max_length=max_length)
+      print(f"Evaluating {candidate.describe()}")
+
+      with run_profiler.stage("candidate"):
+        summaries, duration = summarize_all(candidate, articles)
+
+      results.append({
+        "checkpoint" : checkpoint,
+        "quantize" : quantize,
+        "num_beams" : beams,
+        "max_length" : max_length,
+        "load_s" : candidate.load_time,
+        "articles_per_s" : len(articles) / duration,
+        "speedup" : baseline_duration / duration,
+        **score(references, summaries)
+      })
+
+    results_df = pd.DataFrame(results)
+    print(results_df.to_string(index=False, float_format=lambda val: f"{val:.3f}"))
+
+    if os.path.isdir(EVALUATION_DATA_DIR) is False:
+      os.makedirs(EVALUATION_DATA_DIR)
+
+    results_filepath = f"{EVALUATION_DATA_DIR}/evaluation_{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.csv"
+    results_df.to_csv(results_filepath, index=False)
+    print(f"Results saved to {results_filepath}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,191 @@
+import re
+import zlib
+import numpy as np
+
+# The minhash signature is NUM_BANDS bands of ROWS_PER_BAND hashes. With 16 bands of 8 rows
+# two articles become candidates around a Jaccard similarity of (1/16)^(1/8) ~= 0.7
+NUM_BANDS = 16
+ROWS_PER_BAND = 8
+NUM_PERMUTATIONS = NUM_BANDS * ROWS_PER_BAND
+
+SHINGLE_SIZE = 5
+SEED = 42
+
+# The estimated Jaccard similarity above which two articles are near duplicates
+DEFAULT_THRESHOLD = 0.8
+
+# A near duplicate with fewer new words than this reuses its representative's summary,
+# with the new words put in front of it
+MIN_DIFF_WORDS = 40
+
+# A Mersenne prime larger than every 32 bit shingle hash
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+REPRESENTATIVE = "representative"
+REUSE = "reuse"
+DIFF = "diff"
+
+WORD_REGEX = re.compile(r"\w+")
+
+"""
+Notes:
+
+ProMED often republishes an update which repeats most of the text of the previous post
+about the outbreak. Each article is reduced to the set of its word 5-grams and a minhash
+signature of that set, and the signatures are split into bands and indexed by band so
+only the articles sharing a whole band are compared (locality sensitive hashing). The
+candidates whose estimated Jaccard similarity is above the threshold are joined into
+clusters with a union-find.
+
+The earliest article of every cluster is its representative and is summarized in full.
+Every other article of the cluster keeps only the lines the representative doesn't have.
+An update's new counts end up in those lines, so they are what its summary has to carry
+first (EpiTator keeps the first count it finds). When there are fewer than MIN_DIFF_WORDS
+words of them they are put in front of the representative's summary without calling the
+model at all, otherwise only the new lines are summarized.
+"""
+
+class MinHasher:
+  """
+  Purpose: Computes the minhash signatures of texts
+
+  Input: num_permutations - The length of the signatures
+         shingle_size - The number of words per shingle
+         seed - The seed of the hash functions
+  """
+
+  def __init__(self, num_permutations: int = NUM_PERMUTATIONS, shingle_size: int = SHINGLE_SIZE, seed: int = SEED):
+    self.shingle_size = shingle_size
+    generator = np.random.default_rng(seed)
+    # The universal hash functions h(x) = (a * x + b) mod p, one per permutation
+    self.a = generator.integers(1, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+    self.b = generator.integers(0, MERSENNE_PRIME, size=num_permutations, dtype=np.uint64)
+
+  def shingles(self, text: str) -> np.ndarray:
+    words = WORD_REGEX.findall(text.lower()) if isinstance(text, str) else []
+    if len(words) < self.shingle_size:
+      words_per_shingle = [words] if len(words) > 0 else []
+    else:
+      words_per_shingle = [words[idx:idx+self.shingle_size] for idx in range(len(words) - self.shingle_size + 1)]
+
+    return np.unique(np.array([zlib.crc32(" ".join(shingle).encode()) for shingle in words_per_shingle], dtype=np.uint64))
+
+  def signature(self, text: str) -> np.ndarray:
+    """
+    Purpose: Computes the minhash signature of a text
+
+    Input: text - The text
+
+    Output: The signature (every hash is MAX_HASH for a text without words)
+    """
+    shingles = self.shingles(text)
+    if len(shingles) <= 0:
+      return np.full(len(self.a), MAX_HASH, dtype=np.uint64)
+
+    # a * x overflows 64 bits so the hashes wrap modulo 2^64 before the prime, which still
+    # mixes them well enough for the minimums
+    hashes = (np.outer(shingles, self.a) + self.b) % np.uint64(MERSENNE_PRIME)
+    return (hashes & np.uint64(MAX_HASH)).min(axis=0)
+
+class LSHIndex:
+  """
+  Purpose: Finds the texts whose signatures share a band with a signature
+
+  Input: num_bands - The number of bands of a signature
+         rows_per_band - The number of hashes per band
+  """
+
+  def __init__(self, num_bands: int = NUM_BANDS, rows_per_band: int = ROWS_PER_BAND):
+    self.num_bands = num_bands
+    self.rows_per_band = rows_per_band
+    self.buckets = [{} for band in range(num_bands)]
+
+  def band_keys(self, signature: np.ndarray) -> list:
+    return [signature[band*self.rows_per_band:(band+1)*self.rows_per_band].tobytes() for band in range(self.num_bands)]
+
+  def candidates(self, signature: np.ndarray) -> set:
+    candidates = set()
+    for band, band_key in enumerate(self.band_keys(signature)):
+      candidates.update(self.buckets[band].get(band_key, []))
+    return candidates
+
+  def add(self, key, signature: np.ndarray) -> None:
+    for band, band_key in enumerate(self.band_keys(signature)):
+      self.buckets[band].setdefault(band_key, []).append(key)
+
+def find_near_duplicate_clusters(texts: list, threshold: float = DEFAULT_THRESHOLD) -> list:
+  """
+  Purpose: Groups the near duplicate texts together
+
+  Input: texts - The texts (in the order they were published)
+         threshold - The estimated Jaccard similarity above which two texts are near duplicates
+
+  Output: A list of the clusters, each a sorted list of the positions of its texts
+  (texts without a near duplicate are clusters of one)
+  """
+  hasher = MinHasher()
+  index = LSHIndex()
+  signatures = []
+  parents = list(range(len(texts)))
+
+  def find(position):
+    while parents[position] != position:
+      parents[position] = parents[parents[position]]
+      position = parents[position]
+    return position
+
+  for position, text in enumerate(texts):
+    signature = hasher.signature(text)
+    signatures.append(signature)
+
+    # Texts without any words never match anything
+    if isinstance(text, str) and len(WORD_REGEX.findall(text)) > 0:
+      for candidate in index.candidates(signature):
+        if np.mean(signatures[candidate] == signature) >= threshold:
+          root, candidate_root = find(position), find(candidate)
+          # The earliest text is always the root so it becomes the representative
+          parents[max(root, candidate_root)] = min(root, candidate_root)
+      index.add(position, signature)
+
+  clusters = {}
+  for position in range(len(texts)):
+    clusters.setdefault(find(position), []).append(position)
+
+  return list(clusters.values())
+
+def novel_lines(text: str, representative_text: str) -> str:
+  """
+  Purpose: Finds the lines of a text which its representative doesn't have
+
+  Input: text - The near duplicate's text
+         representative_text - The representative's text
+
+  Output: The new lines joined by newlines
+  """
+  representative_lines = set(line.strip() for line in representative_text.splitlines())
+  return "\n".join(line for line in text.splitlines() if line.strip() not in representative_lines)
+
+def plan_summaries(texts: list, threshold: float = DEFAULT_THRESHOLD) -> list:
+  """
+  Purpose: Decides how each text should be summarized
+
+  Input: texts - The texts (in the order they were published)
+         threshold - The estimated Jaccard similarity above which two texts are near duplicates
+
+  Output: A list with a (action, representative position, new text) tuple per text, where
+  the action is REPRESENTATIVE (summarize in full), REUSE (put the new text in front of the
+  representative's summary) or DIFF (summarize only the new text)
+  """
+  plan = [(REPRESENTATIVE, position, None) for position in range(len(texts))]
+
+  for cluster in find_near_duplicate_clusters(texts, threshold=threshold):
+    representative = cluster[0]
+    for position in cluster[1:]:
+      diff_text = novel_lines(texts[position], texts[representative])
+      if len(WORD_REGEX.findall(diff_text)) < MIN_DIFF_WORDS:
+        plan[position] = (REUSE, representative, diff_text)
+      else:
+        plan[position] = (DIFF, representative, diff_text)
+
+  return plan
@@ -0,0 +1,215 @@
+import re
+import pandas as pd
+
+# The columns extract_cchf_data_from_df adds to every article
+EXTRACTION_COLS = [
+  "admin1_code",
+  "admin2_code",
+  "admin3_code",
+  "admin4_code",
+  "location_name",
+  "location_lat",
+  "location_lon",
+  "cases",
+  "cases_tags",
+  "deaths",
+  "deaths_tags",
+  "dates_start",
+  "dates_end",
+]
+
+RULE_TIER_KEY = "tier"
+RULE_SUMMARY_KEY = "summary"
+
+CASE_TABLE_TIER = "case_table"
+CASES_AND_DEATHS_TIER = "cases_and_deaths"
+CASES_ONLY_TIER = "cases_only"
+RULE_TIERS = [CASE_TABLE_TIER, CASES_AND_DEATHS_TIER, CASES_ONLY_TIER]
+
+NUMBER_WORDS = {
+  "no" : 0, "zero" : 0, "one" : 1, "two" : 2, "three" : 3, "four" : 4, "five" : 5, "six" : 6,
+  "seven" : 7, "eight" : 8, "nine" : 9, "ten" : 10, "eleven" : 11, "twelve" : 12,
+  "thirteen" : 13, "fourteen" : 14, "fifteen" : 15, "sixteen" : 16, "seventeen" : 17,
+  "eighteen" : 18, "nineteen" : 19, "twenty" : 20, "thirty" : 30, "forty" : 40, "fifty" : 50
+}
+
+# A count written in digits (1,234 or 1 234) or in words
+NUMBER = r"(\d{1,3}(?:[, ]\d{3})+|\d+|" + "|".join(NUMBER_WORDS.keys()) + r")"
+
+CASE_QUALIFIERS = ["new", "confirmed", "laboratory-confirmed", "laboratory confirmed", "suspected", "probable", "fatal", "human", "additional", "more", "total"]
+QUALIFIERS = r"(?:(?:" + "|".join(re.escape(qualifier) for qualifier in CASE_QUALIFIERS) + r")\s+)*"
+
+# The structured ProMED case tables e.g. "Brazil [w/e 6 Jul 2019] / 12 cases / 2 deaths / ..."
+CASE_TABLE_REGEX = re.compile(
+  r'([A-Za-z ]+).*\[w\/e (.+)\] \/ (.+) \/ (.+) \/ (.+) \/ (.+) \/ (.+)', re.MULTILINE)
+
+# "12 confirmed cases and 3 deaths", "12 cases, including 3 deaths", "12 cases with 3 fatalities"
+CASES_AND_DEATHS_REGEX = re.compile(
+  rf"\b{NUMBER}\s+({QUALIFIERS})cases?\b[^.;]{{0,80}}?\b(?:and|including|with|of which|of whom|,)\s+{NUMBER}\s+(?:(?:related\s+)?deaths?|fatalities|fatal|died)\b",
+  re.IGNORECASE)
+
+# "3 deaths among 12 cases", "3 deaths out of 12 cases"
+DEATHS_AND_CASES_REGEX = re.compile(
+  rf"\b{NUMBER}\s+(?:deaths?|fatalities)\s+(?:among|out of|from|in)\s+{NUMBER}\s+({QUALIFIERS})cases?\b",
+  re.IGNORECASE)
+
+CASES_REGEX = re.compile(rf"\b{NUMBER}\s+({QUALIFIERS})cases?\b", re.IGNORECASE)
+DEATHS_REGEX = re.compile(rf"\b{NUMBER}\s+(?:deaths?|fatalities)\b", re.IGNORECASE)
+MENTIONS_DEATHS_REGEX = re.compile(r"\b(?:deaths?|died|dead|fatal|fatalit(?:y|ies)|succumbed)\b", re.IGNORECASE)
+
+"""
+Notes:
+
+The rule tier of the extraction. Summarizing an article with BART and annotating the
+summary with EpiTator takes seconds per article, but a large share of the ProMED posts
+state their counts in a handful of fixed forms. Every article is run through the rule
+extractors below in order and the first one which parses it confidently wins:
+
+  1. case_table - The structured "<place> [w/e <date>] / ... / ..." case tables. The
+     first row with a field labelled as cases is used (matching EpiTator's first entity)
+  2. cases_and_deaths - "N cases and M deaths" style sentences, when every such sentence
+     in the article agrees and no other case count contradicts it
+  3. cases_only - A single case count, when the article doesn't mention deaths at all
+
+Anything else (several conflicting counts, deaths we can't attach to a count, ...) is
+left to the model path. The rules never guess a location from free text so the location
+columns are only filled in for the case tables.
+"""
+
+def extract_with_rules(text: str) -> dict:
+  """
+  Purpose: Runs the rule extractors over an article in order
+
+  Input: text - The (cleaned) content of the article
+
+  Output: A dictionary of the EXTRACTION_COLS, the tier which parsed the article and
+  an extractive summary (the text the counts came from), or None when no rule parsed
+  the article confidently
+  """
+  if not isinstance(text, str) or len(text.strip()) <= 0:
+    return None
+
+  for extractor in [extract_case_table, extract_cases_and_deaths, extract_cases_only]:
+    extraction = extractor(text)
+    if extraction is not None:
+      return extraction
+
+  return None
+
+def extract_case_table(text: str) -> dict:
+  for match in CASE_TABLE_REGEX.finditer(text):
+    place, week_ending = match.group(1), match.group(2)
+
+    cases = None
+    deaths = None
+    for field in match.groups()[2:]:
+      deaths_match = DEATHS_REGEX.search(field)
+      if deaths_match is not None and deaths is None:
+        deaths = parse_number(deaths_match.group(1))
+        continue
+      cases_match = CASES_REGEX.search(field)
+      if cases_match is not None and cases is None:
+        cases = parse_number(cases_match.group(1))
+
+    if cases is None:
+      continue
+
+    week_ending_date = pd.to_datetime(week_ending, errors="coerce")
+    return build_extraction(
+      tier = CASE_TABLE_TIER,
+      summary = match.group(0).strip(),
+      cases = cases,
+      cases_tags = ["case"],
+      deaths = deaths,
+      location_name = place.strip(),
+      date = week_ending_date
+    )
+
+  return None
+
+def extract_cases_and_deaths(text: str) -> dict:
+  counts = set()
+  sentences = []
+  qualifiers = []
+
+  for match in CASES_AND_DEATHS_REGEX.finditer(text):
+    counts.add((parse_number(match.group(1)), parse_number(match.group(3))))
+    qualifiers.append(match.group(2))
+    sentences.append(enclosing_sentence(text, match))
+
+  for match in DEATHS_AND_CASES_REGEX.finditer(text):
+    counts.add((parse_number(match.group(2)), parse_number(match.group(1))))
+    qualifiers.append(match.group(3))
+    sentences.append(enclosing_sentence(text, match))
+
+  if len(counts) != 1:
+    return None
+
+  cases, deaths = counts.pop()
+
+  # Any other case count in the article (cumulative vs new, another district, ...) makes it ambiguous
+  case_counts = set(parse_number(match.group(1)) for match in CASES_REGEX.finditer(text))
+  if len(case_counts - {cases}) > 0:
+    return None
+
+  return build_extraction(
+    tier = CASES_AND_DEATHS_TIER,
+    summary = " ".join(dict.fromkeys(sentences)),
+    cases = cases,
+    cases_tags = case_tags(qualifiers[0]),
+    deaths = deaths
+  )
+
+def extract_cases_only(text: str) -> dict:
+  if MENTIONS_DEATHS_REGEX.search(text) is not None:
+    return None
+
+  matches = list(CASES_REGEX.finditer(text))
+  case_counts = set(parse_number(match.group(1)) for match in matches)
+  if len(case_counts) != 1:
+    return None
+
+  return build_extraction(
+    tier = CASES_ONLY_TIER,
+    summary = " ".join(dict.fromkeys(enclosing_sentence(text, match) for match in matches)),
+    cases = case_counts.pop(),
+    cases_tags = case_tags(matches[0].group(2)),
+    deaths = None
+  )
+
+def build_extraction(tier: str, summary: str, cases: int, cases_tags: list, deaths: int, location_name: str = None, date = None) -> dict:
+  extraction = {col : pd.NA for col in EXTRACTION_COLS}
+  extraction["cases"] = cases
+  extraction["cases_tags"] = cases_tags
+  if deaths is not None:
+    extraction["deaths"] = deaths
+    extraction["deaths_tags"] = ["death"]
+  if location_name is not None:
+    extraction["location_name"] = location_name
+  if date is not None and not pd.isna(date):
+    extraction["dates_start"] = date
+    extraction["dates_end"] = date
+
+  extraction[RULE_TIER_KEY] = tier
+  extraction[RULE_SUMMARY_KEY] = summary
+  return extraction
+
+def enclosing_sentence(text: str, match: re.Match) -> str:
+  start = max(text.rfind(".", 0, match.start()), text.rfind("\n", 0, match.start())) + 1
+  end_candidates = [idx for idx in [text.find(".", match.end()), text.find("\n", match.end())] if idx >= 0]
+  end = min(end_candidates) + 1 if len(end_candidates) > 0 else len(text)
+  return text[start:end].strip()
+
+def case_tags(qualifiers: str) -> list:
+  # Mirror EpiTator's count attributes e.g. ["case", "confirmed"]
+  tags = ["case"]
+  for qualifier in (qualifiers or "").lower().split():
+    if qualifier in ["confirmed", "suspected", "probable", "fatal"] and qualifier not in tags:
+      tags.append(qualifier)
+  return tags
+
+def parse_number(val: str) -> int:
+  val = val.lower().strip()
+  if val in NUMBER_WORDS:
+    return NUMBER_WORDS[val]
+  return int(re.sub(r"[, ]", "", val))
@@ -0,0 +1,128 @@
+import time
+
+from transformers import BartForConditionalGeneration, BartTokenizer
+
+DEFAULT_CHECKPOINT = "facebook/bart-large-cnn"
+# A distilled bart-large-cnn with 6 of the 12 decoder layers, roughly twice as fast on CPU
+DISTILLED_CHECKPOINT = "sshleifer/distilbart-cnn-12-6"
+
+MAX_INPUT_TOKENS = 1024
+
+# None leaves the setting to the checkpoint's generation config (4 beams and up to 142 tokens for bart-large-cnn)
+DEFAULT_NUM_BEAMS = None
+DEFAULT_MAX_LENGTH = None
+
+"""
+Notes:
+
+The summarizer is loaded lazily on the first article it summarizes, so a run where
+the rule extractors handle every article never loads the model at all.
+
+Our summarization boxes are CPU only. With quantize the Linear layers of the model
+(which hold nearly all of its weights and time) are converted to int8 with PyTorch's
+dynamic quantization: the weights are quantized once when the model is loaded and the
+activations on the fly, which runs several times faster than float32 on CPU for a small
+loss in quality. A distilled checkpoint can be swapped in with checkpoint, and the
+number of beams and the maximum summary length trade quality for speed as well.
+evaluate_summarizer.py measures both against the float32 summaries.
+"""
+
+class BartSummarizer:
+  """
+  Purpose: Summarizes articles with a BART checkpoint
+
+  Input: checkpoint - The name (or path) of the checkpoint
+         quantize - Whether to quantize the Linear layers to int8
+         num_beams - The number of beams of the beam search (None for the checkpoint's)
+         max_length - The maximum number of tokens of a summary (None for the checkpoint's)
+  """
+
+  def __init__(self, checkpoint: str = DEFAULT_CHECKPOINT, quantize: bool = False, num_beams: int = DEFAULT_NUM_BEAMS, max_length: int = DEFAULT_MAX_LENGTH):
+    self.configure(checkpoint, quantize, num_beams, max_length)
+
+  def configure(self, checkpoint: str = DEFAULT_CHECKPOINT, quantize: bool = False, num_beams: int = DEFAULT_NUM_BEAMS, max_length: int = DEFAULT_MAX_LENGTH) -> None:
+    """
+    Purpose: Changes the settings of the summarizer, dropping the loaded model when the
+    checkpoint or the quantization changed
+
+    Input: checkpoint - The name (or path) of the checkpoint
+           quantize - Whether to quantize the Linear layers to int8
+           num_beams - The number of beams of the beam search (None for the checkpoint's)
+           max_length - The maximum number of tokens of a summary (None for the checkpoint's)
+
+    Output: None
+    """
+    if getattr(self, "checkpoint", None) != checkpoint or getattr(self, "quantize", None) != quantize:
+      self.tokenizer = None
+      self.model = None
+      self.load_time = None
+
+    self.checkpoint = checkpoint
+    self.quantize = quantize
+    self.num_beams = num_beams
+    self.max_length = max_length
+
+  def describe(self) -> str:
+    settings = [self.checkpoint, "int8" if self.quantize else "float32"]
+    if self.num_beams is not None:
+      settings.append(f"{self.num_beams} beams")
+    if self.max_length is not None:
+      settings.append(f"max length {self.max_length}")
+    return ", ".join(settings)
+
+  def load(self) -> None:
+    if self.model is not None:
+      return
+
+    print(f"loading transformers ({self.describe()})")
+    start = time.perf_counter()
+    self.tokenizer = BartTokenizer.from_pretrained(self.checkpoint)
+    model = BartForConditionalGeneration.from_pretrained(self.checkpoint)
+    model.eval()
+
+    if self.quantize:
+      # Only imported here since torch is only needed directly for the quantization
+      import torch
+      model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    self.model = model
+    self.load_time = time.perf_counter() - start
+
+  def summarize(self, text: str) -> str:
+    """
+    Purpose: Summarizes an article
+
+    Input: text - The content of the article
+
+    Output: The summary
+    """
+    self.load()
+
+    generation_settings = {}
+    if self.num_beams is not None:
+      generation_settings["num_beams"] = self.num_beams
+    if self.max_length is not None:
+      generation_settings["max_length"] = self.max_length
+
+    input_ids = self.tokenizer(text, return_tensors='pt', max_length=MAX_INPUT_TOKENS,
+                               padding=True, truncation=True)['input_ids']
+    summary_ids = self.model.generate(input_ids, **generation_settings)
+    summary = ''.join([self.tokenizer.decode(s) for s in summary_ids])
+    summary = summary.replace('<s>', '').replace('</s>', '')
+    return summary
+
+def add_summarizer_arguments(parser) -> None:
+  parser.add_argument("--summarizer-checkpoint", type=str, required=False, default=DEFAULT_CHECKPOINT, help=f"The BART checkpoint to summarize with e.g. {DISTILLED_CHECKPOINT}")
+  parser.add_argument("--quantize", required=False, action="store_true", help="Quantize the summarizer's Linear layers to int8 (faster on CPU)")
+  parser.add_argument("--num-beams", type=int, required=False, default=DEFAULT_NUM_BEAMS, help="The number of beams of the summarizer's beam search")
+  parser.add_argument("--max-length", type=int, required=False, default=DEFAULT_MAX_LENGTH, help="The maximum number of tokens of a summary")
+
+def summarizer_settings(args) -> dict:
+  return {
+    "checkpoint" : args.summarizer_checkpoint,
+    "quantize" : args.quantize,
+    "num_beams" : args.num_beams,
+    "max_length" : args.max_length
+  }
+
+bart_summarizer = BartSummarizer()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sys
+import numpy as np
+
+from typing import Union
+from scipy import sparse
+from shapely.geometry import box
+from shapely.prepared import prep
+
+# The geometry store lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.geometry_store import geometry_store
+from common.region_registry import ROOT_DIR
+
+CACHE_DIR = os.path.join(ROOT_DIR, "data", "cache", "area_weights")
+
+NAME_KEY = "name"
+
+"""
+Notes:
+
+A district's value for a grid is the area weighted mean of every grid cell it
+overlaps, where a cell's weight is the area of the overlap. Stacking those weights
+gives a sparse (district x cell) matrix W which is row normalized, so for a stack of
+T grids flattened to a (T x cells) matrix G the district means are simply
+
+  G @ W.T
+
+which is one sparse matrix multiply no matter how many months are in the stack.
+"""
+
+def build_district_weights(geojson_filepath: str, lats: np.ndarray, lons: np.ndarray) -> tuple:
+  """
+  Purpose: Builds the sparse district x cell weight matrix of a regular grid from
+  the exact overlap of every district polygon with every grid cell
+
+  Input: geojson_filepath - The filepath to the district GeoJSON
+         lats - The latitude of the center of each grid row
+         lons - The longitude of the center of each grid column
+
+  Output: A tuple of the (num districts x num lats * num lons) csr weight matrix
+  and the list of district names (one per matrix row)
+  """
+  features = geometry_store.load_districts(geojson_filepath)
+
+  lat_edges = compute_cell_edges(lats)
+  lon_edges = compute_cell_edges(lons)
+  lat_lows = np.minimum(lat_edges[:-1], lat_edges[1:])
+  lat_highs = np.maximum(lat_edges[:-1], lat_edges[1:])
+  lon_lows = np.minimum(lon_edges[:-1], lon_edges[1:])
+  lon_highs = np.maximum(lon_edges[:-1], lon_edges[1:])
+
+  # Cells shrink towards the poles so scale the planar overlap by cos(lat)
+  lat_scales = np.cos(np.radians(lats))
+
+  num_lons = len(lons)
+
+  rows = []
+  cols = []
+  weights = []
+  district_names = []
+
+  for district_idx, feature in enumerate(features):
+    district_names.append(feature[NAME_KEY])
+
+    polygon = feature["geometry"]
+    prepared_polygon = feature["prepared"]
+    if polygon.is_valid is False:
+      polygon = polygon.buffer(0)
+      prepared_polygon = prep(polygon)
+
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    candidate_rows = np.nonzero((lat_highs > min_lat) & (lat_lows < max_lat))[0]
+    candidate_cols = np.nonzero((lon_highs > min_lon) & (lon_lows < max_lon))[0]
+
+    for row_idx in candidate_rows:
+      for col_idx in candidate_cols:
+        cell = box(lon_lows[col_idx], lat_lows[row_idx], lon_highs[col_idx], lat_highs[row_idx])
+
+        if prepared_polygon.contains(cell):
+          overlap = cell.area
+        elif prepared_polygon.intersects(cell):
+          overlap = polygon.intersection(cell).area
+        else:
+          continue
+
+        if overlap <= 0:
+          continue
+
+        rows.append(district_idx)
+        cols.append(row_idx * num_lons + col_idx)
+        weights.append(overlap * lat_scales[row_idx])
+
+  weight_matrix = sparse.csr_matrix(
+    (np.array(weights, dtype=np.float64), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+    shape=(len(features), len(lats) * num_lons)
+  )
+
+  return normalize_rows(weight_matrix), district_names
+
+def load_or_build_district_weights(geojson_filepath: str, lats: np.ndarray, lons: np.ndarray, cache_dir: Union[str, None] = None) -> tuple:
+  """
+  Purpose: Retrieves the weight matrix of a (GeoJSON, grid) pair from the cache,
+  building and caching it if it doesn't exist yet
+
+  Input: geojson_filepath - The filepath to the district GeoJSON
+         lats - The latitude of the center of each grid row
+         lons - The longitude of the center of each grid column
+         cache_dir - The directory holding the cached matrices (CACHE_DIR by default)
+
+  Output: A tuple of the csr weight matrix and the list of district names
+  """
+  if cache_dir is None:
+    cache_dir = CACHE_DIR
+
+  cache_filepath = f"{cache_dir}/{compute_cache_key(geojson_filepath, lats, lons)}.npz"
+
+  if os.path.isfile(cache_filepath):
+    cached = np.load(cache_filepath, allow_pickle=False)
+    weight_matrix = sparse.csr_matrix(
+      (cached["data"], cached["indices"], cached["indptr"]),
+      shape=tuple(cached["shape"])
+    )
+    return weight_matrix, cached["district_names"].tolist()
+
+  weight_matrix, district_names = build_district_weights(
+    geojson_filepath = geojson_filepath,
+    lats = lats,
+    lons = lons
+  )
+
+  os.makedirs(cache_dir, exist_ok=True)
+  np.savez(
+    cache_filepath,
+    data = weight_matrix.data,
+    indices = weight_matrix.indices,
+    indptr = weight_matrix.indptr,
+    shape = np.array(weight_matrix.shape),
+    district_names = np.array(district_names, dtype=str)
+  )
+
+  return weight_matrix, district_names
+
+def apply_district_weights(weight_matrix: sparse.csr_matrix, grids: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Computes the district means of a whole stack of grids at once.
+  Missing cells (masked or NaN) are left out and the remaining weights of the
+  district renormalized.
+
+  Input: weight_matrix - The row normalized district x cell weight matrix
+         grids - A (num grids x num lats x num lons) stack of grids
+
+  Output: A (num grids x num districts) array of district means. Districts that
+  don't overlap any valid cell are NaN
+  """
+  num_grids = grids.shape[0]
+
+  values = np.ma.filled(np.ma.masked_invalid(grids).astype(np.float64), np.nan).reshape(num_grids, -1)
+  valid = np.isfinite(values)
+  values[~valid] = 0
+
+  weighted_sums = (weight_matrix @ values.T).T
+  weight_totals = (weight_matrix @ valid.T.astype(np.float64)).T
+
+  with np.errstate(invalid="ignore", divide="ignore"):
+    return np.where(weight_totals > 0, weighted_sums/weight_totals, np.nan)
+
+def normalize_rows(weight_matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+  row_sums = np.asarray(weight_matrix.sum(axis=1)).ravel()
+  row_sums[row_sums == 0] = 1
+  return (sparse.diags(1/row_sums) @ weight_matrix).tocsr()
+
+def compute_cell_edges(centers: np.ndarray) -> np.ndarray:
+  """
+  Purpose: Computes the edges of the cells of a regular grid axis from the cell centers
+
+  Input: centers - The cell centers
+
+  Output: An array of len(centers) + 1 edges
+  """
+  centers = np.asarray(centers, dtype=np.float64)
+  if len(centers) == 1:
+    return np.array([centers[0] - .5, centers[0] + .5])
+
+  step = np.median(np.diff(centers))
+  return np.concatenate([centers - step/2, [centers[-1] + step/2]])
+
+def compute_cache_key(geojson_filepath: str, lats: np.ndarray, lons: np.ndarray) -> str:
+  key = hashlib.sha1()
+  with open(geojson_filepath, "rb") as geo_file:
+    key.update(geo_file.read())
+  key.update(np.asarray(lats, dtype=np.float64).tobytes())
+  key.update(np.asarray(lons, dtype=np.float64).tobytes())
+  return key.hexdigest()
@@ -0,0 +1,423 @@
+import argparse
+import os
+import pandas as pd
+import sys
+import numpy as np
+import time
+import netCDF4 as nc
+
+from typing import Iterable, Union
+
+from area_weights import load_or_build_district_weights, apply_district_weights
+from granule_catalog import GranuleCatalog, parse_granule_link
+
+# The region registry lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.region_registry import region_registry, MIN_LAT_KEY, MAX_LAT_KEY, MIN_LON_KEY, MAX_LON_KEY
+from common.instrumentation import run_profiler, add_profile_argument
+from common.district_ids import district_id_registry, DISTRICT_ID_COL, UNKNOWN_DISTRICT_ID
+from common.datacube import district_datacube
+
+# Mapping Keys
+DISTRICT_KEY = "district"
+DISTRICT_ID_KEY = DISTRICT_ID_COL
+COUNTRY_KEY = "country"
+YEAR_KEY = "year"
+MONTH_KEY = "month"
+
+# The column each MERRA-2 variable is written to. Variables not listed here keep their own name
+VARIABLE_COLUMNS = {
+  "TLML" : "temperature in (K)",
+  "PRECTOTCORR" : "PRECTOTLAND kg m-2 s-1",
+  "QLML" : "specific humidity in (kg kg-1)",
+  "GWETTOP" : "surface soil wetness"
+}
+
+DEFAULT_VARIABLES = ["TLML", "PRECTOTCORR"]
+
+# The datacube variable each MERRA-2 variable is written to. Variables not listed here are left out of it
+DATACUBE_VARIABLES = {
+  "TLML" : "temperature",
+  "PRECTOTCORR" : "precipitation",
+  "QLML" : "specific_humidity",
+  "GWETTOP" : "soil_wetness"
+}
+
+"""
+Notes:
+
+Before running this python script it is required to have the appropriate setup in order to
+execute wget properly to rechieve the NASA data. Please see this link for the setup steps
+required: https://disc.gsfc.nasa.gov/data-access#windows_wget
+
+Every granule is opened once and all of the variables requested are read from it, so
+adding a variable to a run costs next to nothing as long as the links request it.
+
+Downloaded granules are recorded in the granule catalog (see granule_catalog.py) and
+the granules to extract are looked up in it rather than found by scanning the disk. Only
+the granules of the links file are extracted unless --all-catalogued asks for every
+catalogued granule of the links' products.
+
+Every row carries the district's id from the district id registry (see
+common/district_ids.py) and the yearly averages are grouped on it, or on the country and
+district names for the districts the registry doesn't know. The monthly district values
+are also written into the district datacube (see common/datacube.py).
+"""
+
+def main():
+
+  nasa_links_filepath, countries, download_data, variables, start_year, end_year, all_catalogued, profile = extract_arguments()
+
+  with run_profiler.run(script="fetch_nasa_merra2_data", profile=profile):
+    print("Downloading and parsing NASA data")
+    with run_profiler.stage("retrieve_nasa_data"):
+      fileinfos = retrieve_nasa_data(
+        filepath = nasa_links_filepath,
+        download_data = download_data,
+        variables = variables,
+        start_year = start_year,
+        end_year = end_year,
+        all_catalogued = all_catalogued
+      )
+    with run_profiler.stage("retrieve_merra2_data"):
+      merra2_data = retrieve_merra2_data(fileinfos=fileinfos, variables=variables)
+    print("Finished downloading and parsing NASA data")
+
+    print("Collapsing MERRA-2 data")
+    with run_profiler.stage("collapse_merra2_data"):
+      merra2_df = collapse_merra2_data(
+        merra2_data = merra2_data,
+        countries = countries
+      )
+    print("Finished collapsing MERRA-2 data")
+
+    with run_profiler.stage("yearly_average"):
+      yearly_merra2_df = combine_data_to_be_yearly_average_per_district(
+        df = merra2_df,
+        columns = [variable_column(variable) for variable in variables]
+      )
+
+      yearly_merra2_df.to_csv("yearly_merra2_data_by_district.csv", index = False)
+      run_profiler.count("rows", yearly_merra2_df.shape[0])
+
+def extract_arguments() -> Iterable[Union[str, list, bool, int]]:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: filepath - The filepath to the links specified by the user
+          countries - The countries specified by the user
+          download_data - Whether the data should be downloaded
+          variables - The MERRA-2 variables to extract
+          start_year / end_year - The range of years to extract
+          all_catalogued - Whether to extract every catalogued granule of the links' products
+          profile - Whether to profile the run
+  """
+
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the text file containing the links to pull the files from")
+  parser.add_argument("-d", "--download", required=False, action='store_true', help="Fetch all of the data specified in the file")
+  parser.add_argument("-c", "--countries", type=str, nargs="+", required=True, help="The countries we wish to fetch the data for")
+  parser.add_argument("-v", "--variables", type=str, nargs="+", default=DEFAULT_VARIABLES, help="The MERRA-2 variables to extract from every granule")
+  parser.add_argument("--start-year", type=int, default=None, help="Only extract the granules from this year onwards")
+  parser.add_argument("--end-year", type=int, default=None, help="Only extract the granules up to and including this year")
+  parser.add_argument("--all-catalogued", required=False, action="store_true", help="Extract every catalogued granule of the links' products, not just the granules in the links file")
+  add_profile_argument(parser)
+
+  args = parser.parse_args()
+
+  """
+  Validate the following:
+
+    1. The filepath has a length > 0
+    2. The filepath actually points to a file
+  """
+
+  filepath = args.filepath
+  countries = args.countries
+  download_data = args.download
+  variables = args.variables
+
+  if (
+    len(filepath) <= 0 or
+    os.path.isfile(filepath) is False
+  ):
+    print(f"The filepath: {filepath} is either not a valid file.")
+    sys.exit(-1)
+
+  for country in countries:
+    if len(country) <= 0:
+      print(f"The country: {country} is not valid")
+      sys.exit(-1)
+
+  for variable in variables:
+    if len(variable) <= 0:
+      print(f"The variable: {variable} is not valid")
+      sys.exit(-1)
+
+  return filepath, countries, download_data, variables, args.start_year, args.end_year, args.all_catalogued, args.profile
+
+def retrieve_nasa_data(
+  filepath: str,
+  download_data: bool,
+  variables: list = DEFAULT_VARIABLES,
+  start_year: int = None,
+  end_year: int = None,
+  all_catalogued: bool = False,
+  catalog: GranuleCatalog = None
+) -> list:
+  """
+  Purpose: Issues wget calls and downloads the specified data files from the urls stored in the
+  specified text files, registers the downloaded granules in the granule catalog and looks up
+  the granules of the links holding the variables in the catalog
+
+  Input: filepath - The filepth to the file holding the links
+         download_data - Whether the data should be downloaded
+         variables - The variables the granules must contain
+         start_year / end_year - An inclusive range of years (either bound optional)
+         all_catalogued - Whether to look up every catalogued granule of the links' products
+                          rather than only the granules of the links
+         catalog - The granule catalog (defaults to the catalog at CATALOG_FILEPATH)
+
+  Output: A list of (filename, date recorded) tuples ordered by date
+  """
+  if catalog is None:
+    catalog = GranuleCatalog()
+
+  links = []
+
+  with open(filepath, "r") as file_containing_links:
+    links = file_containing_links.readlines()
+
+  granule_links = [parse_granule_link(link) for link in links]
+  granule_links = [granule_link for granule_link in granule_links if granule_link is not None]
+
+  if download_data:
+    for granule_link in granule_links:
+      os.system(f"wget --tries=0 --read-timeout=20 --load-cookies ~/.urs_cookies --save-cookies ~/.urs_cookies --auth-no-challenge=on --keep-session-cookies \"{granule_link['url']}\"")
+      time.sleep(5)
+
+  catalog.register_links(links=links)
+
+  products = sorted(set(granule_link["product"] for granule_link in granule_links))
+  if len(products) <= 0:
+    return []
+
+  # Only keep the granules holding every variable requested
+  granules = None
+  for variable in variables:
+    variable_granules = catalog.query(
+      product = products,
+      variable = variable,
+      start_year = start_year,
+      end_year = end_year,
+      paths = None if all_catalogued else [granule_link["file_name"] for granule_link in granule_links]
+    )
+    variable_paths = set(granule["path"] for granule in variable_granules)
+    granules = variable_granules if granules is None else [granule for granule in granules if granule["path"] in variable_paths]
+
+  return [(granule["path"], f"{granule['year']}-{granule['month']:02d}") for granule in granules if granule["year"] is not None]
+
+def retrieve_merra2_data(fileinfos: list, variables: list) -> tuple:
+  """
+  Purpose: Reads every variable requested from every granule in a single pass,
+  stacking each variable's grids into a stack of monthly grids. Granules with
+  several time steps are averaged into a single grid for the month.
+
+  Input: fileinfos - The file infos list containing tuples of the (filename, date recorded)
+         variables - The MERRA-2 variables to read
+
+  Output: A tuple of a dictionary of variable -> (num months x num lats x num lons)
+  stack of grids, the list of dates recorded (one per grid), the latitudes and the
+  longitudes of the grid
+  """
+
+  grids = {variable : [] for variable in variables}
+  recorded_dates = []
+  lats = None
+  lons = None
+
+  for file_name, recorded_date in fileinfos:
+    if os.path.isfile(file_name) is False:
+      continue
+
+    try:
+      ds = nc.Dataset(file_name)
+    except Exception as err:
+      print(f"Skipping {file_name} since it could not be read: {err}")
+      continue
+
+    with ds:
+      missing_variables = [variable for variable in variables if variable not in ds.variables]
+      if len(missing_variables) > 0:
+        print(f"Skipping {file_name} since it is missing the variables: {', '.join(missing_variables)}")
+        continue
+
+      file_lats = np.asarray(ds['lat'][:], dtype=np.float64)
+      file_lons = np.asarray(ds['lon'][:], dtype=np.float64)
+
+      if lats is None:
+        lats = file_lats
+        lons = file_lons
+      elif np.shape(file_lats) != np.shape(lats) or np.shape(file_lons) != np.shape(lons):
+        print(f"Skipping {file_name} since its grid does not match the other files")
+        continue
+
+      for variable in variables:
+        grids[variable].append(np.ma.mean(ds[variable][:], axis=0))
+
+      recorded_dates.append(recorded_date)
+      run_profiler.count("granules")
+
+  if len(recorded_dates) <= 0:
+    return {variable : np.ma.zeros((0, 0, 0)) for variable in variables}, recorded_dates, np.array([]), np.array([])
+
+  return {variable : np.ma.stack(grids[variable]) for variable in variables}, recorded_dates, lats, lons
+
+def collapse_merra2_data(merra2_data: tuple, countries: list, csv_prefix: str = "merra2_data") -> pd.DataFrame:
+  """
+  Purpose: Computes the monthly value of every variable for every district as the
+  area weighted mean of the grid cells it overlaps. The weights of a country are
+  built (or loaded from the cache) once and applied to the grids of every variable
+  and month with a single sparse matrix multiply.
+
+  Input: merra2_data - The (grids, recorded dates, lats, lons) tuple of retrieve_merra2_data
+         countries - The countries to compute the district values for
+         csv_prefix - The prefix of the csv the monthly district values are saved to
+
+  Output: A wide dataframe with a row per country, year, month and district and a
+  column per variable
+
+  Side-Effects: Saves the csv data in the current directory for analysis and writes the
+  monthly values into the district datacube
+  """
+
+  grids, recorded_dates, lats, lons = merra2_data
+  variables = list(grids.keys())
+  columns = [variable_column(variable) for variable in variables]
+
+  years = [recorded_date.split("-")[0] for recorded_date in recorded_dates]
+  months = [recorded_date.split("-")[1] for recorded_date in recorded_dates]
+  num_grids = len(recorded_dates)
+
+  for country_to_retrieve in countries:
+
+    if region_registry.has_country(country_to_retrieve) is False:
+      print(f"Cannot fetch coordinate info from internal database for {country_to_retrieve}")
+      sys.exit(-1)
+
+  # A country whose GeoJSON was just dropped in has no district ids yet
+  district_id_registry.register_missing_districts(countries)
+
+  country_dfs = []
+
+  for country_to_retrieve in countries:
+
+    GEOJSON_DATA = region_registry.geojson_filepath(country_to_retrieve)
+
+    if num_grids <= 0:
+      continue
+
+    # Crop the grid to the country (plus a cell of margin) before building the weights
+    lat_idxs, lon_idxs = crop_grid_to_bounding_box(lats, lons, region_registry.country_bounds(country_to_retrieve))
+
+    weight_matrix, district_names = load_or_build_district_weights(
+      geojson_filepath = GEOJSON_DATA,
+      lats = lats[lat_idxs],
+      lons = lons[lon_idxs]
+    )
+
+    # Stack every variable's grids so all of them go through the same multiply
+    country_grids = np.ma.concatenate([
+      grids[variable][:, lat_idxs[:, None], lon_idxs] for variable in variables
+    ])
+    district_means = apply_district_weights(weight_matrix, country_grids)
+    num_districts = len(district_names)
+    district_ids = district_id_registry.district_ids([country_to_retrieve] * num_districts, district_names)
+    run_profiler.count("districts", num_districts)
+    run_profiler.count("pixels", len(lat_idxs) * len(lon_idxs) * country_grids.shape[0])
+
+    country_df = {
+      COUNTRY_KEY : country_to_retrieve,
+      YEAR_KEY : np.repeat(years, num_districts),
+      MONTH_KEY : np.repeat(months, num_districts),
+      DISTRICT_KEY : np.tile(district_names, num_grids),
+      DISTRICT_ID_KEY : np.tile(district_ids, num_grids)
+    }
+    for variable_idx, column in enumerate(columns):
+      country_df[column] = district_means[variable_idx*num_grids:(variable_idx + 1)*num_grids].ravel()
+
+    country_dfs.append(pd.DataFrame(country_df))
+
+  merra2_df = pd.DataFrame(columns=[COUNTRY_KEY, YEAR_KEY, MONTH_KEY, DISTRICT_KEY, DISTRICT_ID_KEY] + columns)
+  if len(country_dfs) > 0:
+    merra2_df = pd.concat(country_dfs, ignore_index=True).dropna(subset=columns, how="all")
+
+  merra2_df_save_name = csv_prefix
+  for country_to_retrieve in countries:
+    merra2_df_save_name += f"_{country_to_retrieve.lower()}"
+  merra2_df_save_name += ".csv"
+
+  merra2_df.to_csv(merra2_df_save_name, index=False)
+  run_profiler.count("rows", merra2_df.shape[0])
+
+  datacube_columns = {
+    variable_column(variable) : DATACUBE_VARIABLES[variable] for variable in variables if variable in DATACUBE_VARIABLES
+  }
+  run_profiler.count("datacube_values", district_datacube.write_frame(merra2_df, datacube_columns, year_col=YEAR_KEY, month_col=MONTH_KEY))
+
+  return merra2_df
+
+def crop_grid_to_bounding_box(lats: np.ndarray, lons: np.ndarray, coords_range: dict) -> tuple:
+  """
+  Purpose: Finds the rows and columns of a grid covering a bounding box, with a
+  margin of one cell so cells straddling the border are kept
+
+  Input: lats - The latitudes of the grid
+         lons - The longitudes of the grid
+         coords_range - The bounding box
+
+  Output: A tuple of the latitude indexes and the longitude indexes
+  """
+  lat_step = np.abs(np.median(np.diff(lats))) if len(lats) > 1 else 0
+  lon_step = np.abs(np.median(np.diff(lons))) if len(lons) > 1 else 0
+
+  lat_idxs = np.nonzero(
+    (lats >= coords_range[MIN_LAT_KEY] - lat_step) & (lats <= coords_range[MAX_LAT_KEY] + lat_step)
+  )[0]
+  lon_idxs = np.nonzero(
+    (lons >= coords_range[MIN_LON_KEY] - lon_step) & (lons <= coords_range[MAX_LON_KEY] + lon_step)
+  )[0]
+
+  return lat_idxs, lon_idxs
+
+def combine_data_to_be_yearly_average_per_district(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+  """
+  Purpose: Computes the yearly average of every column for every district
+
+  Input: df - The monthly district data
+         columns - The columns to average
+
+  Output: A dataframe with a row per country, district and year
+  """
+  aggregations = {COUNTRY_KEY : "first", DISTRICT_KEY : "first"}
+  aggregations.update({column : "mean" for column in columns})
+  unknown_aggregations = {DISTRICT_ID_KEY : "first"}
+  unknown_aggregations.update({column : "mean" for column in columns})
+
+  # The districts the registry doesn't know all share UNKNOWN_DISTRICT_ID, so they are
+  # told apart by their country and district names instead
+  known = df[DISTRICT_ID_KEY] != UNKNOWN_DISTRICT_ID
+  yearly_df = pd.concat([
+    df[known].groupby([DISTRICT_ID_KEY, YEAR_KEY], as_index=False, sort=False).agg(aggregations),
+    df[~known].groupby([COUNTRY_KEY, DISTRICT_KEY, YEAR_KEY], as_index=False, sort=False).agg(unknown_aggregations)
+  ], ignore_index=True)
+  return yearly_df[[COUNTRY_KEY, DISTRICT_KEY, DISTRICT_ID_KEY, YEAR_KEY] + columns]
+
+def variable_column(variable: str) -> str:
+  return VARIABLE_COLUMNS.get(variable, variable)
+
+if __name__ == "__main__":
+  main()
@@ -1,52 +1,24 @@
 import argparse
-import json
 import os
 import pandas as pd
-import requests
 import sys
-import numpy as np
-import time
-import netCDF4 as nc
 
-from pyhdf.SD import SD, SDC
 from typing import Iterable, Union
-from io import StringIO
-from shapely.geometry import shape, Point
-
-MIN_LAT_KEY = "min_lat"
-MAX_LAT_KEY = "max_lat"
-MIN_LON_KEY = "min_lon"
-MAX_LON_KEY = "max_lon"
-
-COORDS_RANGE = {
-  "serbia" : {
-    MIN_LAT_KEY : 40,
-    MAX_LAT_KEY : 48,
-    MIN_LON_KEY : 18,
-    MAX_LON_KEY : 25
-  },
-  "pakistan" : {
-    MIN_LAT_KEY : 22,
-    MAX_LAT_KEY : 38,
-    MIN_LON_KEY : 60,
-    MAX_LON_KEY : 77
-  },
-  "afghanistan" : {
-    MIN_LAT_KEY : 29,
-    MAX_LAT_KEY : 39,
-    MIN_LON_KEY : 63,
-    MAX_LON_KEY : 70
-  }
-}
-
-# Temperature Mapping Keys
-LAT_KEY = "latitude"
-LON_KEY = "longitude"
+
+from fetch_nasa_merra2_data import (
+  retrieve_nasa_data,
+  retrieve_merra2_data,
+  collapse_merra2_data,
+  combine_data_to_be_yearly_average_per_district as combine_merra2_data_to_be_yearly_average_per_district,
+  COUNTRY_KEY
+)
+
+# The run profiler lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.instrumentation import run_profiler, add_profile_argument
+
+MERRA2_VARIABLE = "TLML"
 TEMP_KEY = "temperature in (K)"
-DISTRICT_KEY = "district"
-COUNTRY_KEY = "country"
-YEAR_KEY = "year"
-MONTH_KEY = "month"
 
 """
 Notes:
@@ -54,34 +26,43 @@ Notes:
 Before running this python script it is required to have the appropriate setup in order to
 execute wget properly to rechieve the NASA data. Please see this link for the setup steps 
 required: https://disc.gsfc.nasa.gov/data-access#windows_wget
+
+This script only extracts TLML. To extract it alongside the other MERRA-2 variables in a
+single pass over the granules use fetch_nasa_merra2_data.py instead.
 """
 
 def main():
   
-  nasa_links_filepath, countries, download_data = extract_arguments()
+  nasa_links_filepath, countries, download_data, profile = extract_arguments()
   
-  print("Downloading and parsing NASA data")
-  fileinfos = retrieve_nasa_data(
-    filepath = nasa_links_filepath,
-    download_data = download_data
-  )
-  temp_data_map = retrieve_temperature_data(fileinfos=fileinfos)
-  print("Finished downloading and parsing NASA data")
-
-  print("Collapsing temperature data map")
-  temp_df = collapse_temperature_data(
-    temp_data_map = temp_data_map,
-    countries = countries
-  )
-  print("Finished collapsing temperature data map")
-
-  temp_df = combine_data_to_be_yearly_average_per_district(
-    countries = countries,
-    df = pd.read_csv("../data/individual_data_sets/temperature_data/temperature_data_serbia_pakistan_afghanistan.csv")
-    #df = temp_df
-  )
-
-  temp_df.to_csv("yearly_temperature_data_by_district.csv", index = False)
+  with run_profiler.run(script="fetch_nasa_temperature_data", profile=profile):
+    print("Downloading and parsing NASA data")
+    with run_profiler.stage("retrieve_nasa_data"):
+      fileinfos = retrieve_nasa_data(
+        filepath = nasa_links_filepath,
+        download_data = download_data,
+        variables = [MERRA2_VARIABLE]
+      )
+    with run_profiler.stage("retrieve_temperature_data"):
+      temperature_data_map = retrieve_temperature_data(fileinfos=fileinfos)
+    print("Finished downloading and parsing NASA data")
+
+    print("Collapsing temperature data map")
+    with run_profiler.stage("collapse_temperature_data"):
+      temperature_df = collapse_temperature_data(
+        temperature_data_map = temperature_data_map,
+        countries = countries
+      )
+    print("Finished collapsing temperature data map")
+
+    with run_profiler.stage("yearly_average"):
+      temperature_df = combine_data_to_be_yearly_average_per_district(
+        countries = countries,
+        df = temperature_df
+      )
+
+      temperature_df.to_csv("yearly_temperature_data_by_district.csv", index = False)
+      run_profiler.count("rows", temperature_df.shape[0])
 
 def extract_arguments() -> Iterable[Union[str, list, bool]]:
   """
@@ -89,16 +70,18 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
 
   Input: None
 
-  Output: filepath - The csv filepath specified by the user
+  Output: filepath - The filepath to the links specified by the user
+          countries - The countries specified by the user
+          download_data - Whether the data should be downloaded
+          profile - Whether to profile the run
   """
 
-  CSV_FILE_ENDING = ".csv"
-
   parser = argparse.ArgumentParser()
   
   parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the text file containing the links to pull the files from")
   parser.add_argument("-d", "--download", required=False, action='store_true', help="Fetch all of the data specified in the file")
-  parser.add_argument("-c", "--countries", type=str, nargs="+", required=True, help="The countries we wish to fetch the NDVI data for")
+  parser.add_argument("-c", "--countries", type=str, nargs="+", required=True, help="The countries we wish to fetch the temperature data for")
+  add_profile_argument(parser)
 
   args = parser.parse_args()
 
@@ -107,7 +90,6 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
 
     1. The filepath has a length > 0
     2. The filepath actually points to a file
-    3. The file pointed to by the filepath is a csv
   """
 
   filepath = args.filepath
@@ -126,220 +108,53 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
       print(f"The country: {country} is not valid")
       sys.exit(-1)
 
-  return filepath, countries, download_data
+  return filepath, countries, download_data, args.profile
 
-def retrieve_nasa_data(filepath: str, download_data: bool) -> list:
+def retrieve_temperature_data(fileinfos: list) -> tuple:
   """
-  Purpose: Issues wget calls and downloads the specified data files from the urls stored in the
-  specified text files
+  Purpose: Reads the TLML grid of every file into a single stack of monthly grids
 
-  Input: filepath - The filepth to the file holding the links
+  Input: fileinfos - The file infos list containing tuples of the (filename, date recorded)
 
-  Output: A list of all the files downloaded from the 
+  Output: A tuple of the (num months x num lats x num lons) stack of grids, the list
+  of dates recorded (one per grid), the latitudes and the longitudes of the grid
   """
-  fileinfos = []
-  links = []
-  
-  with open(filepath, "r") as file_containing_links:
-    links = file_containing_links.readlines()
-
-    if download_data:
-      for link in links:
-        os.system(f"wget --tries=0 --read-timeout=20 --load-cookies ~/.urs_cookies --save-cookies ~/.urs_cookies --auth-no-challenge=on --keep-session-cookies {link.strip()}")
-        time.sleep(5)
-
-  for link in links:
-    if os.path.isfile(link) is False:
-      continue
-    file_link_path = link.split("/")
-    queried_file_name = file_link_path[-1].strip()
-    file_name = queried_file_name.split(".nc4?")[0]
-    
-    date_recorded_info_start_idx = queried_file_name.find("_Nx.") + len("_Nx.")
-    date_recorded_info_end_idx = queried_file_name.find(".nc4")
-    date_recorded_info = queried_file_name[date_recorded_info_start_idx:date_recorded_info_end_idx]
-    date_recorded_info = f"{date_recorded_info[0:4]}-{date_recorded_info[4:6]}" 
-
-    fileinfos.append((file_name, date_recorded_info))
-
-  for file_name, date_recorded_info in fileinfos:
-    for root, dirs, files in os.walk(".", topdown=False):
-      for file in files:
-        if file_name in file:
-          os.rename(file, file_name)
-
-  return fileinfos
-
-def retrieve_temperature_data(fileinfos: list) -> dict:
-
-  temperature_data = {}
-
-  for file_name, recorded_date in fileinfos:
-    ds = nc.Dataset(file_name)
-    tlml_lats = ds['lat'][:]
-    tlml_lons = ds["lon"][:]
-    
-    tlml_data = ds['TLML'][:]
-    z, num_lats, num_lons = np.shape(tlml_data)
-
-    date_split = recorded_date.split("-")
-    year = date_split[0]
-    month = date_split[1]
-
-    if year not in temperature_data:
-      temperature_data[year] = {}
-    
-    if month not in temperature_data[year]:
-      temperature_data[year][month] = []
-
-    for z_idx in range(0, z):
-      for lat_idx in range(0, num_lats):
-        for lon_idx in range(0, num_lons):
-          temp_in_kelvin = tlml_data[z_idx, lat_idx, lon_idx]
-
-          temperature_data[year][month].append({
-            LAT_KEY  : tlml_lats[lat_idx],
-            LON_KEY  : tlml_lons[lon_idx],
-            TEMP_KEY : temp_in_kelvin
-          })
-
-  return temperature_data
-
-def collapse_temperature_data(temp_data_map: dict, countries: list) -> pd.DataFrame:
-
-  FEATURES_KEY = "features"
-  GEOMETRY_KEY = "geometry"
-  PROPERTIES_KEY = "properties"
-  NAME_KEY = "name"
-
-  temperature_data = {
-    COUNTRY_KEY : [],
-    YEAR_KEY : [],
-    MONTH_KEY : [],
-    DISTRICT_KEY : [],
-    LAT_KEY : [],
-    LON_KEY : [],
-    TEMP_KEY : []
-  }
-
-  for country_to_retrieve in countries:
-
-    COUNTRY_LOWERCASE = country_to_retrieve.lower()
-    GEOJSON_DATA = f"../data/geodata/{COUNTRY_LOWERCASE}/{COUNTRY_LOWERCASE}-districts.geojson"
-
-    geodata = None
-    with open(GEOJSON_DATA, "r") as geo_file:
-      geodata = json.load(geo_file)
-
-    if COUNTRY_LOWERCASE not in COORDS_RANGE:
-      print(f"Cannot fetch coordinate info from internal database for {country_to_retrieve}")
-      sys.exit(-1)
-
-    min_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LAT_KEY]
-    max_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LAT_KEY]
-    min_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LON_KEY]
-    max_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LON_KEY]
-
-    years = temp_data_map.keys()
-    for year in years:
-      months = temp_data_map[year].keys()
-      for month in months:
-        list_of_temp_data = temp_data_map[year][month]
-
-        for temp_info in list_of_temp_data:
-          lat = temp_info[LAT_KEY]
-          lon = temp_info[LON_KEY]
-          temp = temp_info[TEMP_KEY]
-
-          if max_lat > lat and lat > min_lat and max_lon > lon and lon > min_lon:
-            coordinate = Point(lon, lat)
-
-            polygon = None
-            if FEATURES_KEY in geodata:
-              for feature in geodata[FEATURES_KEY]:
-                properties = feature[PROPERTIES_KEY]
-                feature_name = properties[NAME_KEY]
-                polygon = shape(feature[GEOMETRY_KEY])
-                if polygon.contains(coordinate):
-                  temperature_data[COUNTRY_KEY].append(country_to_retrieve)
-                  temperature_data[DISTRICT_KEY].append(feature_name)
-                  temperature_data[MONTH_KEY].append(month)
-                  temperature_data[YEAR_KEY].append(year)
-                  temperature_data[LAT_KEY].append(lat)
-                  temperature_data[LON_KEY].append(lon)
-                  temperature_data[TEMP_KEY].append(temp)
-
-            elif GEOMETRY_KEY in geodata:
-              properties = geodata[PROPERTIES_KEY]
-              feature_name = properties[NAME_KEY]
-              polygon = shape(geodata[GEOMETRY_KEY])
-              if polygon.contains(coordinate):
-                temperature_data[COUNTRY_KEY].append(country_to_retrieve)
-                temperature_data[DISTRICT_KEY].append(feature_name)
-                temperature_data[MONTH_KEY].append(month)
-                temperature_data[YEAR_KEY].append(year)
-                temperature_data[LAT_KEY].append(lat)
-                temperature_data[LON_KEY].append(lon)
-                temperature_data[TEMP_KEY].append(temp)
-
-  temp_df = pd.DataFrame(temperature_data)
-
-  temp_df_save_name = f"temperature_data"
-  for country_to_retrieve in countries:
-    temp_df_save_name += f"_{country_to_retrieve.lower()}"
-  temp_df_save_name += ".csv"
-
-  temp_df.to_csv(temp_df_save_name, index=False)
-
-  return temp_df
-
-def combine_data_to_be_yearly_average_per_district(countries: list, df: pd.DataFrame):
+  grids, recorded_dates, lats, lons = retrieve_merra2_data(fileinfos=fileinfos, variables=[MERRA2_VARIABLE])
+  return grids[MERRA2_VARIABLE], recorded_dates, lats, lons
 
+def collapse_temperature_data(temperature_data_map: tuple, countries: list) -> pd.DataFrame:
   """
-  Steps:
-    1. Filter on each country
-    2. Filter on each year
-    3. Filter on each district
-    4. Compute the average of each district in that year
-  """
-
-  yearly_district_avg_df = {
-    COUNTRY_KEY : [],
-    DISTRICT_KEY : [],
-    YEAR_KEY : [],
-    TEMP_KEY : []
-  }
-
-  for country in countries:
+  Purpose: Computes the monthly temperature of every district as the area weighted mean of
+  the grid cells it overlaps (see fetch_nasa_merra2_data.collapse_merra2_data)
 
-    country_df = df[df[COUNTRY_KEY] == country]
-    # Now we need to grab a list of unique values for every year
-    years = set(country_df[YEAR_KEY].values)
+  Input: temperature_data_map - The (grids, recorded dates, lats, lons) tuple of retrieve_temperature_data
+         countries - The countries to compute the district temperature for
 
-    for year in years:
-      # Now we shall filter off of the districts
-      yearly_country_df = country_df[country_df[YEAR_KEY] == year]
-      
-      # We need to get all of the districts
-      districts = set(yearly_country_df[DISTRICT_KEY].values)
+  Output: A dataframe with the monthly temperature of every district
 
-      for district in districts:        
-        temperature_average = 0
-        temperature_sum = 0
+  Side-Effects: Saves the csv data in the current directory for analysis
+  """
+  grids, recorded_dates, lats, lons = temperature_data_map
 
-        district_df = yearly_country_df[yearly_country_df[DISTRICT_KEY] == district]
+  return collapse_merra2_data(
+    merra2_data = ({MERRA2_VARIABLE : grids}, recorded_dates, lats, lons),
+    countries = countries,
+    csv_prefix = "temperature_data"
+  )
 
-        for idx, row in district_df.iterrows():
-          temperature_sum += row[TEMP_KEY]
+def combine_data_to_be_yearly_average_per_district(countries: list, df: pd.DataFrame) -> pd.DataFrame:
+  """
+  Purpose: Computes the yearly average temperature of every district of the countries
 
-        temperature_average = temperature_sum/len(district_df.index)
+  Input: countries - The countries to keep
+         df - The monthly district temperature
 
-        yearly_district_avg_df[COUNTRY_KEY].append(country)
-        yearly_district_avg_df[DISTRICT_KEY].append(district)
-        yearly_district_avg_df[YEAR_KEY].append(year)
-        yearly_district_avg_df[TEMP_KEY].append(temperature_average)
-    
-  return pd.DataFrame(yearly_district_avg_df)
+  Output: A dataframe with a row per country, district and year
+  """
+  return combine_merra2_data_to_be_yearly_average_per_district(
+    df = df[df[COUNTRY_KEY].isin(countries)],
+    columns = [TEMP_KEY]
+  )
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
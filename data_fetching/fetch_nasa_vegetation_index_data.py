@@ -1,42 +1,22 @@
 import argparse
-import json
 import os
 import pandas as pd
-import requests
 import sys
 import numpy as np
 import time
 
 from pyhdf.SD import SD, SDC
 from typing import Iterable, Union
-from io import StringIO
-from shapely.geometry import shape, Point
-
-MIN_LAT_KEY = "min_lat"
-MAX_LAT_KEY = "max_lat"
-MIN_LON_KEY = "min_lon"
-MAX_LON_KEY = "max_lon"
-
-COORDS_RANGE = {
-  "serbia" : {
-    MIN_LAT_KEY : 40,
-    MAX_LAT_KEY : 48,
-    MIN_LON_KEY : 18,
-    MAX_LON_KEY : 25
-  },
-  "pakistan" : {
-    MIN_LAT_KEY : 22,
-    MAX_LAT_KEY : 38,
-    MIN_LON_KEY : 60,
-    MAX_LON_KEY : 77
-  },
-  "afghanistan" : {
-    MIN_LAT_KEY : 29,
-    MAX_LAT_KEY : 39,
-    MIN_LON_KEY : 63,
-    MAX_LON_KEY : 70
-  }
-}
+
+from granule_catalog import GranuleCatalog, parse_granule_link
+
+# The region registry lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.region_registry import region_registry, MIN_LAT_KEY, MAX_LAT_KEY, MIN_LON_KEY, MAX_LON_KEY
+from common.admin_locator import admin_locator
+from common.instrumentation import run_profiler, add_profile_argument
+from common.district_ids import district_id_registry, add_district_id_column, DISTRICT_ID_COL, UNKNOWN_DISTRICT_ID
+from common.datacube import district_datacube
 
 # NVDI Mapping Keys
 REC_DATE_KEY = "recorded_date"
@@ -44,37 +24,60 @@ LAT_KEY = "latitude"
 LON_KEY = "longitude"
 NVDI_KEY = "NVDI Val"
 DISTRICT_KEY = "district"
+DISTRICT_ID_KEY = DISTRICT_ID_COL
 COUNTRY_KEY = "country"
 YEAR_KEY = "year"
 MONTH_KEY = "month"
 AVG_NVDI_KEY = "Avg. NVDI Val"
 
+# The datacube variable the monthly district NVDI is written to
+DATACUBE_VARIABLE = "ndvi"
+
+# The dataset holding the NDVI in the CMG HDF files
+NDVI_SDS = "CMG 0.05 Deg MONTHLY NDVI"
+
+VGI_DATA_DIR = "../data/individual_data_sets/vegetation_data"
+
 """
 Notes:
 
 Before running this python script it is required to have the appropriate setup in order to
 execute wget properly to rechieve the NASA data. Please see this link for the setup steps 
 required: https://disc.gsfc.nasa.gov/data-access#windows_wget
+
+The monthly average NVDI of every district is also written into the district datacube
+(see common/datacube.py).
 """
 
 def main():
   
-  nasa_links_filepath, countries, download_data = extract_arguments()
-  fileinfos = retrieve_nasa_data(
-    filepath = nasa_links_filepath,
-    download_data = download_data
-  )
+  nasa_links_filepath, countries, download_data, all_catalogued, profile = extract_arguments()
 
-  vegetation_index_map = retrieve_country_vegetation_index(fileinfos=fileinfos, countries=countries)
+  with run_profiler.run(script="fetch_nasa_vegetation_index_data", report_dir=VGI_DATA_DIR, profile=profile):
+    with run_profiler.stage("retrieve_nasa_data"):
+      fileinfos = retrieve_nasa_data(
+        filepath = nasa_links_filepath,
+        download_data = download_data,
+        all_catalogued = all_catalogued
+      )
 
-  vgi_df = collapse_VGI_map_to_df(vegetation_index_map=vegetation_index_map)
+    with run_profiler.stage("retrieve_country_vegetation_index"):
+      vegetation_index_map = retrieve_country_vegetation_index(fileinfos=fileinfos, countries=countries)
 
-  yearly_avg_district_df = combine_data_to_be_yearly_average_per_district(
-    countries = countries,
-    df = vgi_df
-  )
+    with run_profiler.stage("collapse_VGI_map_to_df"):
+      vgi_df = collapse_VGI_map_to_df(vegetation_index_map=vegetation_index_map)
+
+    with run_profiler.stage("datacube"):
+      write_VGI_to_datacube(df=vgi_df)
+
+    with run_profiler.stage("yearly_average"):
+      yearly_avg_district_df = combine_data_to_be_yearly_average_per_district(
+        countries = countries,
+        df = vgi_df
+      )
 
-  yearly_avg_district_df.to_csv(f"../data/individual_data_sets/vegetation_data/vgi_data.csv", index=False)
+      yearly_avg_district_df.to_csv(f"{VGI_DATA_DIR}/vgi_data.csv", index=False)
+      run_profiler.count("rows", yearly_avg_district_df.shape[0])
 
 def extract_arguments() -> Iterable[Union[str, list, bool]]:
   """
@@ -83,6 +86,10 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
   Input: None
 
   Output: filepath - The csv filepath specified by the user
+          countries - The countries specified by the user
+          download_data - Whether the data should be downloaded
+          all_catalogued - Whether to extract every catalogued granule of the links' products
+          profile - Whether to profile the run
   """
 
   CSV_FILE_ENDING = ".csv"
@@ -92,6 +99,8 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
   parser.add_argument("-f", "--filepath", type=str, required=True, help="The filepath to the text file containing the links to pull the files from")
   parser.add_argument("-d", "--download", required=False, action='store_true', help="Fetch all of the data specified in the file")
   parser.add_argument("-c", "--countries", type=str, nargs="+", required=True, help="The countries we wish to fetch the NDVI data for")
+  parser.add_argument("--all-catalogued", required=False, action="store_true", help="Extract every catalogued granule of the links' products, not just the granules in the links file")
+  add_profile_argument(parser)
 
   args = parser.parse_args()
 
@@ -119,35 +128,54 @@ def extract_arguments() -> Iterable[Union[str, list, bool]]:
       print(f"The country: {country} is not valid")
       sys.exit(-1)
 
-  return filepath, countries, download_data
+  return filepath, countries, download_data, args.all_catalogued, args.profile
 
-def retrieve_nasa_data(filepath: str, download_data: bool) -> list:
+def retrieve_nasa_data(filepath: str, download_data: bool, all_catalogued: bool = False, catalog: GranuleCatalog = None) -> list:
   """
   Purpose: Issues wget calls and downloads the specified data files from the urls stored in the
-  specified text files
+  specified text files, registers the downloaded granules in the granule catalog and looks up
+  the NDVI granules of the links in the catalog
 
   Input: filepath - The filepth to the file holding the links
+         download_data - Whether the data should be downloaded
+         all_catalogued - Whether to look up every catalogued NDVI granule of the links'
+                          products rather than only the granules of the links
+         catalog - The granule catalog (defaults to the catalog at CATALOG_FILEPATH)
 
-  Output: A list of all the files downloaded from the 
+  Output: A list of (filename, date recorded) tuples ordered by date
   """
-  fileinfos = []
+  if catalog is None:
+    catalog = GranuleCatalog()
+
   links = []
   
   with open(filepath, "r") as file_containing_links:
     links = file_containing_links.readlines()
 
-  for link in links:
-    file_link_path = link.split("/")
-    file_name = file_link_path[-1].strip()
-    date_recorded_info = file_link_path[-2]
-    fileinfos.append((file_name, date_recorded_info))
+  granule_links = [parse_granule_link(link) for link in links]
+  granule_links = [granule_link for granule_link in granule_links if granule_link is not None]
 
   if download_data:
-    for link in links:
-      os.system(f"wget --tries=0 --read-timeout=20 --load-cookies ~/.urs_cookies --save-cookies ~/.urs_cookies --auth-no-challenge=on --keep-session-cookies {link.strip()}")
+    for granule_link in granule_links:
+      os.system(f"wget --tries=0 --read-timeout=20 --load-cookies ~/.urs_cookies --save-cookies ~/.urs_cookies --auth-no-challenge=on --keep-session-cookies {granule_link['url']}")
       time.sleep(5)
-  
-  return fileinfos
+
+  catalog.register_links(links=links, variables=[NDVI_SDS])
+
+  products = sorted(set(granule_link["product"] for granule_link in granule_links))
+  if len(products) <= 0:
+    return []
+
+  granules = catalog.query(
+    product = products,
+    variable = NDVI_SDS,
+    paths = None if all_catalogued else [granule_link["file_name"] for granule_link in granule_links]
+  )
+
+  return [
+    (granule["path"], f"{granule['year']}.{granule['month']:02d}.{granule['day']:02d}")
+    for granule in granules if granule["day"] is not None
+  ]
 
 def display_hdf_files(filenames: list) -> None:
   """
@@ -162,7 +190,7 @@ def display_hdf_files(filenames: list) -> None:
       file = SD(filename, SDC.READ)
       datasets_dic = file.datasets()
 
-      sds_obj = file.select('CMG 0.05 Deg MONTHLY NDVI') # select sds
+      sds_obj = file.select(NDVI_SDS) # select sds
 
       data = sds_obj.get() # get sds data
       print(data.shape)
@@ -173,17 +201,16 @@ def retrieve_country_vegetation_index(fileinfos: list, countries: list) -> dict:
   countries of interest. After determining the coordinates it retrieves the data
   information at that coordinate and stores it into a dictionary
 
+  Only the window of the matrix covering a country's bounding box is read from
+  each HDF file and the district every pixel in that window belongs to is worked
+  out once per country rather than once per file, so the cost of a file scales
+  with the area of the country instead of the globe.
+
   Input: fileinfos - The file infos list containing tuples of the (filename, date recorded)
          countries - A list of countries 
 
-  Output: A dictionary containing the information on the data of interest
+  Output: A dictionary containing a list of data frames (one per file) for every country
   """
-  FEATURES_KEY = "features"
-  GEOMETRY_KEY = "geometry"
-  PROPERTIES_KEY = "properties"
-  NAME_KEY = "name"
-  TYPE_KEY = "type"
-  COORDINATES_KEY = "coordinates"
 
   print(f"Starting to get NVDI data")
 
@@ -191,86 +218,87 @@ def retrieve_country_vegetation_index(fileinfos: list, countries: list) -> dict:
 
   for country_to_retrieve in countries:
 
-    COUNTRY_LOWERCASE = country_to_retrieve.lower()
-    GEOJSON_DATA = f"../data/geodata/{COUNTRY_LOWERCASE}/{COUNTRY_LOWERCASE}-districts.geojson"
-
-    geodata = None
-    with open(GEOJSON_DATA, "r") as geo_file:
-      geodata = json.load(geo_file)
-
-    if COUNTRY_LOWERCASE not in COORDS_RANGE:
+    if region_registry.has_country(country_to_retrieve) is False:
       print(f"Cannot fetch coordinate info from internal database for {country_to_retrieve}")
       sys.exit(-1)
 
     vegetation_index_map[country_to_retrieve] = []
 
-    min_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LAT_KEY]
-    max_lat = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LAT_KEY]
-    min_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MIN_LON_KEY]
-    max_lon = COORDS_RANGE[COUNTRY_LOWERCASE][MAX_LON_KEY]
+    country_bounds = region_registry.country_bounds(country_to_retrieve)
+    min_lat = country_bounds[MIN_LAT_KEY]
+    max_lat = country_bounds[MAX_LAT_KEY]
+    min_lon = country_bounds[MIN_LON_KEY]
+    max_lon = country_bounds[MAX_LON_KEY]
+
+    row_start, row_end, col_start, col_end = compute_matrix_window(
+      min_lat = min_lat,
+      max_lat = max_lat,
+      min_lon = min_lon,
+      max_lon = max_lon
+    )
+
+    # Pixel center coordinates of the window
+    lats = 90 - (np.arange(row_start, row_end)*.05)
+    lons = (np.arange(col_start, col_end)*.05) - 180
+
+    pixel_labels = admin_locator.label_grid(
+      country = country_to_retrieve,
+      lats = lats,
+      lons = lons
+    )
+    label_rows, label_cols, label_districts = pixel_labels
 
-    data = None
     for filename, date_recorded_info in fileinfos:
       vgi_data_retrieval_start = time.time()
-      if os.path.isfile(filename):
-        
-        file = SD(filename, SDC.READ)
+      if os.path.isfile(filename) is False:
+        continue
 
-        sds_obj = file.select('CMG 0.05 Deg MONTHLY NDVI') # select sds
+      file = SD(filename, SDC.READ)
 
-        data = sds_obj.get() # get sds data
+      sds_obj = file.select(NDVI_SDS) # select sds
 
-      if data is None:
-        continue
+      window = sds_obj[row_start:row_end, col_start:col_end] # only read the country's window
+
+      file.end()
 
       print(f"Analyzing file: {filename}")
+      run_profiler.count("granules")
+      run_profiler.count("pixels", len(label_districts))
+
+      vegetation_index_map[country_to_retrieve].append(
+        pd.DataFrame({
+          DISTRICT_KEY : label_districts,
+          REC_DATE_KEY : date_recorded_info,
+          LAT_KEY : lats[label_rows],
+          LON_KEY : lons[label_cols],
+          NVDI_KEY : window[label_rows, label_cols]
+        })
+      )
 
-      num_rows, num_cols = data.shape
-      
-      for col_idx in range(0, num_cols):
-        for row_idx in range(0, num_rows):
-          lon = (col_idx*.05) - 180
-          lat = 90-(row_idx*.05)
-          if max_lat > lat and lat > min_lat and max_lon > lon and lon > min_lon:
-            coordinate = Point(lon, lat)
-
-            polygon = None
-            if FEATURES_KEY in geodata:
-              for feature in geodata[FEATURES_KEY]:
-                properties = feature[PROPERTIES_KEY]
-                feature_name = properties[NAME_KEY]
-                polygon = shape(feature[GEOMETRY_KEY])
-                if polygon.contains(coordinate):
-
-                  vegetation_index_map[country_to_retrieve].append(
-                    {
-                      DISTRICT_KEY : feature_name,
-                      REC_DATE_KEY : date_recorded_info,
-                      LAT_KEY : lat,
-                      LON_KEY : lon,
-                      NVDI_KEY : data[row_idx][col_idx]
-                    }
-                  )
-
-            elif GEOMETRY_KEY in geodata:
-              properties = geodata[PROPERTIES_KEY]
-              feature_name = properties[NAME_KEY]
-              polygon = shape(geodata[GEOMETRY_KEY])
-              if polygon.contains(coordinate):
-                vegetation_index_map[country_to_retrieve].append(
-                  {
-                    DISTRICT_KEY : feature_name,
-                    REC_DATE_KEY : date_recorded_info,
-                    LAT_KEY : lat,
-                    LON_KEY : lon,
-                    NVDI_KEY : data[row_idx][col_idx]
-                  }
-                )
-      
       print(f"Finished retrieving NVDI data time to complete: : {time.time() - vgi_data_retrieval_start}")
 
   return vegetation_index_map
 
+def compute_matrix_window(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> tuple:
+  """
+  Purpose: Converts a bounding box into the (row_start, row_end, col_start, col_end)
+  slice of the 3600 x 7200 matrix covering it
+
+  Input: min_lat, max_lat, min_lon, max_lon - The bounding box
+
+  Output: The row and column slice bounds (ends are exclusive)
+  """
+  NUM_ROWS = 3600
+  NUM_COLS = 7200
+
+  # Latitude decreases as the row index increases
+  row_start = max(0, convert_latitude_to_matrix_idx(max_lat))
+  row_end = min(NUM_ROWS, convert_latitude_to_matrix_idx(min_lat) + 1)
+  col_start = max(0, convert_longitude_to_matrix_idx(min_lon))
+  col_end = min(NUM_COLS, convert_longitude_to_matrix_idx(max_lon) + 1)
+
+  return row_start, row_end, col_start, col_end
+
 def convert_latitude_to_matrix_idx(latitude: int) -> int:
   """
   Purpose: Some HDFs have data stored in a 3600 x 7200 matrix. As a result,
@@ -303,7 +331,7 @@ def collapse_VGI_map_to_df(vegetation_index_map: dict) -> pd.DataFrame:
   Purpose: Collapse the dictionary of data into a CSV containing the
   following columns:
 
-  country, year, month, district, latitude, longitude, NVDI Val
+  country, year, month, district, district_id, latitude, longitude, NVDI Val
   
   Input: vegetation_index_map - The vegetation data map
 
@@ -314,90 +342,90 @@ def collapse_VGI_map_to_df(vegetation_index_map: dict) -> pd.DataFrame:
 
   csv_title = f"vgi_data_for"
 
-  vgi_df = {
-    COUNTRY_KEY : [],
-    YEAR_KEY : [],
-    MONTH_KEY : [],
-    DISTRICT_KEY : [],
-    LAT_KEY : [],
-    LON_KEY : [],
-    NVDI_KEY : []
-  }
+  country_dfs = []
 
   for country, data in vegetation_index_map.items():
 
     csv_title += f"_{country}"
 
-    for district_data in data:
-      vgi_df[COUNTRY_KEY].append(country)
-      vgi_df[DISTRICT_KEY].append(district_data[DISTRICT_KEY])
-      recorded_date_split = district_data[REC_DATE_KEY].split(".")
-      year = recorded_date_split[0]
-      month = recorded_date_split[1]
-
-      vgi_df[YEAR_KEY].append(year)
-      vgi_df[MONTH_KEY].append(month)
-      vgi_df[LAT_KEY].append(district_data[LAT_KEY])
-      vgi_df[LON_KEY].append(district_data[LON_KEY])
-      vgi_df[NVDI_KEY].append(district_data[NVDI_KEY])
+    if len(data) <= 0:
+      continue
+
+    country_df = pd.concat(data, ignore_index=True)
+    recorded_date_split = country_df[REC_DATE_KEY].str.split(".", expand=True)
+
+    country_dfs.append(pd.DataFrame({
+      COUNTRY_KEY : country,
+      YEAR_KEY : recorded_date_split[0],
+      MONTH_KEY : recorded_date_split[1],
+      DISTRICT_KEY : country_df[DISTRICT_KEY],
+      LAT_KEY : country_df[LAT_KEY],
+      LON_KEY : country_df[LON_KEY],
+      NVDI_KEY : country_df[NVDI_KEY]
+    }))
   
   csv_title += ".csv"
-  vgi_df = pd.DataFrame(vgi_df)
+  vgi_df = pd.DataFrame(columns=[COUNTRY_KEY, YEAR_KEY, MONTH_KEY, DISTRICT_KEY, LAT_KEY, LON_KEY, NVDI_KEY])
+  if len(country_dfs) > 0:
+    vgi_df = pd.concat(country_dfs, ignore_index=True)
+
+  # A country whose GeoJSON was just dropped in has no district ids yet
+  district_id_registry.register_missing_districts(list(vegetation_index_map.keys()))
+  vgi_df = add_district_id_column(vgi_df, country_col=COUNTRY_KEY, district_col=DISTRICT_KEY)
 
   vgi_df.to_csv(csv_title, index = False)
+  run_profiler.count("rows", vgi_df.shape[0])
 
   return vgi_df
 
-def combine_data_to_be_yearly_average_per_district(countries: list, df: pd.DataFrame):
+def monthly_district_nvdi(df: pd.DataFrame) -> pd.DataFrame:
+  # Fill values (-12000 and below) count as 0, as they do in the yearly average
+  df = df.assign(**{AVG_NVDI_KEY : df[NVDI_KEY].where(df[NVDI_KEY] > -12000, 0)})
+  return df.groupby([DISTRICT_ID_KEY, YEAR_KEY, MONTH_KEY], as_index=False, sort=False)[AVG_NVDI_KEY].mean()
 
+def write_VGI_to_datacube(df: pd.DataFrame) -> None:
   """
-  Steps:
-    1. Filter on each country
-    2. Filter on each year
-    3. Filter on each district
-    4. Compute the average of each district in that year
+  Purpose: Writes the monthly average NVDI of every district into the district datacube
+
+  Input: df - The pixel NVDI values
+
+  Output: None
   """
+  monthly_df = monthly_district_nvdi(df)
+  written = district_datacube.write_frame(monthly_df, {AVG_NVDI_KEY : DATACUBE_VARIABLE}, year_col=YEAR_KEY, month_col=MONTH_KEY)
+  run_profiler.count("datacube_values", written)
 
-  yearly_district_avg_df = {
-    COUNTRY_KEY : [],
-    DISTRICT_KEY : [],
-    YEAR_KEY : [],
-    AVG_NVDI_KEY : []
-  }
+def combine_data_to_be_yearly_average_per_district(countries: list, df: pd.DataFrame):
 
-  for country in countries:
+  """
+  Purpose: Computes the yearly average NVDI of every district of the countries. Fill
+  values (-12000 and below) count as 0 towards the average, as they always have
 
-    country_df = df[df[COUNTRY_KEY] == country]
-    # Now we need to grab a list of unique values for every year
-    years = set(country_df[YEAR_KEY].values)
-
-    for year in years:
-      # Now we shall filter off of the districts
-      yearly_country_df = country_df[country_df[YEAR_KEY] == year]
-      
-      # We need to get all of the districts
-      districts = set(yearly_country_df[DISTRICT_KEY].values)
-
-      for district in districts:        
-        nvdi_average = 0
-        nvdi_sum = 0
-
-        district_df = yearly_country_df[yearly_country_df[DISTRICT_KEY] == district]
-
-        for idx, row in district_df.iterrows():
-          nvdi_val = row[AVG_NVDI_KEY]
-
-          if nvdi_val > -12000:
-            nvdi_sum += nvdi_val
-        
-        nvdi_average = nvdi_sum/len(district_df.index)
-
-        yearly_district_avg_df[COUNTRY_KEY].append(country)
-        yearly_district_avg_df[DISTRICT_KEY].append(district)
-        yearly_district_avg_df[YEAR_KEY].append(year)
-        yearly_district_avg_df[AVG_NVDI_KEY].append(nvdi_average)
-    
-  return pd.DataFrame(yearly_district_avg_df)
+  Input: countries - The countries to keep
+         df - The pixel NVDI values
+
+  Output: A dataframe with a row per country, district and year
+  """
+  df = df[df[COUNTRY_KEY].isin(countries)]
+  df = df.assign(**{AVG_NVDI_KEY : df[NVDI_KEY].where(df[NVDI_KEY] > -12000, 0)})
+
+  # Grouped on the integer district id rather than the country and district names, but
+  # the districts the registry doesn't know all share UNKNOWN_DISTRICT_ID so they are
+  # told apart by their names instead
+  known = df[DISTRICT_ID_KEY] != UNKNOWN_DISTRICT_ID
+  yearly_df = pd.concat([
+    df[known].groupby([DISTRICT_ID_KEY, YEAR_KEY], as_index=False, sort=False).agg({
+      COUNTRY_KEY : "first",
+      DISTRICT_KEY : "first",
+      AVG_NVDI_KEY : "mean"
+    }),
+    df[~known].groupby([COUNTRY_KEY, DISTRICT_KEY, YEAR_KEY], as_index=False, sort=False).agg({
+      DISTRICT_ID_KEY : "first",
+      AVG_NVDI_KEY : "mean"
+    })
+  ], ignore_index=True)
+
+  return yearly_df[[COUNTRY_KEY, DISTRICT_KEY, DISTRICT_ID_KEY, YEAR_KEY, AVG_NVDI_KEY]]
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import netCDF4 as nc
+
+from typing import Iterable, Union
+from urllib.parse import urlsplit, unquote
+
+CATALOG_FILEPATH = "../data/cache/granules.sqlite"
+
+# Dimension variables requested alongside the data variables in OPeNDAP links
+DIMENSION_VARIABLES = ["time", "lat", "lon"]
+
+# MERRA-2 granules carry the month as YYYYMM after the _Nx. collection suffix
+MERRA2_DATE_REGEX = re.compile(r"_Nx\.(\d{4})(\d{2})")
+# MODIS / VIP granules live in a YYYY.MM.DD directory
+DIRECTORY_DATE_REGEX = re.compile(r"^(\d{4})\.(\d{2})\.(\d{2})$")
+
+CHECKSUM_CHUNK_SIZE = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+  path TEXT PRIMARY KEY,
+  url TEXT,
+  product TEXT NOT NULL,
+  year INTEGER,
+  month INTEGER,
+  day INTEGER,
+  min_lat REAL,
+  max_lat REAL,
+  min_lon REAL,
+  max_lon REAL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  checksum TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS granule_variables (
+  path TEXT NOT NULL REFERENCES granules(path) ON DELETE CASCADE,
+  variable TEXT NOT NULL,
+  PRIMARY KEY (variable, path)
+);
+CREATE INDEX IF NOT EXISTS granules_by_product_date ON granules(product, year, month, day);
+CREATE INDEX IF NOT EXISTS granules_by_url ON granules(url);
+"""
+
+"""
+Notes:
+
+The catalog records every granule we have on disk (product, variables, date, bounding
+box, local path, size and checksum) in a small SQLite database, so the fetchers can ask
+for e.g. all of the TLML granules between 2005 and 2015 with an indexed query instead
+of parsing filenames and walking the working directory.
+
+Files are only checksummed when they are registered for the first time or their size
+or modification time changed since they were registered.
+"""
+
+def main():
+
+  catalog_filepath, links_filepath, download_dir, product, variable, start_year, end_year = extract_arguments()
+
+  catalog = GranuleCatalog(catalog_filepath)
+
+  if links_filepath is not None:
+    with open(links_filepath, "r") as file_containing_links:
+      links = file_containing_links.readlines()
+    registered = catalog.register_links(links=links, download_dir=download_dir)
+    print(f"Registered {len(registered)} granules")
+
+  granules = catalog.query(
+    product = product,
+    variable = variable,
+    start_year = start_year,
+    end_year = end_year
+  )
+
+  for granule in granules:
+    print(f"{granule['product']}\t{format_date(granule)}\t{granule['size']}\t{granule['path']}")
+  print(f"{len(granules)} granules")
+
+def extract_arguments() -> Iterable[Union[str, int, None]]:
+  """
+  Purpose: extracts the arguments specified by the user
+
+  Input: None
+
+  Output: catalog_filepath - The filepath to the catalog database
+          links_filepath - The optional filepath to a links file to register
+          download_dir - The directory the links were downloaded to
+          product, variable, start_year, end_year - The query filters
+  """
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument("--catalog", type=str, default=CATALOG_FILEPATH, help="The filepath to the catalog database")
+  parser.add_argument("-f", "--filepath", type=str, default=None, help="A text file of links whose downloaded granules should be registered")
+  parser.add_argument("--download-dir", type=str, default=".", help="The directory the granules were downloaded to")
+  parser.add_argument("-p", "--product", type=str, default=None, help="Only list granules of this product")
+  parser.add_argument("-v", "--variable", type=str, default=None, help="Only list granules containing this variable")
+  parser.add_argument("--start-year", type=int, default=None, help="Only list granules from this year onwards")
+  parser.add_argument("--end-year", type=int, default=None, help="Only list granules up to and including this year")
+
+  args = parser.parse_args()
+
+  if args.filepath is not None and os.path.isfile(args.filepath) is False:
+    print(f"The filepath: {args.filepath} is either not a valid file.")
+    sys.exit(-1)
+
+  return args.catalog, args.filepath, args.download_dir, args.product, args.variable, args.start_year, args.end_year
+
+class GranuleCatalog:
+  """
+  Purpose: SQLite backed catalog of the granules downloaded to the local disk
+
+  Input: filepath - The filepath to the catalog database, created if it doesn't exist
+  """
+
+  def __init__(self, filepath: str = CATALOG_FILEPATH):
+    self.filepath = filepath
+    self.lock = threading.Lock()
+
+    catalog_dir = os.path.dirname(filepath)
+    if len(catalog_dir) > 0:
+      os.makedirs(catalog_dir, exist_ok=True)
+
+    self.connection = sqlite3.connect(filepath, check_same_thread=False)
+    self.connection.row_factory = sqlite3.Row
+    self.connection.execute("PRAGMA foreign_keys = ON")
+    self.connection.executescript(SCHEMA)
+
+  def close(self) -> None:
+    self.connection.close()
+
+  def register(
+    self,
+    path: str,
+    product: str,
+    variables: list,
+    year: int = None,
+    month: int = None,
+    day: int = None,
+    url: str = None
+  ) -> dict:
+    """
+    Purpose: Records a granule in the catalog. The checksum and bounding box are only
+    recomputed if the file changed since it was last registered
+
+    Input: path - The filepath to the granule
+           product - The product (collection) the granule belongs to
+           variables - The variables stored in the granule
+           year, month, day - The date the granule was recorded
+           url - The url the granule was downloaded from
+
+    Output: The catalog row of the granule
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    with self.lock:
+      existing = self.connection.execute(
+        "SELECT * FROM granules WHERE path = ?", (path,)
+      ).fetchone()
+
+      if existing is not None and existing["size"] == stat.st_size and existing["mtime_ns"] == stat.st_mtime_ns:
+        checksum = existing["checksum"]
+        bbox = (existing["min_lat"], existing["max_lat"], existing["min_lon"], existing["max_lon"])
+      else:
+        checksum = compute_checksum(path)
+        bbox = read_granule_bbox(path)
+
+      with self.connection:
+        self.connection.execute(
+          "INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+          (path, url, product, year, month, day, *bbox, stat.st_size, stat.st_mtime_ns, checksum)
+        )
+        self.connection.execute("DELETE FROM granule_variables WHERE path = ?", (path,))
+        self.connection.executemany(
+          "INSERT INTO granule_variables VALUES (?, ?)",
+          [(path, variable) for variable in dict.fromkeys(variables)]
+        )
+
+      return dict(self.connection.execute("SELECT * FROM granules WHERE path = ?", (path,)).fetchone())
+
+  def register_links(self, links: list, download_dir: str = ".", variables: list = None) -> list:
+    """
+    Purpose: Registers the granules of a list of links that are present in the download
+    directory. wget saves OPeNDAP downloads under the full queried name, so those files
+    are renamed to the granule's file name. The download directory is listed once no
+    matter how many links there are.
+
+    Input: links - The links the granules were downloaded from
+           download_dir - The directory the granules were downloaded to
+           variables - The variables stored in the granules, overriding the ones in the links
+
+    Output: The catalog rows of the granules registered
+    """
+    granule_links = [parse_granule_link(link) for link in links]
+    granule_links = [granule_link for granule_link in granule_links if granule_link is not None]
+
+    downloaded_files = {}
+    if os.path.isdir(download_dir):
+      for entry in os.listdir(download_dir):
+        downloaded_files.setdefault(granule_file_name(entry), entry)
+
+    registered = []
+    for granule_link in granule_links:
+      file_name = granule_link["file_name"]
+      if file_name not in downloaded_files:
+        continue
+
+      path = os.path.join(download_dir, file_name)
+      if downloaded_files[file_name] != file_name and os.path.exists(path) is False:
+        os.rename(os.path.join(download_dir, downloaded_files[file_name]), path)
+
+      if os.path.isfile(path) is False:
+        continue
+
+      registered.append(self.register(
+        path = path,
+        product = granule_link["product"],
+        variables = granule_link["variables"] if variables is None else variables,
+        year = granule_link["year"],
+        month = granule_link["month"],
+        day = granule_link["day"],
+        url = granule_link["url"]
+      ))
+
+    return registered
+
+  def query(
+    self,
+    product: Union[str, list] = None,
+    variable: str = None,
+    start_year: int = None,
+    end_year: int = None,
+    present_only: bool = True,
+    paths: list = None
+  ) -> list:
+    """
+    Purpose: Finds the granules matching every filter specified
+
+    Input: product - A product or list of products
+           variable - A variable the granules must contain
+           start_year / end_year - An inclusive range of years (either bound optional)
+           present_only - Whether to leave out granules that were removed from disk
+           paths - Only the granules at these paths (e.g. the granules of a links file)
+
+    Output: A list of catalog rows (dictionaries) ordered by date
+    """
+    clauses = []
+    params = []
+
+    if product is not None:
+      products = [product] if isinstance(product, str) else list(product)
+      clauses.append(f"g.product IN ({', '.join('?' * len(products))})")
+      params.extend(products)
+
+    if variable is not None:
+      clauses.append("g.path IN (SELECT path FROM granule_variables WHERE variable = ?)")
+      params.append(variable)
+
+    if start_year is not None:
+      clauses.append("g.year >= ?")
+      params.append(start_year)
+
+    if end_year is not None:
+      clauses.append("g.year <= ?")
+      params.append(end_year)
+
+    sql = "SELECT g.* FROM granules g"
+    if len(clauses) > 0:
+      sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY g.year, g.month, g.day, g.path"
+
+    with self.lock:
+      rows = [dict(row) for row in self.connection.execute(sql, params).fetchall()]
+
+    if present_only:
+      rows = [row for row in rows if os.path.isfile(row["path"])]
+
+    # Filtered here rather than in SQL, a links file can hold more paths than SQLite takes parameters
+    if paths is not None:
+      paths = set(os.path.abspath(path) for path in paths)
+      rows = [row for row in rows if row["path"] in paths]
+
+    return rows
+
+  def variables(self, path: str) -> list:
+    with self.lock:
+      return [
+        row["variable"] for row in self.connection.execute(
+          "SELECT variable FROM granule_variables WHERE path = ? ORDER BY variable", (os.path.abspath(path),)
+        ).fetchall()
+      ]
+
+def parse_granule_link(link: str) -> dict:
+  """
+  Purpose: Works out the file name, product, variables and date of the granule a
+  link points to. Supports the MERRA-2 OPeNDAP links and the links to granules stored
+  in YYYY.MM.DD directories (MODIS / VIP)
+
+  Input: link - The link
+
+  Output: A dictionary of url, file_name, product, variables, year, month and day or
+  None if the line doesn't hold a link
+  """
+  SKIP_FILE_FLAG = "#"
+
+  link = link.strip()
+  if len(link) <= 0 or link[0] == SKIP_FILE_FLAG:
+    return None
+
+  split_link = urlsplit(link)
+  path_parts = [unquote(part) for part in split_link.path.split("/") if len(part) > 0]
+  if len(path_parts) <= 0:
+    return None
+
+  file_name = granule_file_name(path_parts[-1])
+
+  variables = []
+  if len(split_link.query) > 0:
+    for requested in unquote(split_link.query).split(","):
+      variable = requested.split("[")[0].strip()
+      if len(variable) > 0 and variable not in DIMENSION_VARIABLES:
+        variables.append(variable)
+
+  year = month = day = None
+  product = path_parts[-2] if len(path_parts) > 1 else ""
+
+  merra2_date = MERRA2_DATE_REGEX.search(file_name)
+  directory_date = DIRECTORY_DATE_REGEX.match(path_parts[-2]) if len(path_parts) > 1 else None
+
+  if merra2_date is not None:
+    year, month = int(merra2_date.group(1)), int(merra2_date.group(2))
+    # .../M2IMNXLFO.5.12.4/1980/MERRA2_100...nc4
+    if len(path_parts) > 2:
+      product = path_parts[-3]
+  elif directory_date is not None:
+    year, month, day = [int(val) for val in directory_date.groups()]
+    # .../VIP30.004/1981.01.01/VIP30.A1981001...hdf
+    if len(path_parts) > 2:
+      product = path_parts[-3]
+
+  return {
+    "url" : link,
+    "file_name" : file_name,
+    "product" : product,
+    "variables" : variables,
+    "year" : year,
+    "month" : month,
+    "day" : day
+  }
+
+def granule_file_name(name: str) -> str:
+  """
+  Purpose: Strips the OPeNDAP response suffix and query off a (downloaded) file name
+  e.g. MERRA2_100.instM_2d_lfo_Nx.198001.nc4.nc4?TLML[...] -> MERRA2_100.instM_2d_lfo_Nx.198001.nc4
+
+  Input: name - The file name
+
+  Output: The granule's file name
+  """
+  name = name.split("?")[0]
+  if name.endswith(".nc4.nc4"):
+    name = name[:-len(".nc4")]
+  return name
+
+def format_date(granule: dict) -> str:
+  if granule["year"] is None:
+    return "unknown"
+  if granule["day"] is None:
+    return f"{granule['year']}-{granule['month']:02d}"
+  return f"{granule['year']}-{granule['month']:02d}-{granule['day']:02d}"
+
+def compute_checksum(path: str) -> str:
+  checksum = hashlib.sha1()
+  with open(path, "rb") as granule_file:
+    for chunk in iter(lambda: granule_file.read(CHECKSUM_CHUNK_SIZE), b""):
+      checksum.update(chunk)
+  return checksum.hexdigest()
+
+def read_granule_bbox(path: str) -> tuple:
+  """
+  Purpose: Reads the (min_lat, max_lat, min_lon, max_lon) covered by a netCDF granule.
+  Granules that aren't netCDF (or have no lat / lon) are assumed to be global grids
+
+  Input: path - The filepath to the granule
+
+  Output: The bounding box
+  """
+  GLOBAL_BBOX = (-90.0, 90.0, -180.0, 180.0)
+
+  try:
+    with nc.Dataset(path) as ds:
+      if "lat" not in ds.variables or "lon" not in ds.variables:
+        return GLOBAL_BBOX
+      lats = ds["lat"][:]
+      lons = ds["lon"][:]
+      return (float(lats.min()), float(lats.max()), float(lons.min()), float(lons.max()))
+  except (OSError, ValueError):
+    return GLOBAL_BBOX
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,59 @@
+import os
+import sys
+
+from shapely.geometry import mapping
+
+# The region registry lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.region_registry import region_registry
+
+# Coordinates are rounded to ~10m which is plenty for a choropleth and keeps the payload small
+COORDINATE_PRECISION = 4
+
+FEATURES_KEY = "features"
+GEOMETRY_KEY = "geometry"
+PROPERTIES_KEY = "properties"
+COORDINATES_KEY = "coordinates"
+NAME_KEY = "name"
+COUNTRY_KEY = "country"
+
+def load_district_geometry(countries: list = None) -> dict:
+  """
+  Purpose: Combines the district GeoJSONs of the countries specified into a
+  single FeatureCollection stripped down to what the map needs (the country,
+  the district name and rounded coordinates)
+
+  Input: countries - The lowercase names of the countries to include (defaults to
+                     every country in the region registry)
+
+  Output: The combined FeatureCollection
+  """
+  if countries is None:
+    countries = region_registry.countries()
+
+  features = []
+
+  for country in countries:
+    for district in region_registry.districts(country):
+      geometry = mapping(district["geometry"])
+      features.append({
+        "type" : "Feature",
+        PROPERTIES_KEY : {
+          COUNTRY_KEY : country.capitalize(),
+          NAME_KEY : district[NAME_KEY]
+        },
+        GEOMETRY_KEY : {
+          "type" : geometry["type"],
+          COORDINATES_KEY : round_coordinates(geometry[COORDINATES_KEY])
+        }
+      })
+
+  return {
+    "type" : "FeatureCollection",
+    FEATURES_KEY : features
+  }
+
+def round_coordinates(coordinates):
+  if isinstance(coordinates[0], (int, float)):
+    return [round(val, COORDINATE_PRECISION) for val in coordinates]
+  return [round_coordinates(coordinate) for coordinate in coordinates]
@@ -0,0 +1,228 @@
+import os
+import threading
+import pandas as pd
+
+COMBINED_DATA = "../data/combined_district_data.csv"
+CCHF_DISTRICT_DATA = "../data/individual_data_sets/CCHF_data/cchf_district_data.csv"
+
+# Constants for the data
+YEAR_COL = "year"
+DISTRICT_COL = "district"
+TOT_CASES_CCHF_COL = "total cases"
+TOT_DEATHS_CCHF_COL = "total deaths"
+AVG_NVDI_COL = "Avg. NVDI Val"
+COUNTRY_PRECIPITATION_COL = "PRECTOTLAND kg m-2 s-1"
+COUNTRY_TEMPERATURE_COL = "temperature in (K)"
+DISTRICT_LAT_COL = "region/city lat"
+DISTRICT_LON_COL = "region/city lon"
+
+NO_DATA_MESSAGE = "No data found for this location."
+
+class DistrictMarkerIndex:
+  """
+  Purpose: Everything the homepage needs to draw a year, built once at app start
+  instead of on every request:
+
+    1. The coordinates of every district we have CCHF reports for
+    2. The combined data frame of every year
+    3. The markers of every year, both as compact rows and expanded into
+       (coordinates, popup message) tuples
+
+  The index is rebuilt when either csv changes on disk.
+
+  Input: combined_filepath - The filepath to the combined district data
+         cchf_district_filepath - The filepath to the CCHF district data
+  """
+
+  def __init__(self, combined_filepath: str = COMBINED_DATA, cchf_district_filepath: str = CCHF_DISTRICT_DATA):
+    self.combined_filepath = combined_filepath
+    self.cchf_district_filepath = cchf_district_filepath
+    self.lock = threading.Lock()
+    self.signature = None
+    self.version = 0
+    self.district_coords = {}
+    self.frames_by_year = {}
+    self.marker_rows_by_year = {}
+    self.markers_by_year = {}
+    self.no_data_marker_rows = []
+    self.no_data_markers = []
+    self.empty_frame = None
+    self.hits = 0
+    self.misses = 0
+    self.refresh_if_stale()
+
+  def refresh_if_stale(self) -> bool:
+    """
+    Purpose: Rebuilds the index if either csv was modified since it was built
+
+    Input: None
+
+    Output: Whether the index was rebuilt
+    """
+    signature = file_signature([self.combined_filepath, self.cchf_district_filepath])
+    if signature == self.signature:
+      self.hits += 1
+      return False
+
+    with self.lock:
+      if signature == self.signature:
+        self.hits += 1
+        return False
+      self.build()
+      self.signature = signature
+      self.version += 1
+      self.misses += 1
+
+    return True
+
+  def build(self) -> None:
+    district_coords = build_district_coords_map(self.cchf_district_filepath)
+
+    combined_df = pd.read_csv(self.combined_filepath)
+
+    frames_by_year = {}
+    marker_rows_by_year = {}
+    markers_by_year = {}
+    for year, year_df in combined_df.groupby(YEAR_COL):
+      frames_by_year[int(year)] = year_df
+      marker_rows_by_year[int(year)] = build_year_marker_rows(year_df, district_coords)
+      markers_by_year[int(year)] = build_year_markers(marker_rows_by_year[int(year)])
+
+    self.district_coords = district_coords
+    self.frames_by_year = frames_by_year
+    self.marker_rows_by_year = marker_rows_by_year
+    self.markers_by_year = markers_by_year
+    self.no_data_marker_rows = [list(coordinates) for coordinates in district_coords.values()]
+    self.no_data_markers = build_year_markers(self.no_data_marker_rows)
+    self.empty_frame = combined_df.iloc[0:0]
+
+  def frame_for_year(self, year: int) -> pd.DataFrame:
+    return self.frames_by_year.get(year, self.empty_frame)
+
+  def markers_for_year(self, year: int) -> list:
+    """
+    Purpose: Retrieves the markers for a year as a list of (coordinates, message)
+    tuples where a message of None marks a district we have no data for
+
+    Input: year - The year of interest
+
+    Output: The list of markers
+    """
+    return self.markers_by_year.get(year, self.no_data_markers)
+
+  def marker_rows_for_year(self, year: int) -> list:
+    """
+    Purpose: Retrieves the compact marker rows for a year (see build_year_marker_rows)
+
+    Input: year - The year of interest
+
+    Output: The list of marker rows
+    """
+    return self.marker_rows_by_year.get(year, self.no_data_marker_rows)
+
+def build_district_coords_map(filepath: str = CCHF_DISTRICT_DATA) -> dict:
+  """
+  Purpose: Maps every district to the coordinates of the first report assigned
+  to it which has valid coordinates
+
+  Input: filepath - The filepath to the CCHF district data
+
+  Output: A dictionary of district -> [lat, lon]
+  """
+  cchf_df = pd.read_csv(filepath, usecols=[DISTRICT_COL, DISTRICT_LAT_COL, DISTRICT_LON_COL])
+
+  cchf_df = cchf_df.dropna(subset=[DISTRICT_COL, DISTRICT_LAT_COL, DISTRICT_LON_COL])
+  cchf_df = cchf_df.drop_duplicates(subset=[DISTRICT_COL], keep="first")
+
+  return {
+    district : [float(lat), float(lon)] for district, lat, lon in zip(
+      cchf_df[DISTRICT_COL].values,
+      cchf_df[DISTRICT_LAT_COL].values,
+      cchf_df[DISTRICT_LON_COL].values
+    )
+  }
+
+def build_year_marker_rows(year_df: pd.DataFrame, district_coords: dict) -> list:
+  """
+  Purpose: Builds the compact marker rows for a single year in one pass over the
+  year's rows and one pass over the known districts. A row is either
+
+    [lat, lon] for a district without data for the year or
+    [lat, lon, cases, deaths, temperature, precipitation, nvdi] otherwise
+
+  with None standing in for missing values so the rows serialize straight to JSON
+
+  Input: year_df - The combined data for the year
+         district_coords - The district coordinates map
+
+  Output: A list of marker rows
+  """
+  rows = []
+
+  year_df = year_df.drop_duplicates(subset=[DISTRICT_COL], keep="first")
+  year_df = year_df.dropna(subset=[DISTRICT_LAT_COL, DISTRICT_LON_COL])
+  districts_with_data = set(year_df[DISTRICT_COL].values)
+
+  for district, coordinates in district_coords.items():
+    if district not in districts_with_data:
+      rows.append(list(coordinates))
+
+  columns = [
+    DISTRICT_LAT_COL,
+    DISTRICT_LON_COL,
+    TOT_CASES_CCHF_COL,
+    TOT_DEATHS_CCHF_COL,
+    COUNTRY_TEMPERATURE_COL,
+    COUNTRY_PRECIPITATION_COL,
+    AVG_NVDI_COL
+  ]
+
+  for row in year_df[columns].itertuples(index=False, name=None):
+    rows.append([None if pd.isna(val) else float(val) for val in row])
+
+  return rows
+
+def build_year_markers(marker_rows: list) -> list:
+  """
+  Purpose: Expands the compact marker rows into (coordinates, message) tuples.
+  Districts without data for the year have a message of None
+
+  Input: marker_rows - The marker rows of the year
+
+  Output: A list of (coordinates, message) tuples
+  """
+  markers = []
+  for row in marker_rows:
+    if len(row) > 2:
+      markers.append((row[:2], build_info_message(*row[2:])))
+    else:
+      markers.append((row[:2], None))
+  return markers
+
+def build_info_message(cases, deaths, temperature, precipitation, nvdi) -> str:
+
+  # In case we don't have data for a specific column
+  num_of_cchf_cases = known_or_unknown(cases)
+  num_of_cchf_deaths = known_or_unknown(deaths)
+  surface_temperature = known_or_unknown(temperature)
+  precip = known_or_unknown(precipitation)
+  nvdi_val = known_or_unknown(nvdi)
+
+  return f"""Total Number of CCHF Cases: {num_of_cchf_cases} <br>
+                       Total Number of CCHF Deaths: {num_of_cchf_deaths} <br>
+                       Avg Surface Temp: {surface_temperature} K<br>
+                       Avg Precipitation: {precip} kg m-2 s-1<br>
+                       Avg NVDI Value: {nvdi_val} <br>
+                    """
+
+def known_or_unknown(val):
+  if pd.isna(val):
+    return "Unknown"
+  return val
+
+def file_signature(filepaths: list) -> tuple:
+  signature = []
+  for filepath in filepaths:
+    stat = os.stat(filepath)
+    signature.append((filepath, stat.st_mtime_ns, stat.st_size))
+  return tuple(signature)
@@ -0,0 +1,269 @@
+import bisect
+import hashlib
+import math
+import threading
+import pandas as pd
+
+from typing import Union
+from district_marker_index import file_signature
+
+COMBINED_DATA = "../data/combined_district_data.csv"
+
+# Constants for the data
+COUNTRY_COL = "country"
+DISTRICT_COL = "district"
+YEAR_COL = "year"
+DISTRICT_LAT_COL = "region/city lat"
+DISTRICT_LON_COL = "region/city lon"
+
+# Metric names exposed through the API and the columns they are read from
+METRIC_COLUMNS = {
+  "cases" : "total cases",
+  "deaths" : "total deaths",
+  "ndvi" : "Avg. NVDI Val",
+  "precipitation" : "PRECTOTLAND kg m-2 s-1",
+  "temperature" : "temperature in (K)"
+}
+
+# Record keys
+COUNTRY_KEY = "country"
+DISTRICT_KEY = "district"
+YEAR_KEY = "year"
+LAT_KEY = "lat"
+LON_KEY = "lon"
+METRICS_KEY = "metrics"
+
+class DistrictStore:
+  """
+  Purpose: Read-only in-memory store of the combined district data. The csv is
+  read once and every record is indexed by year and by (country, district) so
+  lookups never touch the dataframe again. The store is reloaded when the csv
+  changes on disk (see refresh_if_stale).
+
+  Input: filepath - The filepath to the combined district data csv
+  """
+
+  def __init__(self, filepath: str = COMBINED_DATA):
+    self.filepath = filepath
+    self.lock = threading.Lock()
+    self.signature = None
+    self.version = ""
+    self.years = []
+    self.records_by_year = {}
+    self.records_by_district = {}
+    self.years_by_district = {}
+    self.names_by_key = {}
+    self.load()
+
+  def load(self) -> None:
+    """
+    Purpose: (Re)loads the csv and rebuilds every index
+
+    Input: None
+
+    Output: None
+    """
+    signature = file_signature([self.filepath])
+    with open(self.filepath, "rb") as csv_file:
+      version = hashlib.sha1(csv_file.read()).hexdigest()
+
+    df = pd.read_csv(self.filepath)
+
+    records_by_year = {}
+    records_by_district = {}
+
+    columns = [COUNTRY_COL, DISTRICT_COL, YEAR_COL, DISTRICT_LAT_COL, DISTRICT_LON_COL] + list(METRIC_COLUMNS.values())
+    for row in df[columns].itertuples(index=False, name=None):
+      country, district, year, lat, lon = row[:5]
+      metric_vals = row[5:]
+
+      record = {
+        COUNTRY_KEY : country,
+        DISTRICT_KEY : district,
+        YEAR_KEY : int(year),
+        LAT_KEY : to_json_number(lat),
+        LON_KEY : to_json_number(lon),
+        METRICS_KEY : {
+          metric : to_json_number(val) for metric, val in zip(METRIC_COLUMNS.keys(), metric_vals)
+        }
+      }
+
+      records_by_year.setdefault(record[YEAR_KEY], []).append(record)
+      records_by_district.setdefault(district_key(country, district), []).append(record)
+
+    for records in records_by_district.values():
+      records.sort(key=lambda record: record[YEAR_KEY])
+
+    self.years = sorted(records_by_year.keys())
+    self.records_by_year = records_by_year
+    self.records_by_district = records_by_district
+    self.years_by_district = {
+      key : [record[YEAR_KEY] for record in records] for key, records in records_by_district.items()
+    }
+
+    names_by_key = {}
+    for records in records_by_district.values():
+      names_by_key.setdefault(records[0][COUNTRY_KEY].lower(), records[0][COUNTRY_KEY])
+      names_by_key.setdefault(records[0][DISTRICT_KEY].lower(), records[0][DISTRICT_KEY])
+    self.names_by_key = names_by_key
+
+    # Set last so a cache key never carries the version of data that isn't in place yet
+    self.signature = signature
+    self.version = version
+
+  def refresh_if_stale(self) -> bool:
+    """
+    Purpose: Reloads the csv if it was modified since it was loaded
+
+    Input: None
+
+    Output: Whether the csv was reloaded
+    """
+    signature = file_signature([self.filepath])
+    if signature == self.signature:
+      return False
+
+    with self.lock:
+      if signature == self.signature:
+        return False
+      self.load()
+
+    return True
+
+  def query(
+    self,
+    start_year: Union[int, None] = None,
+    end_year: Union[int, None] = None,
+    country: Union[str, None] = None,
+    district: Union[str, None] = None
+  ) -> list:
+    """
+    Purpose: Retrieves the records for the inclusive year range specified,
+    optionally restricted to a country and/or a district
+
+    Input: start_year - The first year to include (None for no lower bound)
+           end_year - The last year to include (None for no upper bound)
+           country - The country to filter on (case insensitive)
+           district - The district to filter on (case insensitive)
+
+    Output: A list of the matching records ordered by year
+    """
+    if district is not None:
+      if country is not None:
+        keys = [district_key(country, district)]
+      else:
+        keys = [key for key in self.records_by_district if key[1] == district.lower()]
+
+      records = []
+      for key in keys:
+        district_records = self.records_by_district.get(key, [])
+        district_years = self.years_by_district.get(key, [])
+        lo, hi = year_range_bounds(district_years, start_year, end_year)
+        records.extend(district_records[lo:hi])
+
+      records.sort(key=lambda record: record[YEAR_KEY])
+      return records
+
+    lo, hi = year_range_bounds(self.years, start_year, end_year)
+
+    records = []
+    for year in self.years[lo:hi]:
+      # A reload may swap the indexes in between the two lookups
+      records.extend(self.records_by_year.get(year, []))
+
+    if country is not None:
+      records = [record for record in records if record[COUNTRY_KEY].lower() == country.lower()]
+
+    return records
+
+  def canonical_name(self, name: Union[str, None]) -> Union[str, None]:
+    """
+    Purpose: Spells a country or district the way the csv does, so a response doesn't
+    depend on the casing of the request that built it
+
+    Input: name - The country or district (any casing)
+
+    Output: The name as spelled in the csv (lower case when it isn't in the csv)
+    """
+    if name is None:
+      return None
+    return self.names_by_key.get(name.lower(), name.lower())
+
+  def build_bundle(self) -> dict:
+    """
+    Purpose: Builds a compact columnar bundle of every metric for every district
+    and year so the browser can switch years without going back to the server.
+    The values of a metric are laid out year major i.e.
+
+      values[metric][year_idx][district_idx]
+
+    with null marking a district that has no data for that year
+
+    Input: None
+
+    Output: The bundle dictionary
+    """
+    # A reload may swap the indexes while the bundle is built
+    years = self.years
+    records_by_district = self.records_by_district
+
+    district_keys = sorted(records_by_district.keys())
+    district_idxs = {key : idx for idx, key in enumerate(district_keys)}
+    year_idxs = {year : idx for idx, year in enumerate(years)}
+
+    districts = {
+      COUNTRY_KEY : [],
+      DISTRICT_KEY : [],
+      LAT_KEY : [],
+      LON_KEY : []
+    }
+
+    for key in district_keys:
+      first_record = records_by_district[key][0]
+      districts[COUNTRY_KEY].append(first_record[COUNTRY_KEY])
+      districts[DISTRICT_KEY].append(first_record[DISTRICT_KEY])
+      districts[LAT_KEY].append(first_record[LAT_KEY])
+      districts[LON_KEY].append(first_record[LON_KEY])
+
+    values = {
+      metric : [[None] * len(district_keys) for year in years] for metric in METRIC_COLUMNS
+    }
+
+    for key, records in records_by_district.items():
+      district_idx = district_idxs[key]
+      for record in records:
+        year_idx = year_idxs.get(record[YEAR_KEY])
+        if year_idx is None:
+          continue
+        for metric, val in record[METRICS_KEY].items():
+          values[metric][year_idx][district_idx] = val
+
+    return {
+      "years" : years,
+      "metrics" : list(METRIC_COLUMNS.keys()),
+      "districts" : districts,
+      "values" : values
+    }
+
+def district_key(country: str, district: str) -> tuple:
+  return (country.lower(), district.lower())
+
+def year_range_bounds(sorted_years: list, start_year: Union[int, None], end_year: Union[int, None]) -> tuple:
+  """
+  Purpose: Binary searches a sorted list of years for the slice covering the
+  inclusive range [start_year, end_year]
+
+  Input: sorted_years - The sorted years
+         start_year - The lower bound (None for no bound)
+         end_year - The upper bound (None for no bound)
+
+  Output: The (lo, hi) slice indices
+  """
+  lo = 0 if start_year is None else bisect.bisect_left(sorted_years, start_year)
+  hi = len(sorted_years) if end_year is None else bisect.bisect_right(sorted_years, end_year)
+  return lo, hi
+
+def to_json_number(val) -> Union[float, None]:
+  if val is None or math.isnan(val):
+    return None
+  return float(val)
@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+from flask import Response
+
+GZIP_MIN_SIZE = 512
+GZIP_LEVEL = 6
+
+class CachedJsonResponse:
+  """
+  Purpose: A serialized JSON payload together with its gzip encoding and ETag
+  so repeated requests never re-serialize or re-compress the same data
+  """
+
+  def __init__(self, payload):
+    self.body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    self.gzip_body = None
+    if len(self.body) >= GZIP_MIN_SIZE:
+      self.gzip_body = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+    self.etag = f"\"{hashlib.sha1(self.body).hexdigest()}\""
+
+class JsonResponseCache:
+  """
+  Purpose: A bounded LRU cache of serialized JSON responses keyed by the
+  normalized request parameters
+
+  Input: max_entries - The maximum number of responses to hold on to
+  """
+
+  def __init__(self, max_entries: int = 1024):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get_or_build(self, key, build_payload) -> CachedJsonResponse:
+    """
+    Purpose: Returns the cached response for the key, building and caching
+    it with the build_payload callable on a miss
+
+    Input: key - A hashable key describing the request
+           build_payload - A callable returning the JSON serializable payload
+
+    Output: The cached response
+    """
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+      self.misses += 1
+
+    entry = CachedJsonResponse(build_payload())
+
+    with self.lock:
+      self.entries[key] = entry
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+
+    return entry
+
+  def clear(self) -> None:
+    with self.lock:
+      self.entries.clear()
+
+def make_json_response(entry: CachedJsonResponse, request) -> Response:
+  """
+  Purpose: Builds the flask response for a cached entry, answering with a
+  304 when the client already holds the current ETag and with the gzip
+  body when the client accepts it
+
+  Input: entry - The cached response
+         request - The flask request being answered
+
+  Output: The flask response
+  """
+  headers = {
+    "ETag" : entry.etag,
+    "Cache-Control" : "no-cache",
+    "Vary" : "Accept-Encoding"
+  }
+
+  if entry.etag in request.headers.get("If-None-Match", ""):
+    return Response(status=304, headers=headers)
+
+  body = entry.body
+  if entry.gzip_body is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+    body = entry.gzip_body
+    headers["Content-Encoding"] = "gzip"
+
+  return Response(body, status=200, mimetype="application/json", headers=headers)
+
+def make_json_error(message: str, status: int = 400) -> Response:
+  body = json.dumps({"error" : message}).encode("utf-8")
+  return Response(body, status=status, mimetype="application/json")
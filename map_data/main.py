@@ -3,12 +3,29 @@
 Created on Tue Apr  7 15:55:57 2020
 @author: Dominic Schroeder and Karan Bhanot
 """
-from flask import Flask, render_template, request, session, redirect
-from geopy.geocoders import Nominatim
+from flask import Flask, render_template, request, session, Response, jsonify
 import folium
-import pandas as pd
-import json
-import math
+import os
+import sys
+import numpy as np
+
+from folium.plugins import FastMarkerCluster
+from district_geometry import load_district_geometry
+from district_marker_index import DistrictMarkerIndex, NO_DATA_MESSAGE
+from district_store import DistrictStore, METRIC_COLUMNS, to_json_number
+from json_responses import JsonResponseCache, make_json_response, make_json_error
+from request_metrics import MetricsRegistry, init_request_metrics, request_phase, PROMETHEUS_CONTENT_TYPE
+from map_render_cache import MapRenderCache
+
+# The datacube lives in the common package at the root of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.datacube import district_datacube
+from common.district_ids import district_id_registry, DISTRICT_ID_COL
+from common.spatial_weights import spatial_weights, CONTIGUITIES, QUEEN
+from common.spatial_statistics import (
+  spatial_autocorrelation, district_metric_values, VALUE_COL, NUM_NEIGHBOURS_COL,
+  LOCAL_I_COL, GI_STAR_COL, P_VALUE_COL, CLUSTER_COL, HOTSPOT_COL
+)
 
 app = Flask(__name__)
 # Required in order to use session cookies
@@ -33,6 +50,8 @@ NUM_OF_CATTLE_COL = "Num of cattle"
 POPULATION_COL = "Population"
 
 YEAR_KEY = "year"
+MARKERS_KEY = "markers"
+DEFAULT_YEAR = 1995
 
 DISTRICT_COL = "district"
 AVG_NVDI_COL = "Avg. NVDI Val"
@@ -41,152 +60,500 @@ COUNTRY_TEMPERATURE_COL = "temperature in (K)"
 DISTRICT_LAT_COL = "region/city lat" 
 DISTRICT_LON_COL = "region/city lon"
 
+# How the district markers are drawn, see create_info_markers
+MARKER_MODES = ["auto", "individual", "clustered"]
+MARKER_MODE = "auto"
+MARKER_CLUSTER_THRESHOLD = 200
+
+# Builds a marker from a compact marker row (see district_marker_index.build_year_marker_rows)
+CLUSTERED_MARKER_CALLBACK = """
+function (row) {
+  var hasData = row.length > 2;
+  var marker = L.marker(new L.LatLng(row[0], row[1]));
+  marker.setIcon(L.AwesomeMarkers.icon({
+    markerColor: hasData ? 'blue' : 'gray',
+    icon: 'info-sign',
+    prefix: 'glyphicon'
+  }));
+  marker.bindPopup(function () {
+    if (!hasData) {
+      return '""" + NO_DATA_MESSAGE + """';
+    }
+    var format = function (val, unit) {
+      return val === null ? 'Unknown' : val + unit;
+    };
+    return 'Total Number of CCHF Cases: ' + format(row[2], '') + ' <br>' +
+           'Total Number of CCHF Deaths: ' + format(row[3], '') + ' <br>' +
+           'Avg Surface Temp: ' + format(row[4], ' K') + '<br>' +
+           'Avg Precipitation: ' + format(row[5], ' kg m-2 s-1') + '<br>' +
+           'Avg NVDI Value: ' + format(row[6], '') + ' <br>';
+  }, {maxWidth: 250, minWidth: 250});
+  return marker;
+}
+"""
+
+# The combined district data is served from memory by the API and reloaded when the csv changes.
+# Its version is part of the API cache keys so a reload never serves a stale response
+district_store = DistrictStore(COMBINED_DATA)
+api_response_cache = JsonResponseCache()
+geometry_response_cache = JsonResponseCache(max_entries=1)
+
+# The district coordinates, per year frames and markers are built once and refreshed when the csvs change
+marker_index = DistrictMarkerIndex(COMBINED_DATA, CCHF_DISTRICT_DATA)
+district_geometry = load_district_geometry()
+
+# The rendered map of every year is cached and pre-rendered in the background at startup
+map_render_cache = MapRenderCache(lambda key: render_map_html(year=key[1], mode=key[2]))
+
+# Every request is timed (see the Server-Timing header and /metrics)
+metrics_registry = MetricsRegistry()
+metrics_registry.register_cache("api", api_response_cache)
+metrics_registry.register_cache("geometry", geometry_response_cache)
+metrics_registry.register_cache("marker_index", marker_index)
+metrics_registry.register_cache("map_render", map_render_cache)
+init_request_metrics(app, metrics_registry)
+
 @app.route('/', methods=["POST","GET"])
 def homepage():
-    
-  cchf_df = pd.read_csv(COMBINED_DATA)
+
+  # Pick up any changes to the csvs since the index was built
+  with request_phase("csv"):
+    if marker_index.refresh_if_stale():
+      warm_up_map_render_cache()
 
   # Default to the first item in our select list
   if (YEAR_KEY not in session):
-      session[YEAR_KEY] = 1995
+      session[YEAR_KEY] = DEFAULT_YEAR
   
   # Persist the values selected by the user in their session
   if request.method == 'POST':
       session.clear()
       session[YEAR_KEY] = int(request.form[YEAR_KEY])
 
-  # Convert the month and year to the proper format for parsing the dataframe
-  filtered_data = cchf_df[cchf_df[YEAR_COL] == session[YEAR_KEY]]
-  
-  # Set the coordinates and zoom so we can see both points
-  start_coords = (34.00, 63.00)
-  folium_map = folium.Map(location=start_coords, zoom_start=4)
-
-  # Add a map layer to allow for a heat map using the GeoJSON we created
-  folium.Choropleth(
-      geo_data="../data/geodata/afghanistan-serbia-pakistan-districts.geojson",
-      name='Afghanistan, Serbia, and Pakistan CCHF Cases',
-      data=filtered_data,
-      columns=[DISTRICT_COL, TOT_CASES_CCHF_COL],
-      key_on='feature.properties.name',
-      fill_color='YlOrRd',
-      fill_opacity=0.7,
-      line_opacity=0.2,
-      legend_name='Number of CCHF Cases',
-      show=True
-  ).add_to(folium_map)
-  
-  create_info_markers(
-    data = filtered_data,
-    folium_map = folium_map
-  )
+  # Allow the marker mode to be forced e.g. /?markers=clustered
+  marker_mode = request.args.get("markers", MARKER_MODE)
+  if marker_mode not in MARKER_MODES:
+    marker_mode = MARKER_MODE
+  session[MARKERS_KEY] = marker_mode
   
   date_selected = {
       "year_selected"  : session[YEAR_KEY]
   }
   
-  folium_map.save('templates/map.html')
-  
-  return render_template("index.html", data = date_selected)
+  with request_phase("render"):
+    return render_template("index.html", data = date_selected)
 
 @app.route('/map')
 def show_map():
-    return render_template('map.html')
-
-def create_info_markers(data, folium_map):
-    
-  marked_districts = []
-
-  district_coords_df = create_district_coords_map()
+  """
+  Purpose: The map of the year (and marker mode) selected on the homepage, served
+  from the render cache
+  """
+  key = (
+    marker_index.version,
+    session.get(YEAR_KEY, DEFAULT_YEAR),
+    session.get(MARKERS_KEY, MARKER_MODE)
+  )
 
-  # In case a user decides to select a year we dont have data for
-  for district, coords_data in district_coords_df.items():
+  with request_phase("map"):
+    html = map_render_cache.get(key)
+
+  return Response(html, mimetype="text/html")
+
+@app.route('/health')
+def health():
+  """
+  Purpose: Liveness check reporting the progress of the map warm-up. Always
+  answers with a 200 while the app is up
+  """
+  return jsonify({"status" : "ok", "warm_up" : map_render_cache.status()})
+
+@app.route('/health/ready')
+def health_ready():
+  """
+  Purpose: Readiness check answering with a 503 until the map of every year has
+  been pre-rendered
+  """
+  warm_up = map_render_cache.status()
+  status = 200 if warm_up["ready"] else 503
+  return jsonify({"status" : "ready" if warm_up["ready"] else "warming up", "warm_up" : warm_up}), status
+
+def render_map_html(year: int, mode: str = MARKER_MODE) -> str:
+  """
+  Purpose: Builds the folium map of a year and renders it to html
+
+  Input: year - The year selected
+         mode - The marker mode (see create_info_markers)
+
+  Output: The html of the map
+  """
+  filtered_data = marker_index.frame_for_year(year)
   
-    if data.empty or data[data[DISTRICT_COL] == district].empty:
-      
-      coordinates = [coords_data[DISTRICT_LAT_COL], coords_data[DISTRICT_LON_COL]]
-      folium.Marker(
-        location = coordinates,
-        popup = "No data found for this location.",
-        icon = folium.Icon(color='gray')
-      ).add_to(folium_map)
-
-      marked_districts.append(district)
-
-  if data.empty:
-    return
-
-  for idx, row in data.iterrows():
-
-    district = row[DISTRICT_COL]
-
-    if district in marked_districts:
-      continue
-
-    marked_districts.append(district)
-
-    coordinates = [row[DISTRICT_LAT_COL], row[DISTRICT_LON_COL]]
+  # Set the coordinates and zoom so we can see both points
+  start_coords = (34.00, 63.00)
+  folium_map = folium.Map(location=start_coords, zoom_start=4)
 
-    # In case we don't have data for a specific column
-    num_of_cchf_cases = "Unknown"
-    num_of_cchf_deaths = "Unknown"
-    surface_temperature = "Unknown"
-    precipitation = "Unknown"
-    nvdi = "Unknown"
-    
-    cchf_cases_row_val = row[TOT_CASES_CCHF_COL]
-    cchf_deaths_row_val = row[TOT_DEATHS_CCHF_COL]
-    surface_temp_row_val = row[COUNTRY_TEMPERATURE_COL]
-    precip_row_val = row[COUNTRY_PRECIPITATION_COL]
-    nvdi_row_val = row[AVG_NVDI_COL]
+  # Add a map layer to allow for a heat map using the GeoJSON we created
+  with request_phase("choropleth"):
+    folium.Choropleth(
+        geo_data=district_geometry,
+        name='Afghanistan, Serbia, and Pakistan CCHF Cases',
+        data=filtered_data,
+        columns=[DISTRICT_COL, TOT_CASES_CCHF_COL],
+        key_on='feature.properties.name',
+        fill_color='YlOrRd',
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name='Number of CCHF Cases',
+        show=True
+    ).add_to(folium_map)
+
+  with request_phase("markers"):
+    create_info_markers(
+      year = year,
+      folium_map = folium_map,
+      mode = mode
+    )
+
+  with request_phase("html"):
+    return folium_map.get_root().render()
+
+def warm_up_map_render_cache() -> None:
+  """
+  Purpose: Pre-renders the map of every year in the combined data (with the default
+  marker mode) in the background
+
+  Input: None
+
+  Output: None
+  """
+  version = marker_index.version
+  map_render_cache.warm_up(
+    version = version,
+    keys = [(version, year, MARKER_MODE) for year in sorted(marker_index.frames_by_year.keys())]
+  )
 
-    if math.isnan(cchf_cases_row_val) is False:
-      num_of_cchf_cases = cchf_cases_row_val
+@app.route('/api/districts')
+def api_districts():
+  """
+  Purpose: Read-only JSON view of the district metrics. Supports the following
+  query parameters:
+
+    year - A single year
+    start_year / end_year - An inclusive range of years (either bound optional)
+    country - Restrict to a country
+    district - Restrict to a district
+    metric - Restrict the metrics returned to one of METRIC_COLUMNS
+
+  Output: A (possibly gzipped) JSON response with an ETag
+  """
+  try:
+    year = parse_optional_int(request.args.get("year"))
+    start_year = parse_optional_int(request.args.get("start_year"))
+    end_year = parse_optional_int(request.args.get("end_year"))
+  except ValueError:
+    return make_json_error("year, start_year and end_year must be integers")
+
+  if year is not None:
+    start_year = year
+    end_year = year
+
+  country = request.args.get("country")
+  district = request.args.get("district")
+  metric = request.args.get("metric")
+
+  if metric is not None and metric not in METRIC_COLUMNS:
+    return make_json_error(f"Unknown metric: {metric}. Expected one of {', '.join(METRIC_COLUMNS.keys())}")
+
+  with request_phase("csv"):
+    district_store.refresh_if_stale()
+
+  cache_key = (
+    district_store.version,
+    start_year,
+    end_year,
+    country.lower() if country else None,
+    district.lower() if district else None,
+    metric
+  )
 
-    if math.isnan(cchf_deaths_row_val) is False:
-      num_of_cchf_deaths = cchf_deaths_row_val
+  def build_payload():
+    records = district_store.query(
+      start_year = start_year,
+      end_year = end_year,
+      country = country,
+      district = district
+    )
+
+    if metric is not None:
+      records = [
+        {**record, "metrics" : {metric : record["metrics"][metric]}} for record in records
+      ]
+
+    return {
+      "start_year" : start_year,
+      "end_year" : end_year,
+      "country" : district_store.canonical_name(country),
+      "district" : district_store.canonical_name(district),
+      "metric" : metric,
+      "count" : len(records),
+      "districts" : records
+    }
+
+  with request_phase("payload"):
+    entry = api_response_cache.get_or_build(cache_key, build_payload)
+
+  return make_json_response(entry, request)
+
+@app.route('/explore')
+def explore():
+  """
+  Purpose: The client side map. The page loads the district geometry and the
+  metrics bundle once and restyles the map in the browser when the year changes
+  """
+  return render_template("explore.html")
+
+@app.route('/api/bundle')
+def api_bundle():
+  with request_phase("csv"):
+    district_store.refresh_if_stale()
+
+  entry = api_response_cache.get_or_build(
+    (district_store.version, "bundle"),
+    district_store.build_bundle
+  )
+  return make_json_response(entry, request)
+
+@app.route('/api/geometry')
+def api_geometry():
+  # The geometry never changes while the app is running so it lives in its own cache
+  entry = geometry_response_cache.get_or_build(
+    "districts",
+    lambda: district_geometry
+  )
+  return make_json_response(entry, request)
 
-    if math.isnan(surface_temp_row_val) is False:
-      surface_temperature = surface_temp_row_val
+@app.route('/api/years')
+def api_years():
+  with request_phase("csv"):
+    district_store.refresh_if_stale()
 
-    if math.isnan(precip_row_val) is False:
-      precipitation = precip_row_val
+  entry = api_response_cache.get_or_build(
+    (district_store.version, "years"),
+    lambda: {"years" : district_store.years, "metrics" : list(METRIC_COLUMNS.keys())}
+  )
+  return make_json_response(entry, request)
+
+@app.route('/api/datacube')
+def api_datacube():
+  """
+  Purpose: Read-only JSON view of a variable of the district datacube for every
+  district, sliced straight out of the memory mapped cube. Supports the following
+  query parameters:
+
+    variable - The datacube variable (required)
+    year - The year (required)
+    month - The month (1-12), the yearly value (sum or mean of the months) when left out
+
+  Output: A (possibly gzipped) JSON response with an ETag
+  """
+  if district_datacube.exists() is False:
+    return make_json_error("There is no datacube yet, run the fetchers to build it", status=404)
+
+  variable = request.args.get("variable")
+  try:
+    year = parse_optional_int(request.args.get("year"))
+    month = parse_optional_int(request.args.get("month"))
+  except ValueError:
+    return make_json_error("year and month must be integers")
+
+  metadata, cube = district_datacube.open()
+  if variable not in metadata["variables"]:
+    return make_json_error(f"Unknown variable: {variable}. Expected one of {', '.join(metadata['variables'])}")
+
+  years = district_datacube.years()
+  if year is None or year not in years:
+    return make_json_error(f"year must be between {years[0]} and {years[-1]}")
+
+  if month is not None and (month < 1 or month > 12):
+    return make_json_error("month must be between 1 and 12")
+
+  def build_payload():
+    if month is None:
+      values = district_datacube.year_values(variable, year)
+    else:
+      values = district_datacube.month_values(variable, year, month)
+
+    district_ids = np.nonzero(~np.isnan(values))[0]
+    registry_df = district_id_registry.load().set_index(DISTRICT_ID_COL)
+    names = registry_df.reindex(district_ids)
+
+    return {
+      "variable" : variable,
+      "year" : year,
+      "month" : month,
+      "count" : len(district_ids),
+      "district_ids" : district_ids.tolist(),
+      "countries" : names[COUNTRY_COL].tolist(),
+      "districts" : names[DISTRICT_COL].tolist(),
+      "values" : values[district_ids].tolist()
+    }
+
+  with request_phase("payload"):
+    entry = api_response_cache.get_or_build((district_datacube.version, "datacube", variable, year, month), build_payload)
+
+  return make_json_response(entry, request)
+
+@app.route('/api/spatial')
+def api_spatial():
+  """
+  Purpose: Spatial autocorrelation of a variable of the district datacube in a year:
+  global Moran's I and the local Moran's I and Getis-Ord Gi* hot spots of every
+  district with geometry (see common/spatial_statistics.py). Supports the following
+  query parameters:
+
+    variable - The datacube variable (defaults to cases)
+    year - The year (required)
+    contiguity - queen (the default) or rook neighbours
+
+  Output: A (possibly gzipped) JSON response with an ETag
+  """
+  if district_datacube.exists() is False:
+    return make_json_error("There is no datacube yet, run the fetchers to build it", status=404)
+
+  variable = request.args.get("variable", "cases")
+  contiguity = request.args.get("contiguity", QUEEN)
+  try:
+    year = parse_optional_int(request.args.get("year"))
+  except ValueError:
+    return make_json_error("year must be an integer")
+
+  metadata, cube = district_datacube.open()
+  if variable not in metadata["variables"]:
+    return make_json_error(f"Unknown variable: {variable}. Expected one of {', '.join(metadata['variables'])}")
+
+  years = district_datacube.years()
+  if year is None or year not in years:
+    return make_json_error(f"year must be between {years[0]} and {years[-1]}")
+
+  if contiguity not in CONTIGUITIES:
+    return make_json_error(f"Unknown contiguity: {contiguity}. Expected one of {', '.join(CONTIGUITIES)}")
+
+  with request_phase("weights"):
+    weights = spatial_weights.load(contiguity)
+
+  def build_payload():
+    global_stats, local_df = spatial_autocorrelation(
+      values = district_metric_values(variable, year, weights["district_ids"]),
+      district_ids = weights["district_ids"],
+      weights = weights["matrix"]
+    )
+
+    registry_df = district_id_registry.load().set_index(DISTRICT_ID_COL)
+    names = registry_df.reindex(local_df[DISTRICT_ID_COL].values)
+
+    return {
+      "variable" : variable,
+      "year" : year,
+      "contiguity" : contiguity,
+      "global" : {key : to_json_number(val) if isinstance(val, float) else val for key, val in global_stats.items()},
+      "count" : local_df.shape[0],
+      "district_ids" : local_df[DISTRICT_ID_COL].tolist(),
+      "countries" : names[COUNTRY_COL].tolist(),
+      "districts" : names[DISTRICT_COL].tolist(),
+      "values" : [to_json_number(val) for val in local_df[VALUE_COL]],
+      "num_neighbours" : local_df[NUM_NEIGHBOURS_COL].tolist(),
+      "local_i" : [to_json_number(val) for val in local_df[LOCAL_I_COL]],
+      "gi_star_z" : [to_json_number(val) for val in local_df[GI_STAR_COL]],
+      "p_values" : [to_json_number(val) for val in local_df[P_VALUE_COL]],
+      "clusters" : local_df[CLUSTER_COL].tolist(),
+      "hotspots" : local_df[HOTSPOT_COL].tolist()
+    }
+
+  with request_phase("payload"):
+    entry = api_response_cache.get_or_build((district_datacube.version, weights["version"], "spatial", variable, year, contiguity), build_payload)
+
+  return make_json_response(entry, request)
+
+@app.route('/metrics')
+def metrics():
+  """
+  Purpose: The request latencies, phase latencies and cache hit ratios of this
+  worker in the Prometheus text format
+  """
+  return Response(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+def parse_optional_int(val):
+  if val is None or val == "":
+    return None
+  return int(val)
+
+def create_info_markers(year: int, folium_map: folium.Map, index: DistrictMarkerIndex = None, mode: str = MARKER_MODE):
+  """
+  Purpose: Adds a marker for every known district to the map. Districts with
+  data for the year get a blue marker with the data in its popup while the
+  rest get a gray one. The markers are precomputed by the marker index so this
+  is a single linear pass.
+
+  Input: year - The year selected
+         folium_map - The map to add the markers to
+         index - The marker index (defaults to the app's index)
+         mode - One of MARKER_MODES. "individual" adds a folium marker per district,
+                "clustered" embeds every marker in a single array rendered by a
+                marker cluster in the browser and "auto" picks clustered once there
+                are more than MARKER_CLUSTER_THRESHOLD markers
+
+  Output: None
+  """
+  if index is None:
+    index = marker_index
+
+  if mode not in MARKER_MODES:
+    raise ValueError(f"Unknown marker mode: {mode}. Expected one of {', '.join(MARKER_MODES)}")
+
+  if mode == "clustered" or (mode == "auto" and len(index.marker_rows_for_year(year)) > MARKER_CLUSTER_THRESHOLD):
+    create_clustered_info_markers(
+      year = year,
+      folium_map = folium_map,
+      index = index
+    )
+    return
 
-    if math.isnan(nvdi_row_val) is False:
-      nvdi = nvdi_row_val
+  for coordinates, info_message in index.markers_for_year(year):
 
-    
-    info_message = f"""Total Number of CCHF Cases: {num_of_cchf_cases} <br>
-                       Total Number of CCHF Deaths: {num_of_cchf_deaths} <br>
-                       Avg Surface Temp: {surface_temperature} K<br>
-                       Avg Precipitation: {precipitation} kg m-2 s-1<br>
-                       Avg NVDI Value: {nvdi} <br>
-                    """ 
+    # In case a user decides to select a year we dont have data for
+    if info_message is None:
+      folium.Marker(
+        location = coordinates,
+        popup = NO_DATA_MESSAGE,
+        icon = folium.Icon(color='gray')
+      ).add_to(folium_map)
+      continue
 
     folium.Marker(location = coordinates,
                      popup = folium.Popup(info_message, max_width=250,min_width=250),
                      icon = folium.Icon(color='blue')
                  ).add_to(folium_map)
 
-def create_district_coords_map(filepath: str = CCHF_DISTRICT_DATA):
-  
-  cchf_df = pd.read_csv(filepath)
-
-  district_coords_df = cchf_df[[DISTRICT_COL, DISTRICT_LAT_COL, DISTRICT_LON_COL]]
-
-  district_coords_map = {}
-  for idx, row in district_coords_df.iterrows():
-    district = row[DISTRICT_COL]
-    district_lat = row[DISTRICT_LAT_COL]
-    district_lon = row[DISTRICT_LON_COL]
-
-    if district not in district_coords_map and math.isnan(district_lat) is False and math.isnan(district_lon) is False:
-      district_coords_map[district] = {
-        DISTRICT_LAT_COL : district_lat,
-        DISTRICT_LON_COL : district_lon
-      }
+def create_clustered_info_markers(year: int, folium_map: folium.Map, index: DistrictMarkerIndex):
+  """
+  Purpose: Adds every marker of the year to the map as a single compact data
+  array rendered by a marker cluster. The markers and their popups are created
+  in the browser, the popups only once a marker is clicked.
+
+  Input: year - The year selected
+         folium_map - The map to add the markers to
+         index - The marker index
+
+  Output: None
+  """
+  FastMarkerCluster(
+    data = index.marker_rows_for_year(year),
+    callback = CLUSTERED_MARKER_CALLBACK,
+    name = "CCHF District Information"
+  ).add_to(folium_map)
 
-  return district_coords_map
+warm_up_map_render_cache()
 
 if __name__ == '__main__':
     app.run(debug=False)
\ No newline at end of file
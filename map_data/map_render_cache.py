@@ -0,0 +1,150 @@
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+WARM_UP_WORKERS = 2
+
+# The number of maps rendered on demand (outside of the warm-up) kept on top of the warm-up's
+MAX_ON_DEMAND_ENTRIES = 32
+
+"""
+Notes:
+
+Building and rendering the folium map of a year takes a few hundred milliseconds, most
+of it spent rendering the html. The render cache holds the html of every (version, year,
+marker mode) rendered so far, where the version is the marker index's version so a
+change to the csvs is never served stale. Every key is a tuple starting with the version.
+
+At startup the app hands the cache the keys of every year in the combined data and they
+are rendered in the background by a small thread pool. A request for a key which is
+still being rendered waits for that render rather than starting another one, and a
+request for a key which isn't cached (another marker mode, a year we have no data for)
+renders it in the request's own thread.
+"""
+
+class MapRenderCache:
+  """
+  Purpose: Caches the rendered html of the maps and pre-renders them in the background
+
+  Input: render - A callable rendering the html of a key
+         max_workers - The number of background rendering threads
+  """
+
+  def __init__(self, render, max_workers: int = WARM_UP_WORKERS):
+    self.render = render
+    self.lock = threading.Lock()
+    self.entries = {}
+    self.pending = {}
+    self.failures = {}
+    self.warm_up_keys = []
+    self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="map-warm-up")
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key) -> str:
+    """
+    Purpose: Retrieves the html of a key, rendering it (or waiting for the background
+    render of it) on a miss
+
+    Input: key - The key of the map
+
+    Output: The rendered html
+    """
+    with self.lock:
+      html = self.entries.get(key)
+      if html is not None:
+        self.hits += 1
+        return html
+
+      self.misses += 1
+      future = self.pending.get(key)
+      owner = future is None
+      if owner:
+        future = Future()
+        self.pending[key] = future
+
+    if owner:
+      self.build(key, future)
+
+    return future.result()
+
+  def warm_up(self, version, keys: list) -> None:
+    """
+    Purpose: Renders the keys in the background, dropping the cached maps of every
+    older version
+
+    Input: version - The version of the keys
+           keys - The keys to render
+
+    Output: None
+    """
+    with self.lock:
+      self.warm_up_keys = list(keys)
+      self.entries = {key : html for key, html in self.entries.items() if key[0] == version}
+      self.failures = {}
+
+      for key in self.warm_up_keys:
+        if key in self.entries or key in self.pending:
+          continue
+        future = Future()
+        self.pending[key] = future
+        self.executor.submit(self.build, key, future)
+
+  def build(self, key, future: Future) -> None:
+    try:
+      html = self.render(key)
+    except Exception as err:
+      with self.lock:
+        self.pending.pop(key, None)
+        self.failures[key] = f"{type(err).__name__}: {err}"
+      future.set_exception(err)
+      return
+
+    with self.lock:
+      self.entries[key] = html
+      self.pending.pop(key, None)
+      self.evict_on_demand_entries()
+    future.set_result(html)
+
+  def evict_on_demand_entries(self) -> None:
+    warm_up_keys = set(self.warm_up_keys)
+    on_demand_keys = [key for key in self.entries if key not in warm_up_keys]
+    # The entries are in insertion order so the oldest are evicted first
+    for key in on_demand_keys[:max(0, len(on_demand_keys) - MAX_ON_DEMAND_ENTRIES)]:
+      del self.entries[key]
+
+  def status(self) -> dict:
+    """
+    Purpose: Reports the progress of the warm-up
+
+    Input: None
+
+    Output: A dictionary of whether every key has been rendered (or failed to),
+    the number of keys rendered, failed and in total and the failures
+    """
+    with self.lock:
+      rendered = sum(1 for key in self.warm_up_keys if key in self.entries)
+      failed = sum(1 for key in self.warm_up_keys if key in self.failures)
+      total = len(self.warm_up_keys)
+      return {
+        "ready" : rendered + failed >= total,
+        "rendered" : rendered,
+        "failed" : failed,
+        "total" : total,
+        "failures" : {str(key) : failure for key, failure in self.failures.items()}
+      }
+
+  def wait_until_warm(self, timeout: float = None) -> bool:
+    """
+    Purpose: Blocks until every key of the warm-up has been rendered (or failed to)
+
+    Input: timeout - The maximum number of seconds to wait (None to wait forever)
+
+    Output: Whether the warm-up finished in time
+    """
+    with self.lock:
+      futures = [self.pending[key] for key in self.warm_up_keys if key in self.pending]
+
+    done, not_done = wait(futures, timeout=timeout)
+
+    return len(not_done) <= 0
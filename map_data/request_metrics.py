@@ -0,0 +1,246 @@
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+
+# The upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+UNMATCHED_ROUTE = "unmatched"
+
+"""
+Notes:
+
+Every request is timed from before_request to after_request and its handler can time
+its phases (reading the csvs, building the choropleth, adding the markers, saving the
+map, rendering the template, ...) with request_phase(). The phases and the total are
+returned to the browser in the Server-Timing header (visible in the network tab of the
+developer tools) and recorded in the histograms served by /metrics in the Prometheus
+text format, along with the hit ratio of every cache registered with the registry.
+"""
+
+class Histogram:
+  """
+  Purpose: A cumulative Prometheus style histogram
+
+  Input: buckets - The upper bounds of the buckets
+  """
+
+  def __init__(self, buckets: list = LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.total = 0
+    self.count = 0
+
+  def observe(self, val: float) -> None:
+    idx = bisect.bisect_left(self.buckets, val)
+    if idx < len(self.counts):
+      self.counts[idx] += 1
+    self.total += val
+    self.count += 1
+
+  def cumulative_counts(self) -> list:
+    cumulative = []
+    running = 0
+    for count in self.counts:
+      running += count
+      cumulative.append(running)
+    return cumulative
+
+class MetricsRegistry:
+  """
+  Purpose: Collects the request latencies, phase latencies and cache statistics of
+  the app and renders them in the Prometheus text format
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.request_counts = {}
+    self.request_latencies = {}
+    self.phase_latencies = {}
+    self.caches = {}
+
+  def observe_request(self, route: str, method: str, status: int, duration: float, phases: list) -> None:
+    """
+    Purpose: Records a finished request
+
+    Input: route - The url rule of the request (UNMATCHED_ROUTE when none matched)
+           method - The HTTP method
+           status - The status code of the response
+           duration - The time taken in seconds
+           phases - A list of (phase, duration in seconds) tuples
+
+    Output: None
+    """
+    with self.lock:
+      count_key = (route, method, str(status))
+      self.request_counts[count_key] = self.request_counts.get(count_key, 0) + 1
+
+      latency_key = (route, method)
+      if latency_key not in self.request_latencies:
+        self.request_latencies[latency_key] = Histogram()
+      self.request_latencies[latency_key].observe(duration)
+
+      for phase, phase_duration in phases:
+        phase_key = (route, phase)
+        if phase_key not in self.phase_latencies:
+          self.phase_latencies[phase_key] = Histogram()
+        self.phase_latencies[phase_key].observe(phase_duration)
+
+  def register_cache(self, name: str, cache) -> None:
+    """
+    Purpose: Reports the hit ratio of a cache. The cache only needs hits and
+    misses attributes
+
+    Input: name - The name of the cache in the metrics
+           cache - The cache
+
+    Output: None
+    """
+    with self.lock:
+      self.caches[name] = cache
+
+  def render(self) -> str:
+    """
+    Purpose: Renders every metric in the Prometheus text exposition format
+
+    Input: None
+
+    Output: The metrics
+    """
+    lines = []
+
+    with self.lock:
+      lines.append("# HELP map_requests_total The number of requests handled")
+      lines.append("# TYPE map_requests_total counter")
+      for (route, method, status), count in sorted(self.request_counts.items()):
+        lines.append(f"map_requests_total{format_labels(route=route, method=method, status=status)} {count}")
+
+      lines.append("# HELP map_request_duration_seconds The time taken to handle a request")
+      lines.append("# TYPE map_request_duration_seconds histogram")
+      for (route, method), histogram in sorted(self.request_latencies.items()):
+        lines.extend(render_histogram("map_request_duration_seconds", histogram, route=route, method=method))
+
+      lines.append("# HELP map_request_phase_duration_seconds The time taken by each phase of a request")
+      lines.append("# TYPE map_request_phase_duration_seconds histogram")
+      for (route, phase), histogram in sorted(self.phase_latencies.items()):
+        lines.extend(render_histogram("map_request_phase_duration_seconds", histogram, route=route, phase=phase))
+
+      caches = sorted(self.caches.items())
+
+    lines.append("# HELP map_cache_hits_total The number of cache lookups answered from the cache")
+    lines.append("# TYPE map_cache_hits_total counter")
+    for name, cache in caches:
+      lines.append(f"map_cache_hits_total{format_labels(cache=name)} {cache.hits}")
+
+    lines.append("# HELP map_cache_misses_total The number of cache lookups which had to build the entry")
+    lines.append("# TYPE map_cache_misses_total counter")
+    for name, cache in caches:
+      lines.append(f"map_cache_misses_total{format_labels(cache=name)} {cache.misses}")
+
+    lines.append("# HELP map_cache_hit_ratio The fraction of cache lookups answered from the cache")
+    lines.append("# TYPE map_cache_hit_ratio gauge")
+    for name, cache in caches:
+      lookups = cache.hits + cache.misses
+      hit_ratio = cache.hits / lookups if lookups > 0 else 0
+      lines.append(f"map_cache_hit_ratio{format_labels(cache=name)} {hit_ratio}")
+
+    return "\n".join(lines) + "\n"
+
+class RequestTimer:
+  """
+  Purpose: The start time and the phases of the request being handled
+  """
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.phases = []
+
+  def server_timing(self, duration: float) -> str:
+    """
+    Purpose: Formats the phases and the total duration as a Server-Timing header
+
+    Input: duration - The total duration of the request in seconds
+
+    Output: The header value
+    """
+    entries = [f"{phase};dur={phase_duration*1000:.2f}" for phase, phase_duration in self.phases]
+    entries.append(f"total;dur={duration*1000:.2f}")
+    return ", ".join(entries)
+
+@contextmanager
+def request_phase(name: str):
+  """
+  Purpose: Times a phase of the request being handled. Does nothing outside of a
+  request (e.g. when the handlers are called from a benchmark)
+
+  Input: name - The name of the phase (a Server-Timing metric name so no spaces)
+
+  Output: None
+  """
+  timer = g.get("request_timer") if has_request_context() else None
+  if timer is None:
+    yield
+    return
+
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    timer.phases.append((name, time.perf_counter() - start))
+
+def init_request_metrics(app, registry: MetricsRegistry) -> None:
+  """
+  Purpose: Times every request of the app, adding the Server-Timing header to its
+  response and recording it in the registry
+
+  Input: app - The flask app
+         registry - The metrics registry
+
+  Output: None
+  """
+  @app.before_request
+  def start_request_timer():
+    g.request_timer = RequestTimer()
+
+  @app.after_request
+  def finish_request_timer(response):
+    timer = g.get("request_timer")
+    if timer is None:
+      return response
+
+    duration = time.perf_counter() - timer.start
+    response.headers["Server-Timing"] = timer.server_timing(duration)
+
+    route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+    registry.observe_request(
+      route = route,
+      method = request.method,
+      status = response.status_code,
+      duration = duration,
+      phases = timer.phases
+    )
+
+    return response
+
+def render_histogram(name: str, histogram: Histogram, **labels) -> list:
+  lines = []
+  for upper_bound, count in zip(histogram.buckets, histogram.cumulative_counts()):
+    lines.append(f"{name}_bucket{format_labels(**labels, le=format_bound(upper_bound))} {count}")
+  lines.append(f"{name}_bucket{format_labels(**labels, le='+Inf')} {histogram.count}")
+  lines.append(f"{name}_sum{format_labels(**labels)} {histogram.total}")
+  lines.append(f"{name}_count{format_labels(**labels)} {histogram.count}")
+  return lines
+
+def format_labels(**labels) -> str:
+  return "{" + ",".join(f"{key}=\"{escape_label_value(val)}\"" for key, val in labels.items()) + "}"
+
+def escape_label_value(val) -> str:
+  return str(val).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_bound(upper_bound: float) -> str:
+  return repr(float(upper_bound))